@@ -0,0 +1,7 @@
+"""
+Benchmarks of the single-cell ligand-receptor pipeline.
+
+The benchmarks follow the `asv <https://asv.readthedocs.io>`_ conventions (``time_*``, ``peakmem_*`` & ``track_*``),
+and can be run with ``asv run``. A per-stage breakdown can also be printed without asv, e.g.
+``python -m benchmarks.bench_sc_methods --n_obs 10000 --n_labels 20``.
+"""
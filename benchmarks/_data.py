@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import anndata as an
+from scipy.sparse import csr_matrix
+
+from liana.resource import select_resource
+
+
+def generate_lr_anndata(n_obs=10000, n_vars=2000, n_labels=10, n_samples=1,
+                        density=0.1, resource_name='consensus', seed=1337):
+    """
+    Generate a log-normalized sparse AnnData, with resource genes as the first variables.
+
+    Parameters
+    ----------
+    n_obs
+        Number of cells.
+    n_vars
+        Number of genes. The resource genes are used first, and the rest are filled with dummy genes.
+    n_labels
+        Number of cell identities, stored in ``adata.obs['label']``.
+    n_samples
+        Number of samples, stored in ``adata.obs['sample']``.
+    density
+        Expected proportion of non-zero values.
+    resource_name
+        Resource from which the gene names are taken.
+    seed
+        Random seed.
+
+    Returns
+    -------
+    An AnnData object with a CSR `X`.
+    """
+    rng = np.random.default_rng(seed)
+
+    resource = select_resource(resource_name)
+    genes = np.union1d(resource['ligand'].str.split('_').explode(),
+                       resource['receptor'].str.split('_').explode())
+    genes = rng.permutation(genes)[:n_vars]
+    genes = np.append(genes, [f'Gene{i:d}' for i in range(n_vars - genes.shape[0])])
+
+    # non-zero values per cell, and their (possibly duplicated) positions
+    nnz = rng.binomial(n_vars, density, size=n_obs)
+    indptr = np.append(0, np.cumsum(nnz))
+    indices = rng.integers(0, n_vars, size=indptr[-1])
+    data = np.log1p(rng.poisson(5, size=indptr[-1]) + 1).astype(np.float32)
+    X = csr_matrix((data, indices, indptr), shape=(n_obs, n_vars))
+    X.sum_duplicates()
+
+    obs = pd.DataFrame({'label': pd.Categorical([f'L{i:d}' for i in rng.integers(0, n_labels, size=n_obs)]),
+                        'sample': pd.Categorical([f'S{i:d}' for i in rng.integers(0, n_samples, size=n_obs)])},
+                       index=[f'Cell{i:d}' for i in range(n_obs)])
+
+    return an.AnnData(X=X, obs=obs, var=pd.DataFrame(index=genes))
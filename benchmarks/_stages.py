@@ -0,0 +1,79 @@
+"""
+Per-stage timings of the single-cell pipeline.
+
+The functions of each stage are temporarily wrapped with timers,
+so that the pipeline itself remains unchanged. The time of nested stages
+is excluded from their parent, e.g. `join` is not counted towards `stats`.
+"""
+from contextlib import contextmanager
+from importlib import import_module
+from time import perf_counter
+
+# stage name -> functions (module, attribute) that belong to it
+STAGES = {
+    'prep': [('liana.method.sc._liana_pipe', 'prep_check_adata')],
+    'resource': [('liana.method.sc._liana_pipe', '_handle_resource'),
+                 ('liana.method.sc._liana_pipe', 'filter_resource')],
+    'stats': [('liana.method.sc._liana_pipe', '_get_lr')],
+    'join': [('liana.method.sc._liana_pipe', '_join_lr_stats')],
+    'reassembly': [('liana.method.sc._liana_pipe', 'filter_reassemble_complexes')],
+    'permutations': [('liana.method._pipe_utils._get_mean_perms', '_permute_and_aggregate')],
+    'aggregation': [('liana.method.sc._liana_pipe', '_aggregate')],
+}
+
+
+class StageTimer:
+    """Accumulates the exclusive time spent in each stage."""
+
+    def __init__(self):
+        self.timings = {stage: 0. for stage in STAGES}
+        self.timings['other'] = 0.
+        self._stack = []
+
+    def wrap(self, stage, fun):
+        def wrapped(*args, **kwargs):
+            self._stack.append(0.)
+            start = perf_counter()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                nested = self._stack.pop()
+                self.timings[stage] += elapsed - nested
+                if self._stack:
+                    self._stack[-1] += elapsed
+        return wrapped
+
+    @contextmanager
+    def patch(self):
+        originals = []
+        for stage, funs in STAGES.items():
+            for module_name, attr in funs:
+                module = import_module(module_name)
+                originals.append((module, attr, getattr(module, attr)))
+                setattr(module, attr, self.wrap(stage, getattr(module, attr)))
+        try:
+            yield self
+        finally:
+            for module, attr, fun in reversed(originals):
+                setattr(module, attr, fun)
+
+
+def profile_stages(fun, *args, **kwargs) -> dict:
+    """
+    Time each stage of a call to `fun`.
+
+    Returns
+    -------
+    A dictionary with the seconds spent in each stage, `other` (e.g. scoring), and `total`.
+    """
+    timer = StageTimer()
+    with timer.patch():
+        start = perf_counter()
+        fun(*args, **kwargs)
+        total = perf_counter() - start
+
+    timer.timings['other'] = total - sum(timer.timings.values())
+    timer.timings['total'] = total
+
+    return timer.timings
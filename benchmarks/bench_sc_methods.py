@@ -0,0 +1,151 @@
+"""
+Benchmarks of the single-cell methods, scaling cells, genes, labels & permutations.
+"""
+import argparse
+
+from liana.method import rank_aggregate, cellphonedb, cellchat, natmi
+
+from ._data import generate_lr_anndata
+from ._stages import STAGES, profile_stages
+
+METHODS = {'rank_aggregate': rank_aggregate,
+           'cellphonedb': cellphonedb,
+           'cellchat': cellchat,
+           'natmi': natmi}
+
+N_PERMS = 100
+
+_datasets = {}
+
+
+def _get_adata(n_obs=10000, n_vars=2000, n_labels=10, n_samples=1):
+    # cache within the process, as asv calls setup for each repeat
+    key = (n_obs, n_vars, n_labels, n_samples)
+    if key not in _datasets:
+        _datasets.clear()
+        _datasets[key] = generate_lr_anndata(n_obs=n_obs, n_vars=n_vars,
+                                             n_labels=n_labels, n_samples=n_samples)
+    return _datasets[key]
+
+
+def _run(method, adata, n_perms=N_PERMS):
+    n_perms = n_perms if METHODS[method].permute or method == 'rank_aggregate' else None
+    return METHODS[method](adata, groupby='label', use_raw=False, n_perms=n_perms,
+                           inplace=False, verbose=False)
+
+
+class ScaleCells:
+    params = (list(METHODS), [10_000, 100_000, 1_000_000])
+    param_names = ['method', 'n_obs']
+    timeout = 3600
+
+    def setup(self, method, n_obs):
+        self.adata = _get_adata(n_obs=n_obs)
+
+    def time_method(self, method, n_obs):
+        _run(method, self.adata)
+
+    def peakmem_method(self, method, n_obs):
+        _run(method, self.adata)
+
+
+class ScaleGenes:
+    params = (list(METHODS), [2_000, 10_000, 30_000])
+    param_names = ['method', 'n_vars']
+    timeout = 3600
+
+    def setup(self, method, n_vars):
+        self.adata = _get_adata(n_vars=n_vars)
+
+    def time_method(self, method, n_vars):
+        _run(method, self.adata)
+
+    def peakmem_method(self, method, n_vars):
+        _run(method, self.adata)
+
+
+class ScaleLabels:
+    params = (list(METHODS), [5, 20, 50, 200])
+    param_names = ['method', 'n_labels']
+    timeout = 3600
+
+    def setup(self, method, n_labels):
+        self.adata = _get_adata(n_labels=n_labels)
+
+    def time_method(self, method, n_labels):
+        _run(method, self.adata)
+
+    def peakmem_method(self, method, n_labels):
+        _run(method, self.adata)
+
+
+class ScalePerms:
+    params = (['rank_aggregate', 'cellphonedb', 'cellchat'], [100, 1000, 5000])
+    param_names = ['method', 'n_perms']
+    timeout = 3600
+
+    def setup(self, method, n_perms):
+        self.adata = _get_adata()
+
+    def time_method(self, method, n_perms):
+        _run(method, self.adata, n_perms=n_perms)
+
+    def peakmem_method(self, method, n_perms):
+        _run(method, self.adata, n_perms=n_perms)
+
+
+class BySample:
+    params = (['rank_aggregate', 'cellphonedb'], [4, 20, 200], [1, 4])
+    param_names = ['method', 'n_samples', 'n_jobs']
+    timeout = 3600
+
+    def setup(self, method, n_samples, n_jobs):
+        self.adata = _get_adata(n_obs=n_samples * 2000, n_samples=n_samples)
+
+    def time_by_sample(self, method, n_samples, n_jobs):
+        METHODS[method].by_sample(self.adata, sample_key='sample', groupby='label', use_raw=False,
+                                  n_perms=N_PERMS, n_jobs=n_jobs, inplace=False, verbose=False)
+
+    def peakmem_by_sample(self, method, n_samples, n_jobs):
+        METHODS[method].by_sample(self.adata, sample_key='sample', groupby='label', use_raw=False,
+                                  n_perms=N_PERMS, n_jobs=n_jobs, inplace=False, verbose=False)
+
+
+class Stages:
+    """Seconds spent in each stage of the pipeline, to localize regressions."""
+    params = (list(METHODS), [10_000, 100_000], [10, 50], list(STAGES) + ['other', 'total'])
+    param_names = ['method', 'n_obs', 'n_labels', 'stage']
+    unit = 'seconds'
+    timeout = 3600
+
+    _timings = {}
+
+    def setup(self, method, n_obs, n_labels, stage):
+        key = (method, n_obs, n_labels)
+        if key not in self._timings:
+            adata = _get_adata(n_obs=n_obs, n_labels=n_labels)
+            self._timings[key] = profile_stages(_run, method, adata)
+
+    def track_stage(self, method, n_obs, n_labels, stage):
+        return self._timings[(method, n_obs, n_labels)][stage]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-stage timings of the single-cell methods.')
+    parser.add_argument('--methods', nargs='+', default=list(METHODS), choices=list(METHODS))
+    parser.add_argument('--n_obs', type=int, default=10000)
+    parser.add_argument('--n_vars', type=int, default=2000)
+    parser.add_argument('--n_labels', type=int, default=10)
+    parser.add_argument('--n_perms', type=int, default=N_PERMS)
+    args = parser.parse_args()
+
+    adata = _get_adata(n_obs=args.n_obs, n_vars=args.n_vars, n_labels=args.n_labels)
+    stages = list(STAGES) + ['other', 'total']
+    print('method'.ljust(16) + ''.join(stage.rjust(14) for stage in stages))
+    for method in args.methods:
+        timings = profile_stages(_run, method, adata, n_perms=args.n_perms)
+        print(method.ljust(16) + ''.join(f'{timings[stage]:14.3f}' for stage in stages))
+
+
+if __name__ == '__main__':
+    main()
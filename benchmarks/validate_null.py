@@ -0,0 +1,95 @@
+"""
+Agreement between the analytic and the permutation null p-values.
+
+Each method is run with `null_distribution='permutation'` and `null_distribution='analytic'`,
+and the p-values of the same interactions are compared.
+"""
+import argparse
+from time import perf_counter
+
+import numpy as np
+from scipy.stats import spearmanr
+
+from liana.method import cellphonedb, cellchat, geometric_mean
+
+from ._data import generate_lr_anndata
+
+METHODS = {'cellphonedb': (cellphonedb, 'cellphone_pvals'),
+           'geometric_mean': (geometric_mean, 'gmean_pvals'),
+           'cellchat': (cellchat, 'cellchat_pvals')}
+
+KEY_COLS = ['source', 'target', 'ligand_complex', 'receptor_complex']
+ALPHAS = [0.01, 0.05, 0.1]
+
+
+def compare_nulls(method, adata, n_perms=1000, groupby='label', use_raw=False, **kwargs) -> dict:
+    """
+    Compare the p-values of a method under the permutation and the analytic null.
+
+    Returns
+    -------
+    A dictionary with the Spearman correlation, the mean & max absolute difference,
+    the proportion of interactions with the same call at each of `ALPHAS`,
+    and the seconds spent by each null.
+    """
+    fun, pval_col = METHODS[method]
+
+    results, times = {}, {}
+    for null_distribution in ['permutation', 'analytic']:
+        start = perf_counter()
+        results[null_distribution] = fun(adata, groupby=groupby, use_raw=use_raw, n_perms=n_perms,
+                                         null_distribution=null_distribution, inplace=False,
+                                         **kwargs)
+        times[null_distribution] = perf_counter() - start
+
+    merged = results['permutation'].merge(results['analytic'], on=KEY_COLS,
+                                          suffixes=('_perm', '_analytic'))
+    perm = merged[f'{pval_col}_perm'].values
+    analytic = merged[f'{pval_col}_analytic'].values
+    diff = np.abs(perm - analytic)
+
+    summary = {'n': merged.shape[0],
+               'spearman': spearmanr(perm, analytic)[0],
+               'mean_abs_diff': diff.mean(),
+               'max_abs_diff': diff.max()}
+    for alpha in ALPHAS:
+        summary[f'agreement_{alpha}'] = ((perm < alpha) == (analytic < alpha)).mean()
+    summary['time_permutation'] = times['permutation']
+    summary['time_analytic'] = times['analytic']
+
+    return summary
+
+
+class NullAgreement:
+    """Spearman correlation between the analytic and the permutation p-values."""
+    params = (list(METHODS), [10_000])
+    param_names = ['method', 'n_obs']
+    unit = 'rho'
+    timeout = 3600
+
+    def setup(self, method, n_obs):
+        self.adata = generate_lr_anndata(n_obs=n_obs)
+
+    def track_spearman(self, method, n_obs):
+        return compare_nulls(method, self.adata)['spearman']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analytic vs permutation null p-values.')
+    parser.add_argument('--methods', nargs='+', default=list(METHODS), choices=list(METHODS))
+    parser.add_argument('--n_obs', type=int, default=10000)
+    parser.add_argument('--n_vars', type=int, default=2000)
+    parser.add_argument('--n_labels', type=int, default=10)
+    parser.add_argument('--n_perms', type=int, default=1000)
+    args = parser.parse_args()
+
+    adata = generate_lr_anndata(n_obs=args.n_obs, n_vars=args.n_vars, n_labels=args.n_labels)
+    for method in args.methods:
+        summary = compare_nulls(method, adata, n_perms=args.n_perms)
+        print(method)
+        for key, value in summary.items():
+            print(f'  {key.ljust(18)}{value:.4g}')
+
+
+if __name__ == '__main__':
+    main()
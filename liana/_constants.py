@@ -6,6 +6,9 @@ class DefaultValues():
     min_cells = 5
     expr_prop = 0.1
     n_perms = 1000
+    null_distribution = 'permutation'
+    early_stop = None
+    compact = False
     seed = 1337
     de_method = 't-test'
     resource_name = 'consensus'
@@ -15,6 +18,8 @@ class DefaultValues():
     use_raw = True
     verbose = False
     return_all_lrs = False
+    top_n = None
+    score_thresholds = None
     supp_columns = None
     inplace = True
     groupby_pairs = None
@@ -77,3 +82,6 @@ class InternalValues():
     lrs_to_keep = 'lrs_to_keep'
     prop_min = 'prop_min'
     label = '@label'
+    mat_stats = '@mat_stats'
+    label_moments = '@label_moments'
+    row_stats = '@row_stats'
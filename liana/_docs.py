@@ -93,6 +93,26 @@ n_perms
     Number of permutations for the permutation test. Relevant only for permutation-based methods
     (e.g., `CellPhoneDB`). If `None` is passed, no permutation testing is performed."""
 
+_null_distribution = """\
+null_distribution
+    How the null distribution of permutation-based methods is obtained. One of ['permutation', 'analytic'].
+    'analytic' approximates the permutation p-values in closed form, from the label sizes and the
+    moments of each gene across all cells, and is hence much faster but less accurate
+    for small p-values. Relevant only if `n_perms` is not None."""
+
+_early_stop = """\
+early_stop
+    If an integer, the permutations of an interaction are stopped once this many of its permuted scores
+    are >= its observed score (Besag & Clifford, 1991), with `n_perms` as the maximum.
+    Interactions that are far from significant are thus resolved within a few permutations.
+    If `None`, all `n_perms` permutations are run for all interactions."""
+
+_compact = """\
+compact
+    Whether to return compact results, i.e. with categorical source, target, ligand & receptor columns
+    and float32 scores. These take a fraction of the memory (and disk space, when written to h5ad)
+    of the default string columns. The categorical columns can be converted back to strings with `.astype(str)`."""
+
 _expr_prop = """\
 expr_prop
     Minimum expression proportion for the ligands and receptors (+ their subunits) in the
@@ -112,10 +132,25 @@ return_all_lrs
     threshold. Ligand-receptor pairs that do not pass the `expr_prop` threshold will be assigned
     to the *worst* score of the ones that do. `False` by default."""
 
+_top_n_sc = """\
+top_n
+    Number of top-ranked interactions to return, by the score by which the results are sorted.
+    The top interactions are selected (with `numpy.argpartition`) prior to sorting, so only these are sorted.
+    Ties at the cut-off are broken arbitrarily. If None, all interactions are returned."""
+
+_score_thresholds = """\
+score_thresholds
+    Dictionary with score names as keys (e.g. `{'specificity_rank': 0.05}`) and thresholds as values.
+    Only interactions with scores at least as good as the thresholds are returned, i.e. lower or equal for
+    ascending scores (e.g. p-values and ranks), and greater or equal otherwise. Applied prior to `top_n`.
+    If None, interactions are not filtered by their scores."""
+
 _de_method = """\
 de_method
-    Differential expression method. `scanpy.tl.rank_genes_groups` is used to rank genes
-    according to 1vsRest. The default method is 't-test'."""
+    Differential expression method, by which genes are ranked according to 1vsRest, as in
+    `scanpy.tl.rank_genes_groups`. 't-test', 't-test_overestim_var' and 'wilcoxon' are computed
+    natively, while any other method is passed to `scanpy.tl.rank_genes_groups`.
+    The default method is 't-test'."""
 
 _groupby_pairs = """\
 groupby_pairs
@@ -310,10 +345,15 @@ d = DocstringProcessor(
     lr_sep=_lr_sep,
     n_perms=_n_perms,
     n_perms_sc=_n_perms_sc,
+    null_distribution=_null_distribution,
+    early_stop=_early_stop,
+    compact=_compact,
     expr_prop=_expr_prop,
     min_cells=_min_cells,
     base=_base,
     return_all_lrs=_return_all_lrs,
+    top_n_sc=_top_n_sc,
+    score_thresholds=_score_thresholds,
     liana_res=_liana_res,
     de_method=_de_method,
     source_key=_source_key,
@@ -1,14 +1,20 @@
+from __future__ import annotations
+
+import numba as nb
 import numpy as np
 import pandas as pd
 from functools import reduce
-from scipy.stats import rankdata, beta
+from scipy.stats import rankdata
+
+_RRA_BLOCK_SIZE = 1024
 
 
 def _aggregate(lrs: dict,
                consensus,
                aggregate_method: str = 'rra',
                _consensus_opts: list = None,
-               _key_cols: list = None
+               _key_cols: list = None,
+               _sort: bool = True
                ) -> pd.DataFrame:
     """
 
@@ -26,6 +32,8 @@ def _aggregate(lrs: dict,
         while 'mean' is just the mean of the ranks divided by the number of interactions
     _consensus_opts
         consensus ranks to be obtained
+    _sort
+        whether to sort the interactions by the (last) consensus rank
 
     Returns
     -------
@@ -38,35 +46,68 @@ def _aggregate(lrs: dict,
     if _consensus_opts is None:
         _consensus_opts = ['Magnitude', 'Specificity']
 
-    lrs = [lrs[method].drop_duplicates(keep='first') for method in lrs]
-    # reduce to a df with the shared keys + all relevant sc
-    lr_res = reduce(
-        lambda left, right:
-        pd.merge(left, right, how='outer', on=_key_cols,
-                 suffixes=('', '_duplicated')), lrs
-    )
-    # drop duplicated columns
-    lr_res = lr_res.loc[:, ~lr_res.columns.str.endswith('_duplicated')]
+    # all methods share the keys of liana_pipe, so their scores are aligned rather than merged
+    lr_res = _align_lrs(lrs, _key_cols)
+    if lr_res is None:
+        lrs = [lrs[method].drop_duplicates(keep='first') for method in lrs]
+        # reduce to a df with the shared keys + all relevant sc
+        lr_res = reduce(
+            lambda left, right:
+            pd.merge(left, right, how='outer', on=_key_cols,
+                     suffixes=('', '_duplicated')), lrs
+        )
+        # drop duplicated columns
+        lr_res = lr_res.loc[:, ~lr_res.columns.str.endswith('_duplicated')]
 
     order_col = ''
     if 'Specificity' in _consensus_opts:
-        lr_res[consensus.specificity] = _rank_aggregate(lr_res.copy(),
+        lr_res[consensus.specificity] = _rank_aggregate(lr_res,
                                                         consensus.specificity_specs,
                                                         aggregate_method=aggregate_method
                                                         )
         order_col = consensus.specificity
     if 'Magnitude' in _consensus_opts:
-        lr_res[consensus.magnitude] = _rank_aggregate(lr_res.copy(),
+        lr_res[consensus.magnitude] = _rank_aggregate(lr_res,
                                                       consensus.magnitude_specs,
                                                       aggregate_method=aggregate_method
                                                       )
         order_col = consensus.magnitude
 
-    lr_res = lr_res.sort_values(order_col)
+    if _sort:
+        lr_res = lr_res.sort_values(order_col)
 
     return lr_res
 
 
+def _align_lrs(lrs: dict, key_cols: list) -> pd.DataFrame | None:
+    """
+    Combine the results of all methods, if they share the same (unique) keys in the same order.
+
+    Equivalent to outer-merging the results of all methods (pandas < 2.2), i.e. the rows are
+    in the order of the first method, and the first of any duplicated score column is kept.
+
+    Returns
+    -------
+    A DataFrame with the keys and the scores of all methods, or None if the keys are not aligned.
+    """
+    lrs = list(lrs.values())
+    keys = lrs[0][key_cols]
+    for lr in lrs[1:]:
+        if (lr.shape[0] != keys.shape[0]) or \
+                not all(np.array_equal(lr[key].values, keys[key].values) for key in key_cols):
+            return None
+    if keys.duplicated().any():
+        return None
+
+    columns = {key: keys[key].values for key in key_cols}
+    for lr in lrs:
+        for col in lr.columns:
+            if col not in columns:
+                columns[col] = lr[col].values
+
+    return pd.DataFrame(columns)
+
+
 def _rank_aggregate(lr_res, specs, aggregate_method) -> np.array:
     """
     Aggregate method ranks
@@ -87,19 +128,17 @@ def _rank_aggregate(lr_res, specs, aggregate_method) -> np.array:
     """
     assert aggregate_method in ['rra', 'mean']
 
-    # Convert specs columns to ranks
-    for spec in specs:
-        score_name = specs[spec][0]
-        ascending = specs[spec][1]
-
-        if ascending:
-            lr_res[score_name] = rankdata(lr_res[score_name], method='average')
-        else:
-            lr_res[score_name] = rankdata(lr_res[score_name] * -1, method='average')
+    # scores of all methods, as a (rows x scores) matrix
+    scores = list(dict.fromkeys(score_name for score_name, _ in specs.values()))
+    rmat = np.empty((lr_res.shape[0], len(scores)))
+    for idx, score_name in enumerate(scores):
+        rmat[:, idx] = lr_res[score_name].values
 
-    # get only the relevant ranks as a mat (joins order the keys)
-    scores = list({specs[s][0] for s in specs})
-    rmat = lr_res[scores].values
+    # Convert to ranks, once per method
+    # NOTE: a score shared by several methods is thus re-ranked
+    for score_name, ascending in specs.values():
+        idx = scores.index(score_name)
+        rmat[:, idx] = rankdata(rmat[:, idx] if ascending else rmat[:, idx] * -1, method='average')
 
     if aggregate_method == 'rra':
         return _robust_rank_aggregate(rmat)
@@ -107,55 +146,6 @@ def _rank_aggregate(lr_res, specs, aggregate_method) -> np.array:
         return np.mean(rmat, axis=1) / rmat.shape[0]
 
 
-def _corr_beta_pvals(p, k) -> np.array:
-    """
-    Correct beta p-values
-
-    Parameters
-    ----------
-    p
-        (min) p-value
-    k
-        total number of rows
-
-    Returns
-    -------
-    An array with corrected p-values
-    """
-    p = np.clip(p * k, a_min=0, a_max=1)
-    return p
-
-
-def _rho_scores(rmat, dist_a, dist_b):
-    """
-    Calculate Beta Distribution Rho Scores
-
-    ----------
-    rmat
-        a matrix where rows are the ranks/n for each interaction, while
-        columns correspond to each method
-    dist_a
-        non-negative shape param a
-    dist_b
-        non-negative shape param b
-
-    Returns
-    -------
-    A vector of pvals as implemented in the RRA method
-    """
-
-    # Sort values by sources (rows)
-    rmat = np.sort(rmat, axis=1)
-    # Calc beta cdf across rows
-    p = beta.cdf(rmat, dist_a, dist_b)
-    # get min pval per row
-    p = np.min(p, axis=1)
-    # correct p-vals
-    rho = _corr_beta_pvals(p, k=rmat.shape[1])
-
-    return rho
-
-
 def _robust_rank_aggregate(rmat) -> np.array:
     """
     Calculate Robust Rank Aggregate as in Kolde et al., 2012
@@ -173,9 +163,61 @@ def _robust_rank_aggregate(rmat) -> np.array:
     # 0-1 values depending on relative rank of
     # each interaction divided by the max of each method
     # due to max diffs due to ties
-    rmat = rmat / np.max(rmat, axis=0)
-    # generate dist_a/b with same row size as rmat
-    dist_a = np.repeat([np.arange(rmat.shape[1])], rmat.shape[0], axis=0) + 1
-    dist_b = rmat.shape[1] - dist_a + 1
+    col_max = np.max(rmat, axis=0)
+
+    return _rra_rho(np.ascontiguousarray(rmat, dtype=np.float64), col_max.astype(np.float64))
+
+
+@nb.njit(parallel=True, cache=True)
+def _rra_rho(rmat, col_max):
+    # rho of each row, i.e. the min of the beta CDFs of its sorted values, corrected by k.
+    # The j-th smallest of k uniforms is Beta(j, k - j + 1) distributed, so its CDF at x is
+    # P(Binomial(k, x) >= j). Rows are processed in blocks, with only O(k) memory per row.
+    n_rows, k = rmat.shape
+    rho = np.empty(n_rows)
+
+    for block in nb.prange((n_rows + _RRA_BLOCK_SIZE - 1) // _RRA_BLOCK_SIZE):
+        x = np.empty(k)
+        for row in range(block * _RRA_BLOCK_SIZE, min((block + 1) * _RRA_BLOCK_SIZE, n_rows)):
+            # insertion sort, as the number of methods is small
+            has_nan = False
+            for j in range(k):
+                value = rmat[row, j] / col_max[j]
+                has_nan |= np.isnan(value)
+                pos = j
+                while (pos > 0) and (x[pos - 1] > value):
+                    x[pos] = x[pos - 1]
+                    pos -= 1
+                x[pos] = value
+            # NOTE: nans propagate, as in `beta.cdf`
+            if has_nan:
+                rho[row] = np.nan
+                continue
+
+            p_min = np.inf
+            for j in range(k):
+                p_min = min(p_min, _binom_sf(x[j], k, j + 1))
+            rho[row] = min(max(p_min * k, 0.), 1.)
+
+    return rho
 
-    return _rho_scores(rmat, dist_a, dist_b)
+
+@nb.njit(cache=True)
+def _binom_sf(x, k, j):
+    # P(Binomial(k, x) >= j), summed over the tail, so that small probabilities are exact
+    if x <= 0:
+        return 0. if j > 0 else 1.
+    if x >= 1:
+        return 1.
+    # first term, i.e. C(k, j) x^j (1 - x)^(k - j)
+    coef = 1.
+    for i in range(j):
+        coef = coef * (k - i) / (i + 1)
+    term = coef * x ** j * (1 - x) ** (k - j)
+    # the remaining terms, each from the previous
+    odds = x / (1 - x)
+    p = term
+    for i in range(j, k):
+        term = term * odds * (k - i) / (i + 1)
+        p += term
+    return p
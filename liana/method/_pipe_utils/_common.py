@@ -1,3 +1,7 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, issparse
+
 from liana._constants import PrimaryColumns as P, DefaultValues as V
 from numpy import union1d
 
@@ -38,9 +42,140 @@ def _join_stats(source, target, dedict, resource):
 
     return bound
 
+def _join_lr_stats(resource, pairs, label_stats, labels, var_names, relevant_cols=None) -> pd.DataFrame:
+    """
+    Joins source-ligand and target-receptor stats to the ligand-receptor resource,
+    for all cell identity pairs at once.
+
+    Equivalent to concatenating `_join_stats` for each pair, but the stats are
+    gathered by integer index from label x gene arrays.
+
+    Parameters
+    ----------
+    resource
+        Ligand-receptor Resource
+    pairs
+        DataFrame with source and target cell identities
+    label_stats
+        dictionary with the name of each stat as keys and label x gene arrays as values
+    labels
+        Index of the cell identities, i.e. the rows of the arrays in `label_stats`
+    var_names
+        Index of the genes, i.e. the columns of the arrays in `label_stats`
+    relevant_cols
+        Columns to be returned. If None, all columns are returned.
+
+    Returns
+    -------
+    Ligand-Receptor stats
+
+    """
+    # NOTE: rows are ordered as the inner merges in `_join_stats` (pandas < 2.2) would,
+    # i.e. grouped by ligand and then by receptor, in order of appearance
+    resource = resource.iloc[_grouped_order(resource, [P.ligand, P.receptor])]
+    n_res, n_pairs = resource.shape[0], pairs.shape[0]
+
+    ligand_idx = np.tile(var_names.get_indexer(resource[P.ligand]), n_pairs)
+    receptor_idx = np.tile(var_names.get_indexer(resource[P.receptor]), n_pairs)
+    source_idx = np.repeat(labels.get_indexer(pairs[P.source]), n_res)
+    target_idx = np.repeat(labels.get_indexer(pairs[P.target]), n_res)
+
+    columns = {col: np.tile(resource[col].values, n_pairs) for col in resource.columns}
+    columns[P.source] = np.asarray(labels, dtype=object)[source_idx]
+    columns[P.target] = np.asarray(labels, dtype=object)[target_idx]
+    for stat, values in label_stats.items():
+        columns[f'{P.ligand}_{stat}'] = values[source_idx, ligand_idx]
+        columns[f'{P.receptor}_{stat}'] = values[target_idx, receptor_idx]
+
+    if relevant_cols is not None:
+        columns = {col: columns[col] for col in columns if col in relevant_cols}
+
+    return pd.DataFrame(columns)
+
+
+def _grouped_order(df, keys):
+    # successively group rows by each key, in order of first appearance
+    order = np.arange(df.shape[0])
+    for key in keys:
+        codes = pd.factorize(df[key].values[order])[0]
+        order = order[np.argsort(codes, kind='stable')]
+    return order
+
+
 def _get_props(X_mask):
     return X_mask.getnnz(axis=0) / X_mask.shape[0]
 
+
+def _label_indicator(label_codes, n_labels, perm_idxs=None, dtype=np.float32, weighted=True):
+    """
+    Build a stacked (n_batch * n_labels, n_cells) indicator matrix, where each block
+    assigns the cells in `perm_idx` to the (unshuffled) labels, weighted by 1 / label size.
+
+    Its product with X is equivalent to `agg_fun(X[perm_idx][label_mask], axis=0)`
+    for every permutation and label, without materialising the permuted X.
+    If `perm_idxs` is None, the cells are not shuffled.
+    """
+    n_cells = label_codes.shape[0]
+    if perm_idxs is None:
+        perm_idxs = [np.arange(n_cells)]
+    n_batch = len(perm_idxs)
+
+    if weighted:
+        label_sizes = np.bincount(label_codes, minlength=n_labels)
+        weights = 1 / np.maximum(label_sizes, 1)
+    else:
+        weights = np.ones(n_labels)
+
+    rows = (np.arange(n_batch)[:, None] * n_labels + label_codes[None, :]).ravel()
+    cols = np.concatenate(perm_idxs)
+    data = np.tile(weights[label_codes].astype(dtype), n_batch)
+
+    return csr_matrix((data, (rows, cols)), shape=(n_batch * n_labels, n_cells))
+
+
+def _get_group_stats(X, label_codes, n_labels, moments=False) -> dict:
+    """
+    Calculate per-label statistics with indicator-matrix products, i.e. without slicing X by label
+
+    Parameters
+    ----------
+    X
+        CSR matrix (cells x genes)
+    label_codes
+        Index of the label of each cell
+    n_labels
+        Number of labels
+    moments
+        Whether to also return the sums and the sums of squares per label (in float64)
+
+    Returns
+    -------
+    A dictionary with the number of cells per label (`counts`), and dense label x gene arrays
+    with the `means` and the proportion of cells in which each gene is expressed (`props`)
+    """
+    counts = np.bincount(label_codes, minlength=n_labels)
+
+    # NOTE: the means are obtained as those of the permutations, i.e. they are comparable
+    means = _label_indicator(label_codes, n_labels, dtype=X.dtype) @ X
+
+    # non-zero entries per label
+    label_sums = _label_indicator(label_codes, n_labels, dtype=np.float64, weighted=False)
+    X_nnz = csr_matrix((np.ones(X.nnz), X.indices, X.indptr), shape=X.shape)
+    props = _to_dense(label_sums @ X_nnz) / np.maximum(counts, 1)[:, None]
+
+    stats = {'counts': counts, 'means': _to_dense(means), 'props': props}
+
+    if moments:
+        X = X.astype(np.float64)
+        stats['sums'] = _to_dense(label_sums @ X)
+        stats['sq_sums'] = _to_dense(label_sums @ X.power(2))
+
+    return stats
+
+
+def _to_dense(X):
+    return X.toarray() if issparse(X) else np.asarray(X)
+
 def _get_groupby_subset(groupby_pairs):
     if groupby_pairs is not V.groupby_pairs:
         if not (P.source in groupby_pairs.columns) | (P.target in groupby_pairs.columns):
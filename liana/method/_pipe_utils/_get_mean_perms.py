@@ -2,9 +2,14 @@ from __future__ import annotations
 
 import anndata
 import numpy as np
+from scipy.stats import norm, gamma
 from tqdm import tqdm
 
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, effective_n_jobs
+
+from liana.method._pipe_utils._common import _label_indicator, _to_dense
+from liana.method._pipe_utils._kernels import _exceed_counts
+from liana.method._pipe_utils._trimean import _trimean, _sparse_trimean, _sparse_trimean_moments
 
 def _get_means_perms(adata: anndata.AnnData,
                      n_perms: int,
@@ -12,7 +17,8 @@ def _get_means_perms(adata: anndata.AnnData,
                      agg_fun,
                      norm_factor: float | None,
                      n_jobs: int,
-                     verbose: bool):
+                     verbose: bool,
+                     batch_size: int | None = None):
     """
     Generate permutations and indices required for permutation-based methods
 
@@ -30,6 +36,9 @@ def _get_means_perms(adata: anndata.AnnData,
         additionally normalize the data by some factor (e.g. matrix max for CellChat)
     verbose
         Verbosity bool
+    batch_size
+        Number of permutations aggregated in a single block product.
+        If None, it is inferred from the size of the data.
 
     Returns
     -------
@@ -39,52 +48,263 @@ def _get_means_perms(adata: anndata.AnnData,
         - receptor_pos: Index of the receptor in the perms tensor
         - labels_pos: Index of cell identities in the perms tensor
     """
+    # Perm should be a cube /w dims: n_perms x idents x n_genes
+    perms = np.zeros((n_perms, adata.obs['@label'].cat.categories.shape[0], adata.shape[1]))
+    for batch, permuted_means in _iter_means_perms(adata=adata,
+                                                   n_perms=n_perms,
+                                                   seed=seed,
+                                                   agg_fun=agg_fun,
+                                                   norm_factor=norm_factor,
+                                                   n_jobs=n_jobs,
+                                                   verbose=verbose,
+                                                   batch_size=batch_size):
+        perms[batch] = permuted_means
 
-    if isinstance(norm_factor, np.float32):
-        adata.X /= norm_factor
+    return perms
+
+
+def _iter_means_perms(adata: anndata.AnnData,
+                      n_perms: int,
+                      seed: int,
+                      agg_fun,
+                      norm_factor: float | None,
+                      n_jobs: int,
+                      verbose: bool,
+                      batch_size: int | None = None):
+    """
+    Lazily generate permuted averages per cluster, one batch of permutations at a time.
+
+    Parameters are the same as in `_get_means_perms`.
 
-    # define labels and masks
+    Yields
+    ------
+    Tuples with the indices of the permutations in the batch, and
+    a tensor with the permuted averages of shape (n_batch, idents, n_genes)
+    """
+    X = _normalize(adata.X, norm_factor)
+
+    # define label codes, i.e. the index of each cell's label
     labels = adata.obs['@label'].cat.categories
-    labels_mask = np.zeros((adata.shape[0], labels.shape[0]), dtype=bool)
+    label_codes = adata.obs['@label'].cat.codes.values
 
-    # populate masks shape(genes, labels)
-    for ct_idx, label in enumerate(labels):
-        labels_mask[:, ct_idx] = adata.obs['@label'] == label
+    for batch, (permuted_means, ) in _generate_perms_batches([X], n_perms, label_codes, labels.shape[0],
+                                                             seed, [agg_fun], n_jobs, verbose, batch_size):
+        yield batch, permuted_means
 
-    # Perm should be a cube /w dims: n_perms x idents x n_genes
-    perms = _generate_perms_cube(adata.X, n_perms, labels_mask, seed, agg_fun, n_jobs, verbose)
 
-    return perms
+class _PermutationCache:
+    """
+    Permutations shared by all permutation-based methods within a single `liana_pipe` call.
+
+    The observed scores of each method are first registered, via the `_SharedNull` returned by `null`.
+    `score` then draws the shuffled label assignments once, and in a single pass over batches of permutations
+    calculates all requested aggregates (e.g. mean and trimean) and counts the permuted scores >= the observed ones
+    of every registered method. Only these counts are kept, i.e. the permuted aggregates are not stored,
+    unless they fit in `max_size`, in which case they are kept and reused by later calls to `score`
+    (e.g. by each query of a `PreparedPipe`).
+    Since all methods use the same seed, this is equivalent to permuting for each method.
+    """
+    def __init__(self,
+                 adata: anndata.AnnData,
+                 n_perms: int,
+                 seed: int,
+                 agg_funs: dict,
+                 n_jobs: int,
+                 verbose: bool,
+                 batch_size: int | None = None,
+                 max_size: float = 0):
+        """
+        Parameters
+        ----------
+        adata
+            Annotated data matrix
+        n_perms
+            Number of permutations to be calculated
+        seed
+            Random seed for reproducibility.
+        agg_funs
+            Dictionary with the aggregation functions as keys, and their norm_factor as values
+        n_jobs
+            Number of jobs to run in parallel.
+        verbose
+            Verbosity bool
+        batch_size
+            Number of permutations aggregated in a single block product.
+            If None, it is inferred from the size of the data.
+        max_size
+            Maximum number of permuted aggregates (n_perms x labels x genes, for each aggregation function)
+            to be kept. If they do not fit, the permutations are drawn again by each call to `score`.
+        """
+        self.adata = adata
+        self.n_perms = n_perms
+        self.seed = seed
+        self.agg_funs = agg_funs
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.batch_size = batch_size
+        self.max_size = max_size
+        n_labels = adata.obs['@label'].cat.categories.shape[0]
+        self.keep_aggs = n_perms * n_labels * adata.shape[1] * len(agg_funs) <= max_size
+        # batches of (perm indices, {agg_fun: permuted aggregates}), if kept
+        self._aggs = None
+        # key -> (agg_fun, mat_idx, lr_truth, _score_fun) of the methods to be scored
+        self._pending = {}
+        # key -> p-values of the scored methods
+        self._pvals = {}
+
+    def null(self, key, agg_fun, mat_idx) -> _SharedNull:
+        """The null of a method (identified by `key`), to be passed as `perm_stats`"""
+        if agg_fun not in self.agg_funs:
+            raise ValueError(f"{agg_fun} was not requested when initializing the permutations.")
+        return _SharedNull(self, key, agg_fun, mat_idx)
+
+    def score(self):
+        """Count the permuted scores >= the observed ones of all registered methods, in a single pass"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+
+        exceed_counts = {key: np.zeros(lr_truth.shape[0]) for key, (_, _, lr_truth, _) in pending.items()}
+        for batch, permuted_aggs in self._iter_aggs(pending):
+            for key, (agg_fun, mat_idx, lr_truth, _score_fun) in pending.items():
+                for batch_stats in _iter_perm_stats([(batch, permuted_aggs[agg_fun])], *mat_idx):
+                    exceed_counts[key] += _exceed_counts(_score_fun, batch_stats, lr_truth)
+
+        self._pvals.update({key: counts / self.n_perms for key, counts in exceed_counts.items()})
+
+    def _iter_aggs(self, pending):
+        """Batches of the permuted aggregates required by the `pending` methods (or of all, if kept)"""
+        if self._aggs is not None:
+            yield from self._aggs
+            return
+
+        label_codes = self.adata.obs['@label'].cat.codes.values
+        n_labels = self.adata.obs['@label'].cat.categories.shape[0]
+        if self.keep_aggs:
+            agg_funs = list(self.agg_funs.keys())
+        else:
+            agg_funs = list(dict.fromkeys(agg_fun for agg_fun, *_ in pending.values()))
+        Xs = [_normalize(self.adata.X, self.agg_funs[agg_fun]) for agg_fun in agg_funs]
+
+        batch_size = self.batch_size
+        if batch_size is None:
+            # bound both the permuted aggregates and the ligand-receptor stats of a batch
+            n_rows = max(lr_truth.shape[0] for _, _, lr_truth, _ in pending.values())
+            batch_size = _get_batch_size(self.n_perms, self.adata.shape[0],
+                                         max(n_labels * self.adata.shape[1] * len(agg_funs), 2 * n_rows))
+
+        aggs = []
+        for batch, permuted_aggs in _generate_perms_batches(Xs, self.n_perms, label_codes, n_labels,
+                                                            self.seed, agg_funs, self.n_jobs,
+                                                            self.verbose, batch_size):
+            permuted_aggs = dict(zip(agg_funs, permuted_aggs))
+            if self.keep_aggs:
+                aggs.append((batch, permuted_aggs))
+            yield batch, permuted_aggs
+        if self.keep_aggs:
+            self._aggs = aggs
+
+
+class _SharedNull:
+    """
+    The null of a single method within a `_PermutationCache`.
+
+    When first passed to `_calculate_pvals`, the observed scores are registered and placeholder (NaN) p-values
+    are returned. Once the cache is scored, the p-values of the method are returned instead.
+    """
+    def __init__(self, cache, key, agg_fun, mat_idx):
+        self.cache = cache
+        self.key = key
+        self.agg_fun = agg_fun
+        self.mat_idx = mat_idx
+
+    def pvals(self, lr_truth, _score_fun):
+        lr_truth = np.asarray(lr_truth)
+        if self.key in self.cache._pvals:
+            pvals = self.cache._pvals.pop(self.key)
+            assert pvals.shape[0] == lr_truth.shape[0]
+            return pvals
+        self.cache._pending[self.key] = (self.agg_fun, self.mat_idx, lr_truth, _score_fun)
+        return np.full(lr_truth.shape[0], np.nan)
+
+
+def _normalize(X, norm_factor):
+    if isinstance(norm_factor, np.float32):
+        # NOTE: normalize a copy, rather than modifying adata.X in place
+        X = X.copy()
+        X /= norm_factor
+    return X
 
 
-# Define a helper function for parallel processing
-def _permute_and_aggregate(perm, perm_idx, X, labels_mask, agg_fun):
-    perm_mat = X[perm_idx]
-    permuted_means = np.array([agg_fun(perm_mat[labels_mask[:, i]], axis=0) for i in range(labels_mask.shape[1])])
-    return perm, permuted_means
+def _mean(a, axis=0):
+    return np.mean(a, axis=axis)
 
 
-def _generate_perms_cube(X, n_perms, labels_mask, seed, agg_fun, n_jobs, verbose):
-    # initialize rng
-    rng = np.random.default_rng(seed=seed)
+def _is_mean(agg_fun):
+    return (agg_fun is np.mean) or (agg_fun is _mean)
 
-    # indexes to be shuffled
-    idx = np.arange(X.shape[0])
 
-    # Perm should be a cube /w dims: n_perms x idents x n_genes
-    perms = np.zeros((n_perms, labels_mask.shape[1], X.shape[1]))
+def _get_batch_size(n_perms, n_cells, n_elements, max_nnz=1e7, max_size=2e7):
+    # bound both the (sparse) shuffled indicator and the (dense) aggregates of a batch,
+    # where n_elements is the size of the aggregates for a single permutation
+    batch_size = min(max_nnz // max(n_cells, 1), max_size // max(n_elements, 1))
+    return int(np.clip(batch_size, 1, n_perms))
 
-    # Use Parallel to enable parallelization
-    results = Parallel(n_jobs=n_jobs)(delayed(_permute_and_aggregate)
-                                      (perm, rng.permutation(idx), X, labels_mask, agg_fun)
-                                      for perm in tqdm(range(n_perms), disable=not verbose)
-                                      )
 
-    # Unpack results
-    for perm, permuted_means in results:
-        perms[perm] = np.reshape(permuted_means, (labels_mask.shape[1], X.shape[1]))
+# Define a helper function for parallel processing
+def _permute_and_aggregate(perms, perm_idxs, Xs, label_codes, n_labels, agg_funs):
+    label_masks = [label_codes == i for i in range(n_labels)]
+
+    permuted_aggs = []
+    for X, agg_fun in zip(Xs, agg_funs):
+        if _is_mean(agg_fun):
+            # all permutations in the batch as a single block product
+            permuted_means = _label_indicator(label_codes, n_labels, perm_idxs, X.dtype) @ X
+            permuted_means = _to_dense(permuted_means).reshape(len(perms), n_labels, X.shape[1])
+        elif agg_fun is _trimean:
+            # all permutations in the batch in a single pass over the sparse columns
+            permuted_means = _sparse_trimean(X, label_codes, n_labels, perm_idxs)
+        else:
+            # only gather the rows of each label, i.e. X is never permuted as a whole
+            permuted_means = np.array([
+                [np.asarray(agg_fun(X[perm_idx[label_mask]], axis=0)).ravel()
+                 for label_mask in label_masks]
+                for perm_idx in perm_idxs
+                ])
+        permuted_aggs.append(permuted_means)
+
+    return perms, permuted_aggs
+
+
+def _generate_perms_batches(Xs, n_perms, label_codes, n_labels, seed, agg_funs, n_jobs, verbose, batch_size=None):
+    # initialize rng
+    rng = np.random.default_rng(seed=seed)
 
-    return perms
+    # indexes to be shuffled
+    n_cells, n_genes = Xs[0].shape
+    idx = np.arange(n_cells)
+
+    if batch_size is None:
+        batch_size = _get_batch_size(n_perms, n_cells, n_labels * n_genes)
+
+    # NOTE: permutations are drawn sequentially, so results do not depend on the batch size
+    batches = [np.arange(start, min(start + batch_size, n_perms))
+               for start in range(0, n_perms, batch_size)]
+
+    # only as many batches as there are jobs are held in memory at once
+    n_parallel = effective_n_jobs(n_jobs)
+    progress_bar = tqdm(total=n_perms, disable=not verbose)
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for start in range(0, len(batches), n_parallel):
+            results = parallel(delayed(_permute_and_aggregate)
+                               (batch, [rng.permutation(idx) for _ in batch],
+                                Xs, label_codes, n_labels, agg_funs)
+                               for batch in batches[start:start + n_parallel]
+                               )
+            for batch, permuted_aggs in results:
+                progress_bar.update(len(batch))
+                yield batch, permuted_aggs
+    progress_bar.close()
 
 
 def _get_positions(adata, lr_res):
@@ -102,17 +322,39 @@ def _get_positions(adata, lr_res):
 
 def _get_mat_idx(adata, lr_res):
     # convert to indexes
-    ligand_pos, receptor_pos, labels_pos = _get_positions(adata, lr_res)
+    labels = adata.obs['@label'].cat.categories
 
-    ligand_idx = lr_res['ligand'].map(ligand_pos)
-    receptor_idx = lr_res['receptor'].map(receptor_pos)
+    ligand_idx = adata.var_names.get_indexer(lr_res['ligand'])
+    receptor_idx = adata.var_names.get_indexer(lr_res['receptor'])
 
-    source_idx = lr_res['source'].map(labels_pos)
-    target_idx = lr_res['target'].map(labels_pos)
+    source_idx = labels.get_indexer(lr_res['source'])
+    target_idx = labels.get_indexer(lr_res['target'])
 
     return ligand_idx, receptor_idx, source_idx, target_idx
 
 
+def _iter_perm_stats(perms, ligand_idx, receptor_idx, source_idx, target_idx):
+    """
+    Lazily index batches of permuted averages into ligand-receptor permutation statistics
+
+    Parameters
+    ----------
+    perms
+        Iterable of (perm indices, permuted averages /w shape (n_batch, idents, n_genes))
+    ligand_idx, receptor_idx, source_idx, target_idx
+        Positions of each row in lr_res in the permuted averages
+
+    Yields
+    ------
+    Permutation statistics /w shape (2 (ligand-receptor), n_batch, n_rows in lr_res)
+    """
+    for _, permuted_means in perms:
+        # ligand and receptor perms
+        ligand_stat_perms = permuted_means[:, source_idx, ligand_idx]
+        receptor_stat_perms = permuted_means[:, target_idx, receptor_idx]
+        # stack them together
+        yield np.stack((ligand_stat_perms, receptor_stat_perms), axis=0)
+
 
 def _calculate_pvals(lr_truth, perm_stats, _score_fun):
     """
@@ -120,23 +362,254 @@ def _calculate_pvals(lr_truth, perm_stats, _score_fun):
 
     Parameters
     ----------
-    x
-        DataFrame with LIANA results
+    lr_truth
+        Observed interaction scores
     perm_stats
-        Permutation statistics (2 (ligand-receptor), n_perms (number of permutations, n_rows in lr_res)
+        Permutation statistics (2 (ligand-receptor), n_perms (number of permutations, n_rows in lr_res),
+        or an iterable of such tensors with batches of permutations. In the latter case, each batch
+        is scored and only the counts of permuted scores >= `lr_truth` are kept.
+        Alternatively, an `_AnalyticNull`, in which case the p-values are approximated without permutations,
+        an `_AdaptivePerms`, in which case the permutations of each interaction are stopped early,
+        or a `_SharedNull`, in which case the permutations are shared with other methods.
+    _score_fun
+        Function by which the ligand and receptor statistics are scored, should take `axis` argument
 
     Returns
     -------
-    A tuple with lr_mean and pvalue for x
+    An array with p-values for each interaction
 
     """
     # calculate p-values
-    if perm_stats is not None:
-        lr_perm_means = _score_fun(perm_stats, axis=0)
-        n_perms = perm_stats.shape[1]
-        pvals = np.sum(np.greater_equal(lr_perm_means, lr_truth), axis=0) / n_perms
-    else:
-        pvals = None
+    if perm_stats is None:
+        return None
 
+    if isinstance(perm_stats, (_AnalyticNull, _AdaptivePerms, _SharedNull)):
+        return perm_stats.pvals(lr_truth, _score_fun)
+
+    if isinstance(perm_stats, np.ndarray):
+        perm_stats = [perm_stats]
+
+    n_perms = 0
+    exceed_counts = np.zeros(np.shape(lr_truth)[0])
+    for batch_stats in perm_stats:
+        exceed_counts += _exceed_counts(_score_fun, batch_stats, lr_truth)
+        n_perms += batch_stats.shape[1]
+    pvals = exceed_counts / n_perms
 
     return pvals
+
+
+class _AdaptivePerms:
+    """
+    Permutations with sequential early stopping (Besag & Clifford, 1991).
+
+    Permutations are run in batches of increasing size, and an interaction is retired once
+    `early_stop` of its permuted scores are >= its observed score. Its p-value is then
+    the proportion of exceedances among the permutations run so far, which is already resolved
+    for interactions that are far from significant. Only the genes of the remaining interactions
+    are aggregated in later batches. The permutations are drawn as in `_generate_perms_batches`,
+    so interactions that are never retired get the same p-values as with all permutations.
+    """
+    def __init__(self,
+                 adata: anndata.AnnData,
+                 lr_res,
+                 n_perms: int,
+                 seed: int,
+                 agg_fun,
+                 norm_factor: float | None,
+                 early_stop: int,
+                 n_jobs: int,
+                 verbose: bool,
+                 batch_size: int | None = None):
+        """
+        Parameters
+        ----------
+        adata
+            Annotated data matrix
+        lr_res
+            Ligand-receptor results
+        n_perms
+            Maximum number of permutations
+        seed
+            Random seed for reproducibility.
+        agg_fun
+            function by which to aggregate the matrix, should take `axis` argument
+        norm_factor
+            additionally normalize the data by some factor (e.g. matrix max for CellChat)
+        early_stop
+            Number of permuted scores >= the observed score after which an interaction is retired
+        n_jobs
+            Number of jobs to run in parallel.
+        verbose
+            Verbosity bool
+        batch_size
+            Maximum number of permutations aggregated in a single block product.
+        """
+        self.X = _normalize(adata.X, norm_factor)
+        self.label_codes = adata.obs['@label'].cat.codes.values
+        self.n_labels = adata.obs['@label'].cat.categories.shape[0]
+        self.mat_idx = _get_mat_idx(adata, lr_res)
+        self.n_perms = n_perms
+        self.seed = seed
+        self.agg_fun = agg_fun
+        self.early_stop = early_stop
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        if batch_size is None:
+            batch_size = _get_batch_size(n_perms, self.X.shape[0], self.n_labels * self.X.shape[1])
+        self.batch_size = batch_size
+
+    def pvals(self, lr_truth, _score_fun):
+        """Proportion of permuted scores >= `lr_truth`, among the permutations run for each interaction"""
+        ligand_idx, receptor_idx, source_idx, target_idx = self.mat_idx
+        lr_truth = np.asarray(lr_truth)
+        n_rows = lr_truth.shape[0]
+
+        rng = np.random.default_rng(seed=self.seed)
+        idx = np.arange(self.X.shape[0])
+        exceed_counts = np.zeros(n_rows)
+        perm_counts = np.zeros(n_rows)
+        active = np.arange(n_rows)
+
+        # most interactions are retired after a few multiples of `early_stop` permutations
+        size = min(max(self.early_stop, 1), self.batch_size)
+        n_parallel = effective_n_jobs(self.n_jobs)
+        n_done = 0
+        progress_bar = tqdm(total=self.n_perms, disable=not self.verbose)
+        with Parallel(n_jobs=self.n_jobs) as parallel:
+            while (n_done < self.n_perms) and (active.shape[0] > 0):
+                batches = []
+                for _ in range(n_parallel):
+                    if n_done >= self.n_perms:
+                        break
+                    batches.append(np.arange(n_done, min(n_done + size, self.n_perms)))
+                    n_done = batches[-1][-1] + 1
+
+                # aggregate only the genes of the remaining interactions
+                genes, gene_pos = np.unique(np.concatenate((ligand_idx[active], receptor_idx[active])),
+                                            return_inverse=True)
+                ligand_pos, receptor_pos = gene_pos[:active.shape[0]], gene_pos[active.shape[0]:]
+                X = self.X[:, genes]
+
+                results = parallel(delayed(_permute_and_aggregate)
+                                   (batch, [rng.permutation(idx) for _ in batch],
+                                    [X], self.label_codes, self.n_labels, [self.agg_fun])
+                                   for batch in batches)
+                for batch, (permuted_means, ) in results:
+                    batch_stats = np.stack((permuted_means[:, source_idx[active], ligand_pos],
+                                            permuted_means[:, target_idx[active], receptor_pos]), axis=0)
+                    exceed_counts[active] += _exceed_counts(_score_fun, batch_stats, lr_truth[active])
+                    perm_counts[active] += batch.shape[0]
+                    progress_bar.update(batch.shape[0])
+
+                # retire the interactions whose p-values are resolved
+                active = active[exceed_counts[active] < self.early_stop]
+                size = min(size * 2, self.batch_size)
+        progress_bar.close()
+
+        return exceed_counts / perm_counts
+
+
+class _AnalyticNull:
+    """
+    Closed-form approximation of the permutation null of the ligand & receptor statistics.
+
+    Under permutation, the statistic of a gene in a label is that of a random subset of cells
+    of the same size. Its mean & variance are thus known from the statistic across all cells
+    (e.g. the mean & variance of the gene with a finite population correction for the mean),
+    and p-values can be approximated without permuting.
+    """
+    def __init__(self, observed, means, variances):
+        """
+        Parameters
+        ----------
+        observed
+            Observed ligand & receptor statistics, with shape (2, n_rows in lr_res)
+        means
+            Means of the ligand & receptor statistics under the null, with shape (2, n_rows)
+        variances
+            Variances of the ligand & receptor statistics under the null, with shape (2, n_rows)
+        """
+        self.observed = np.asarray(observed, dtype=np.float64)
+        self.means = np.asarray(means, dtype=np.float64)
+        self.variances = np.asarray(variances, dtype=np.float64)
+
+    def pvals(self, lr_truth, _score_fun):
+        """
+        Approximate p-values, i.e. the probability of permuted scores >= `lr_truth`
+
+        For the mean, a normal approximation (CLT) is used. Any other score is assumed to increase with
+        the product of the ligand & receptor statistics (e.g. geometric mean, CellChat's probability),
+        and a gamma distribution matched to the moments of the product is used.
+        """
+        if _is_mean(_score_fun):
+            mean = self.means.mean(axis=0)
+            var = self.variances.sum(axis=0) / 4
+            return _normal_sf(np.asarray(lr_truth, dtype=np.float64), mean, var)
+
+        (ligand_mean, receptor_mean), (ligand_var, receptor_var) = self.means, self.variances
+        product = self.observed[0] * self.observed[1]
+        mean = ligand_mean * receptor_mean
+        var = ligand_mean ** 2 * receptor_var + receptor_mean ** 2 * ligand_var + ligand_var * receptor_var
+        return _gamma_sf(product, mean, var)
+
+
+def _get_analytic_null(adata, lr_res, agg_fun, norm_factor, observed) -> _AnalyticNull:
+    """
+    Null moments of the ligand & receptor statistics of each row in `lr_res`
+
+    Parameters
+    ----------
+    adata
+        Annotated data matrix
+    lr_res
+        Ligand-receptor results
+    agg_fun
+        Function by which the matrix is aggregated (mean or trimean)
+    norm_factor
+        additionally normalize the data by some factor (e.g. matrix max for CellChat)
+    observed
+        Observed ligand & receptor statistics, with shape (2, n_rows in lr_res)
+
+    Returns
+    -------
+    An `_AnalyticNull` to be passed as `perm_stats`
+    """
+    X = _normalize(adata.X, norm_factor)
+    label_codes = adata.obs['@label'].cat.codes.values
+    n_labels = adata.obs['@label'].cat.categories.shape[0]
+    n_cells = X.shape[0]
+    counts = np.bincount(label_codes, minlength=n_labels).astype(np.float64)
+
+    if _is_mean(agg_fun):
+        gene_means = np.asarray(X.mean(axis=0, dtype=np.float64)).ravel()
+        gene_vars = np.asarray(X.power(2).mean(axis=0, dtype=np.float64)).ravel() - gene_means ** 2
+        means = np.broadcast_to(gene_means, (n_labels, X.shape[1]))
+        # variance of the mean of a random subset of cells, sampled without replacement
+        variances = np.outer((n_cells - counts) / (max(n_cells - 1, 1) * counts), np.maximum(gene_vars, 0))
+    elif agg_fun is _trimean:
+        means, variances = _sparse_trimean_moments(X, counts)
+    else:
+        raise ValueError(f"An analytic null is not available for {agg_fun}.")
+
+    ligand_idx, receptor_idx, source_idx, target_idx = _get_mat_idx(adata, lr_res)
+    return _AnalyticNull(observed=observed,
+                         means=np.stack((means[source_idx, ligand_idx], means[target_idx, receptor_idx])),
+                         variances=np.stack((variances[source_idx, ligand_idx],
+                                             variances[target_idx, receptor_idx])))
+
+
+def _normal_sf(x, mean, var):
+    sd = np.sqrt(var)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pvals = norm.sf((x - mean) / sd)
+    # degenerate nulls, i.e. the statistic is constant across permutations
+    return np.where(sd > 0, pvals, (mean >= x).astype(np.float64))
+
+
+def _gamma_sf(x, mean, var):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pvals = gamma.sf(x, a=mean ** 2 / var, scale=var / mean)
+        # fall back to a normal approximation for non-positive means (e.g. scaled data)
+        pvals = np.where(mean > 0, pvals, norm.sf((x - mean) / np.sqrt(var)))
+    return np.where(var > 0, pvals, (mean >= x).astype(np.float64))
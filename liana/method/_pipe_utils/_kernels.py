@@ -0,0 +1,172 @@
+"""
+Fused, array-based scoring kernels.
+
+The scoring functions of `MethodMeta` take a DataFrame, and permutation-based methods score all
+permutations with numpy/scipy, allocating several temporaries. Kernels registered here are
+used instead, transparently, whenever one is available for a scoring function:
+
+- `_register_score_kernel`: a kernel for `MethodMeta.fun`, which takes the arrays of the required
+  columns and returns (magnitude, specificity), computed in a single pass.
+- `_register_pair_kernel`: one of the scalar kernels of the ligand & receptor statistics below,
+  used for the observed scores and to count the permuted scores >= the observed ones,
+  in a single pass over the permutation statistics.
+
+NOTE: scalar kernels are selected by their code within a single compiled function,
+rather than passed as first-class functions, so that they are inlined and cached.
+"""
+import numba as nb
+import numpy as np
+
+# MethodMeta.fun -> (columns, kernel)
+_SCORE_KERNELS = {}
+# function scoring ligand & receptor statistics -> (scalar kernel code, parameter getter)
+_PAIR_KERNELS = {}
+
+# codes of the scalar kernels
+_MEAN = 0
+_GMEAN = 1
+_PROBABILITY = 2
+
+_BLOCK_SIZE = 256
+
+
+def _register_score_kernel(fun, columns):
+    """
+    Register a kernel for the interaction scoring function `fun`.
+
+    Parameters
+    ----------
+    fun
+        The scoring function of a `MethodMeta`, i.e. `fun(x)`
+    columns
+        Columns of `x` passed to the kernel, in order
+
+    Returns
+    -------
+    A decorator, which registers the kernel and returns it unchanged.
+    The kernel should return a tuple with the magnitude and specificity arrays (or None).
+    """
+    def decorator(kernel):
+        _SCORE_KERNELS[fun] = (columns, kernel)
+        return kernel
+    return decorator
+
+
+def _register_pair_kernel(score_fun, kernel, get_param=None):
+    """
+    Register a scalar kernel for the function `score_fun(stats, axis=0)` of ligand & receptor statistics.
+
+    Parameters
+    ----------
+    score_fun
+        Function by which the ligand & receptor statistics are scored (e.g. in `_calculate_pvals`)
+    kernel
+        Code of the equivalent scalar kernel, one of `_MEAN`, `_GMEAN`, `_PROBABILITY`
+    get_param
+        Function returning an additional scalar parameter of the kernel, e.g. CellChat's `kh`,
+        looked up at each call so that changes are respected.
+    """
+    _PAIR_KERNELS[score_fun] = (kernel, get_param)
+
+
+def _score_lr(_score, lr_res):
+    """Call `_score.fun` on `lr_res`, with its registered kernel if any"""
+    if _score.fun not in _SCORE_KERNELS:
+        return _score.fun(x=lr_res)
+
+    columns, kernel = _SCORE_KERNELS[_score.fun]
+    return kernel(*[np.ascontiguousarray(lr_res[col].values) for col in columns])
+
+
+def _score_pairs(score_fun, ligand, receptor):
+    """Score observed ligand & receptor statistics, as in `score_fun((ligand, receptor), axis=0)`"""
+    if score_fun not in _PAIR_KERNELS:
+        return score_fun((ligand, receptor), axis=0)
+
+    kernel, get_param = _PAIR_KERNELS[score_fun]
+    # NOTE: as in np.stack, ligand & receptor are scored in their common dtype
+    dtype = np.result_type(ligand, receptor)
+    param = dtype.type(0 if get_param is None else get_param())
+    return _pair_scores(kernel,
+                        np.ascontiguousarray(ligand, dtype=dtype),
+                        np.ascontiguousarray(receptor, dtype=dtype),
+                        param)
+
+
+def _exceed_counts(score_fun, stats, lr_truth):
+    """
+    Number of permuted scores >= `lr_truth`, for each interaction
+
+    Parameters
+    ----------
+    score_fun
+        Function by which the ligand & receptor statistics are scored, should take `axis` argument
+    stats
+        Permutation statistics with shape (2 (ligand-receptor), n_perms, n_rows)
+    lr_truth
+        Observed interaction scores
+    """
+    if score_fun not in _PAIR_KERNELS:
+        return np.sum(np.greater_equal(score_fun(stats, axis=0), lr_truth), axis=0)
+
+    kernel, get_param = _PAIR_KERNELS[score_fun]
+    param = stats.dtype.type(0 if get_param is None else get_param())
+    return _pair_exceed_counts(kernel, np.ascontiguousarray(stats),
+                               np.ascontiguousarray(lr_truth), param)
+
+
+@nb.njit(cache=True, error_model='numpy')
+def _mean_pair(ligand, receptor, param):
+    return (ligand + receptor) / 2
+
+
+@nb.njit(cache=True, error_model='numpy')
+def _gmean_pair(ligand, receptor, param):
+    # NOTE: as in scipy.stats.gmean, the geometric mean of negative values is undefined
+    if (ligand < 0) or (receptor < 0):
+        return np.nan
+    return np.sqrt(np.float64(ligand) * receptor)
+
+
+@nb.njit(cache=True, error_model='numpy')
+def _probability_pair(ligand, receptor, kh):
+    # CellChat's Hill function of the product
+    lr_prob = ligand * receptor
+    return lr_prob / (kh + lr_prob)
+
+
+@nb.njit(cache=True, error_model='numpy')
+def _pair_kernel(kernel, ligand, receptor, param):
+    if kernel == _MEAN:
+        return _mean_pair(ligand, receptor, param)
+    elif kernel == _GMEAN:
+        return _gmean_pair(ligand, receptor, param)
+    return _probability_pair(ligand, receptor, param)
+
+
+@nb.njit(parallel=True, cache=True, error_model='numpy')
+def _pair_scores(kernel, ligand, receptor, param):
+    scores = np.empty(ligand.shape[0], dtype=ligand.dtype)
+    for row in nb.prange(ligand.shape[0]):
+        scores[row] = _pair_kernel(kernel, ligand[row], receptor[row], param)
+    return scores
+
+
+@nb.njit(parallel=True, cache=True, error_model='numpy')
+def _pair_exceed_counts(kernel, stats, lr_truth, param):
+    n_perms, n_rows = stats.shape[1], stats.shape[2]
+    counts = np.zeros(n_rows, dtype=np.int64)
+
+    # blocks of rows, so that the permutations are read contiguously
+    for block in nb.prange((n_rows + _BLOCK_SIZE - 1) // _BLOCK_SIZE):
+        start = block * _BLOCK_SIZE
+        stop = min(start + _BLOCK_SIZE, n_rows)
+        # NOTE: scores are kept in the dtype of the statistics, as in `_pair_scores`
+        scores = np.empty(stop - start, dtype=stats.dtype)
+        for perm in range(n_perms):
+            for row in range(start, stop):
+                scores[row - start] = _pair_kernel(kernel, stats[0, perm, row], stats[1, perm, row], param)
+            for row in range(start, stop):
+                counts[row] += scores[row - start] >= lr_truth[row]
+
+    return counts
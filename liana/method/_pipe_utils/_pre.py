@@ -4,13 +4,16 @@ Functions to preprocess the anndata object prior to running any method.
 """
 from __future__ import annotations
 
+import numba as nb
 import numpy as np
 from anndata import AnnData
+from anndata.utils import make_index_unique
 from typing import Optional
-from pandas import DataFrame, Index
-import scanpy as sc
-from scipy.sparse import csr_matrix, isspmatrix_csr
+from pandas import DataFrame, Index, Series, CategoricalDtype
+from scipy.sparse import csr_matrix, isspmatrix_csr, issparse, vstack
+import h5py
 from liana._logging import _logg
+from liana._constants import MethodColumns as M, InternalValues as I
 
 def assert_covered(
         subset,
@@ -66,6 +69,7 @@ def prep_check_adata(adata: AnnData,
                      groupby: (str | None),
                      min_cells: (int | None),
                      groupby_subset: (np.array | None) = None,
+                     var_subset: (np.array | None) = None,
                      use_raw: Optional[bool] = False,
                      layer: Optional[str] = None,
                      obsm = None,
@@ -86,6 +90,13 @@ def prep_check_adata(adata: AnnData,
         for the whole sample (global).
     min_cells
         minimum cells per cell identity. None if groupby is not passed.
+    groupby_subset
+        cell identities to keep. None to keep all.
+    var_subset
+        features to keep, e.g. those of the resource. None to keep all.
+        If passed, stats across all (non-empty) features are stored in `uns['@mat_stats']`.
+        If `adata.uns['@row_stats']` is present (e.g. from `_PreparedMatrix.row_stats`), these stats
+        are computed from it instead, i.e. across features which might have been removed from `adata`.
     use_raw
         Use raw attribute of adata if present.
     layer
@@ -101,72 +112,279 @@ def prep_check_adata(adata: AnnData,
                         layer=layer, verbose=verbose)
 
     if use_raw & (layer is None):
-        var = DataFrame(index=adata.raw.var_names)
+        var_names = adata.raw.var_names
     else:
-        var = DataFrame(index=adata.var_names)
+        var_names = adata.var_names
 
     if obsm is not None:
         # discard any instances of AnnData if in obsm
         obsm = {k: v for k, v in obsm.items() if not isinstance(v, AnnData)}
 
-    adata = sc.AnnData(X=X,
-                       obs=adata.obs.copy(),
-                       dtype="float32",
-                       var=var,
-                       obsp=adata.obsp.copy(),
-                       uns=uns,
-                       obsm=obsm
-                       ).copy()
-    adata.var_names_make_unique()
+    # NOTE: X is checked & subset via index arrays, and copied only once, by `to_anndata`
+    prepared = _PreparedMatrix(X, var_names, row_stats=adata.uns.get(I.row_stats))
 
+    _check_mtx(prepared, verbose=verbose)
+
+    labels = None
+    if groupby is not None:
+        labels = _groupby_labels(adata.obs, groupby, verbose)
+
+        if groupby_subset is not None:
+            prepared.subset_rows(labels.isin(groupby_subset).values)
+
+        # Remove any cell types below X number of cells per cell type
+        sub_labels = labels.iloc[prepared.rows]
+        if groupby_subset is not None:
+            sub_labels = sub_labels.cat.remove_unused_categories()
+        count_cells = sub_labels.value_counts(sort=False)
+        lowly_abundant_idents = list(count_cells.index[count_cells < min_cells])
+
+        if lowly_abundant_idents:
+            # remove lowly abundant identities
+            prepared.subset_rows(~sub_labels.isin(lowly_abundant_idents).values)
+            _logg("The following cell identities were excluded: {0}".format(", ".join(lowly_abundant_idents)),
+                 level='warn', verbose=verbose)
+
+    check_vars(prepared.var_names[prepared.cols],
+               complex_sep=complex_sep,
+               verbose=verbose)
+
+    mat_stats = None
+    if var_subset is not None:
+        # stats of the whole matrix, before only the features in `var_subset` are kept
+        label_codes = None
+        if groupby is not None:
+            label_codes = labels.iloc[prepared.rows].cat.remove_unused_categories().cat.codes.values
+        mat_stats = prepared.mat_stats(label_codes)
+        prepared.subset_cols(np.isin(prepared.var_names[prepared.cols], var_subset))
+
+    # Re-order adata vars alphabetically
+    prepared.sort_cols()
+
+    adata = prepared.to_anndata(obs=adata.obs,
+                                labels=labels,
+                                groupby=groupby,
+                                obsp=adata.obsp,
+                                obsm=obsm,
+                                uns=uns)
+    if mat_stats is not None:
+        adata.uns[I.mat_stats] = mat_stats
+
+    return adata
+
+
+def _check_mtx(prepared, verbose=False):
+    """Check the matrix of a `_PreparedMatrix`, and remove its empty features"""
     # Check for empty features
-    msk_features = np.sum(adata.X, axis=0).A1 == 0
+    msk_features = prepared.col_sums == 0
     n_empty_features = np.sum(msk_features)
     if n_empty_features > 0:
         _logg(f"{n_empty_features} features of mat are empty, they will be removed.", level='warn', verbose=verbose)
-        adata = adata[:, ~msk_features]
+        prepared.subset_cols(~msk_features)
 
     # Check for empty samples
-    msk_samples = adata.X.sum(axis=1).A1 == 0
+    msk_samples = prepared.row_sums == 0
     n_empty_samples = np.sum(msk_samples)
     if n_empty_samples > 0:
         _logg(f"{n_empty_samples} samples of mat are empty, they will be removed.", level='warn', verbose=verbose)
 
     # Check if log-norm
-    _sum = np.sum(adata.X.data[0:100])
+    _sum = np.sum(prepared.X.data[0:100].astype(np.float32))
     if _sum == np.floor(_sum):
         _logg("Make sure that normalized counts are passed!", level='warn', verbose=verbose)
 
     # Check for non-finite values
-    if np.any(~np.isfinite(adata.X.data)):
+    if prepared.n_nonfinite > 0:
         raise ValueError("mat contains non finite values (nan or inf), please set them to 0 or remove them.")
 
-    if groupby is not None:
-        _check_groupby(adata, groupby, verbose)
 
-        if groupby_subset is not None:
-            adata = adata[adata.obs[groupby].isin(groupby_subset), :]
-
-        adata.obs['@label'] = adata.obs[groupby]
-
-        # Remove any cell types below X number of cells per cell type
-        count_cells = adata.obs.groupby(groupby)[groupby].size().reset_index(name='count').copy()
-        count_cells['keep'] = count_cells['count'] >= min_cells
+class _PreparedMatrix:
+    """
+    A CSR matrix with unique var names, and the stats by which it is checked.
 
-        if not all(count_cells.keep):
-            lowly_abundant_idents = list(count_cells[~count_cells.keep][groupby])
-            # remove lowly abundant identities
-            msk = ~np.isin(adata.obs[[groupby]], lowly_abundant_idents)
-            adata = adata[msk]
-            _logg("The following cell identities were excluded: {0}".format(", ".join(lowly_abundant_idents)),
-                 level='warn', verbose=verbose)
+    The column & row sums, the row sums of squares & maxima, and the number of non-finite values,
+    are computed in a single pass over the non-zero values of the matrix. Rows & columns are subset lazily, as index arrays,
+    so that the matrix is copied only once, i.e. when converted to an AnnData.
 
-    check_vars(adata.var_names,
-               complex_sep=complex_sep,
-               verbose=verbose)
-    # Re-order adata vars alphabetically
-    adata = adata[:, np.sort(adata.var_names)]
-    return adata
+    If `row_stats` (as returned by `row_stats`) are passed, they replace the row stats, e.g. if `X` has
+    only some of the features of the matrix, for which they were computed.
+    """
+    def __init__(self, X: csr_matrix, var_names: Index, row_stats: Optional[dict] = None):
+        self.X = X
+        self.var_names = make_index_unique(Index(var_names))
+        self.rows = np.arange(X.shape[0])
+        self.cols = np.arange(X.shape[1])
+
+        self.col_sums, self.row_sums, self.row_sq_sums, self.row_max, self.n_nonfinite = \
+            _csr_stats(X.indptr, X.indices, X.data, X.shape[1])
+
+        self.n_features = None
+        if row_stats is not None:
+            self.row_sums, self.row_sq_sums, self.row_max = \
+                row_stats['sums'], row_stats['sq_sums'], row_stats['max']
+            self.n_features = row_stats['n_features']
+
+    def row_stats(self) -> dict:
+        """Stats of all rows across the (current) columns, to be passed to another `_PreparedMatrix`"""
+        return {'sums': self.row_sums,
+                'sq_sums': self.row_sq_sums,
+                'max': self.row_max,
+                'n_features': self.cols.shape[0] if self.n_features is None else self.n_features}
+
+    def subset_rows(self, msk):
+        """Keep the (current) rows in the boolean mask `msk`"""
+        self.rows = self.rows[msk]
+
+    def subset_cols(self, msk):
+        """Keep the (current) columns in the boolean mask `msk`"""
+        self.cols = self.cols[msk]
+
+    def sort_cols(self):
+        """Order the (current) columns by var name"""
+        self.cols = self.cols[np.argsort(self.var_names[self.cols], kind='stable')]
+
+    def mat_stats(self, label_codes=None) -> dict:
+        """
+        Stats of the (current) rows across all (current) columns, as `mat_mean` & `mat_max`.
+        If `label_codes` of the rows are passed, also the number of cells, and the sums & sums
+        of squares of their values, for each label (`@label_moments`).
+        """
+        n_rows = self.rows.shape[0]
+        n_cols = self.cols.shape[0] if self.n_features is None else self.n_features
+        if n_rows == 0:
+            return {}
+
+        mat_stats = {M.mat_mean: np.float32(self.row_sums[self.rows].sum() / (n_rows * n_cols)),
+                     M.mat_max: np.float32(self.row_max[self.rows].max())}
+        if label_codes is not None:
+            mat_stats[I.label_moments] = \
+                {'counts': np.bincount(label_codes),
+                 'sums': np.bincount(label_codes, weights=self.row_sums[self.rows]),
+                 'sq_sums': np.bincount(label_codes, weights=self.row_sq_sums[self.rows]),
+                 'n_features': n_cols}
+        return mat_stats
+
+    def to_anndata(self, obs, labels=None, groupby=None, obsp=None, obsm=None, uns=None) -> AnnData:
+        """
+        Subset the matrix (as float32), along with the cell annotations, as when copying an AnnData view.
+
+        Parameters
+        ----------
+        obs
+            Cell annotations, of all rows.
+        labels
+            Categorical cell labels, i.e. `obs[groupby]`, also stored as `@label`.
+        obsp, obsm
+            Pairwise & multi-dimensional cell annotations, of all rows.
+        uns
+            Unstructured annotations, with colors subset as the categories of `obs`.
+        """
+        col_map = np.full(self.X.shape[1], -1, dtype=np.int64)
+        col_map[self.cols] = np.arange(self.cols.shape[0])
+        indptr, indices, data = _csr_subset(self.X.indptr, self.X.indices, self.X.data,
+                                            self.rows, col_map)
+        X = csr_matrix((data, indices, indptr), shape=(self.rows.shape[0], self.cols.shape[0]))
+
+        obs = obs.iloc[self.rows].copy()
+        if groupby is not None:
+            obs[groupby] = labels.iloc[self.rows]
+            obs['@label'] = obs[groupby]
+        uns = None if uns is None else dict(uns)
+        _remove_unused_categories(obs, uns)
+
+        # NOTE: rows are a sorted subset, so all are kept if none were removed
+        if self.rows.shape[0] == self.X.shape[0]:
+            obsp = None if obsp is None else {k: v.copy() for k, v in obsp.items()}
+        else:
+            obsp = None if obsp is None else \
+                {k: _subset_rows(v, self.rows)[:, self.rows] for k, v in obsp.items()}
+            obsm = None if obsm is None else {k: _subset_rows(v, self.rows) for k, v in obsm.items()}
+
+        return AnnData(X=X,
+                       obs=obs,
+                       var=DataFrame(index=self.var_names[self.cols]),
+                       obsp=obsp,
+                       obsm=obsm,
+                       uns=uns)
+
+
+@nb.njit(cache=True)
+def _csr_stats(indptr, indices, data, n_cols):
+    # column & row sums, row sums of squares & maxima, and the number of non-finite values,
+    # of the values as float32
+    n_rows = indptr.shape[0] - 1
+    col_sums = np.zeros(n_cols)
+    row_sums = np.zeros(n_rows)
+    row_sq_sums = np.zeros(n_rows)
+    row_max = np.zeros(n_rows)
+    n_nonfinite = 0
+    for row in range(n_rows):
+        # NOTE: implicit zeros are part of the max
+        max_value = -np.inf if indptr[row + 1] - indptr[row] == n_cols else 0.
+        for pos in range(indptr[row], indptr[row + 1]):
+            value = np.float64(np.float32(data[pos]))
+            col_sums[indices[pos]] += value
+            row_sums[row] += value
+            row_sq_sums[row] += value * value
+            max_value = max(max_value, value)
+            n_nonfinite += not np.isfinite(value)
+        row_max[row] = max_value
+    return col_sums, row_sums, row_sq_sums, row_max, n_nonfinite
+
+
+@nb.njit(parallel=True, cache=True)
+def _csr_subset(indptr, indices, data, rows, col_map):
+    # the (rows x kept columns) float32 CSR matrix, with values in their original order within rows
+    n_rows = rows.shape[0]
+    new_indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    for i in nb.prange(n_rows):
+        row = rows[i]
+        n_kept = 0
+        for pos in range(indptr[row], indptr[row + 1]):
+            n_kept += col_map[indices[pos]] >= 0
+        new_indptr[i + 1] = n_kept
+    new_indptr = np.cumsum(new_indptr)
+
+    new_indices = np.empty(new_indptr[-1], dtype=indices.dtype)
+    new_data = np.empty(new_indptr[-1], dtype=np.float32)
+    for i in nb.prange(n_rows):
+        row = rows[i]
+        out = new_indptr[i]
+        for pos in range(indptr[row], indptr[row + 1]):
+            col = col_map[indices[pos]]
+            if col >= 0:
+                new_indices[out] = col
+                new_data[out] = data[pos]
+                out += 1
+    return new_indptr, new_indices, new_data
+
+
+def _subset_rows(value, rows):
+    if isinstance(value, DataFrame):
+        return value.iloc[rows]
+    if issparse(value):
+        value = value.tocsr()
+    return value[rows]
+
+
+def _remove_unused_categories(obs, uns=None):
+    # as when subsetting an AnnData, i.e. along with the colors of each category in `uns`
+    for col in obs.columns:
+        if not isinstance(obs[col].dtype, CategoricalDtype):
+            continue
+        all_categories = obs[col].cat.categories
+        obs[col] = obs[col].cat.remove_unused_categories()
+
+        color_key = f"{col}_colors"
+        if (uns is None) or (color_key not in uns):
+            continue
+        colors = np.array(uns[color_key])
+        if colors.ndim == 0:
+            uns[color_key] = colors[(None,)]
+        elif len(colors) != len(all_categories):
+            del uns[color_key]
+        else:
+            uns[color_key] = colors[np.isin(all_categories, obs[col].cat.categories)]
 
 def check_vars(var_names, complex_sep, verbose=False) -> list:
     """
@@ -263,9 +481,93 @@ def _choose_mtx_rep(adata, use_raw=False, layer=None, verbose=False) -> csr_matr
 
     return X
 
+def _is_backed_mtx(X) -> bool:
+    """
+    Whether `X` is a dense or CSR matrix on disk, which can be read by rows.
+    """
+    if isinstance(X, h5py.Dataset):
+        return X.ndim == 2
+    group = getattr(X, 'group', None)
+    if group is None:
+        return False
+    return (group.attrs.get('encoding-type', None) == 'csr_matrix') | \
+        (group.attrs.get('h5sparse_format', None) == 'csr')
+
+
+def _read_backed_rows(X, rows, cols, chunk_size=10000):
+    """
+    Read the `rows` & `cols` of a backed matrix, in chunks of contiguous rows.
+
+    Parameters
+    ----------
+    X
+        A dense (``h5py.Dataset``) or CSR matrix on disk, e.g. ``adata.X`` of a backed AnnData.
+    rows
+        Sorted integer indices of the rows to read.
+    cols
+        Integer indices of the columns to keep.
+    chunk_size
+        Maximum number of rows to read at once.
+
+    Returns
+    -------
+    The (rows x cols) CSR matrix, the sums of each column across `rows`,
+    and the sum, sum of squares and max of each row across all columns.
+    """
+    n_vars = X.shape[1]
+    col_sums = np.zeros(n_vars, dtype=np.float64)
+    row_sums = np.zeros(rows.shape[0], dtype=np.float64)
+    row_sq_sums = np.zeros(rows.shape[0], dtype=np.float64)
+    row_max = np.zeros(rows.shape[0], dtype=np.float64)
+    chunks = []
+
+    # contiguous runs of rows, split into chunks
+    run_starts = np.flatnonzero(np.append(True, np.diff(rows) != 1))
+    run_stops = np.append(run_starts[1:], rows.shape[0])
+    pos = 0
+    for run_start, run_stop in zip(run_starts, run_stops):
+        for chunk_start in range(run_start, run_stop, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, run_stop)
+            start, stop = rows[chunk_start], rows[chunk_stop - 1] + 1
+            chunk = _read_row_range(X, start, stop)
+
+            chunk_64 = chunk.astype(np.float64)
+            col_sums += chunk_64.sum(axis=0).A1
+            row_sums[pos:pos + chunk.shape[0]] = chunk_64.sum(axis=1).A1
+            row_sq_sums[pos:pos + chunk.shape[0]] = chunk_64.multiply(chunk_64).sum(axis=1).A1
+            row_max[pos:pos + chunk.shape[0]] = chunk.max(axis=1).toarray().ravel()
+            chunks.append(chunk[:, cols])
+            pos += chunk.shape[0]
+
+    X = vstack(chunks, format='csr') if chunks else csr_matrix((0, cols.shape[0]), dtype=np.float32)
+
+    return X, col_sums, row_sums, row_sq_sums, row_max
+
+
+def _read_row_range(X, start, stop) -> csr_matrix:
+    if isinstance(X, h5py.Dataset):
+        return csr_matrix(X[start:stop])
+
+    group = X.group
+    indptr = group['indptr'][start:stop + 1]
+    data = group['data'][indptr[0]:indptr[-1]]
+    indices = group['indices'][indptr[0]:indptr[-1]]
+
+    return csr_matrix((data, indices, indptr - indptr[0]), shape=(stop - start, X.shape[1]))
+
+
 def _check_groupby(adata, groupby, verbose):
-    if groupby not in adata.obs.columns:
+    labels = _groupby_labels(adata.obs, groupby, verbose)
+    if adata.obs[groupby].dtype.name != 'category':
+        adata.obs[groupby] = labels
+
+
+def _groupby_labels(obs, groupby, verbose) -> Series:
+    """The `groupby` column of `obs` as a categorical, without modifying `obs`"""
+    if groupby not in obs.columns:
         raise AssertionError(f"`{groupby}` not found in `adata.obs.columns`.")
-    if not adata.obs[groupby].dtype.name == 'category':
+    labels = obs[groupby]
+    if not labels.dtype.name == 'category':
         _logg(f"Converting `{groupby}` to categorical!", level='warn', verbose=verbose)
-        adata.obs[groupby] = adata.obs[groupby].astype('category')
+        labels = labels.astype('category')
+    return labels
@@ -0,0 +1,147 @@
+"""
+1 vs rest differential expression, as in `scanpy.tl.rank_genes_groups`, for all labels at once.
+"""
+from __future__ import annotations
+
+import numba as nb
+import numpy as np
+from scipy.stats import norm, ttest_ind_from_stats
+
+# methods which are computed natively, any other is passed to `scanpy.tl.rank_genes_groups`
+_DE_METHODS = ['t-test', 't-test_overestim_var', 'wilcoxon']
+
+
+def _rank_genes_stats(X, label_codes, group_stats, method='t-test') -> dict:
+    """
+    Rank genes of each label vs the rest, as `scanpy.tl.rank_genes_groups` (with `reference='rest'`).
+
+    Parameters
+    ----------
+    X
+        CSR matrix (cells x genes)
+    label_codes
+        Index of the label of each cell
+    group_stats
+        Per-label stats of X, with `moments`, as returned by `_get_group_stats`
+    method
+        One of `_DE_METHODS`
+
+    Returns
+    -------
+    A dictionary with label x gene arrays of `scores`, `logfoldchanges`, `pvals` and `pvals_adj`.
+    """
+    if method not in _DE_METHODS:
+        raise ValueError(f"`method` must be one of {_DE_METHODS}.")
+
+    counts = group_stats['counts']
+    if np.any(counts < 2):
+        raise ValueError("Could not calculate statistics for groups {} since they only "
+                         "contain one sample.".format(', '.join(map(str, np.flatnonzero(counts < 2)))))
+
+    n_cells = label_codes.shape[0]
+    n_group = counts[:, None].astype(np.float64)
+    n_rest = n_cells - n_group
+
+    # label & rest means and variances (ddof=1), the rest from the totals
+    sums, sq_sums = group_stats['sums'], group_stats['sq_sums']
+    rest_sums = sums.sum(axis=0) - sums
+    rest_sq_sums = sq_sums.sum(axis=0) - sq_sums
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_group = sums / n_group
+        mean_rest = rest_sums / n_rest
+        var_group = np.maximum(sq_sums / n_group - mean_group ** 2, 0) * (n_group / (n_group - 1))
+        var_rest = np.maximum(rest_sq_sums / n_rest - mean_rest ** 2, 0) * (n_rest / (n_rest - 1))
+
+    if method == 'wilcoxon':
+        rank_sums = _rank_sums(X.tocsc(), label_codes, counts.shape[0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = (rank_sums - n_group * (n_cells + 1) / 2.0) / \
+                np.sqrt(n_group * n_rest * (n_cells + 1) / 12.0)
+        scores[np.isnan(scores)] = 0
+        pvals = 2 * norm.sf(np.abs(scores))
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores, pvals = ttest_ind_from_stats(mean1=mean_group,
+                                                 std1=np.sqrt(var_group),
+                                                 nobs1=n_group,
+                                                 mean2=mean_rest,
+                                                 std2=np.sqrt(var_rest),
+                                                 # hack for overestimating the variance for small groups
+                                                 nobs2=n_group if method == 't-test_overestim_var' else n_rest,
+                                                 equal_var=False)
+        scores[np.isnan(scores)] = 0
+        pvals[np.isnan(pvals)] = 1
+
+    # NOTE: X is assumed to be (natural) log1p-transformed
+    logfoldchanges = np.log2((np.expm1(mean_group) + 1e-9) / (np.expm1(mean_rest) + 1e-9))
+
+    return {'scores': scores.astype(np.float32),
+            'logfoldchanges': logfoldchanges.astype(np.float32),
+            'pvals': pvals,
+            'pvals_adj': _fdr_bh(pvals)}
+
+
+def _fdr_bh(pvals) -> np.ndarray:
+    """Benjamini-Hochberg adjusted p-values, across the genes (columns) of each label"""
+    n_genes = pvals.shape[1]
+    order = np.argsort(pvals, axis=1)
+    ranked = np.take_along_axis(pvals, order, axis=1) * n_genes / np.arange(1, n_genes + 1)
+    ranked = np.minimum(np.minimum.accumulate(ranked[:, ::-1], axis=1)[:, ::-1], 1)
+
+    pvals_adj = np.empty_like(ranked)
+    np.put_along_axis(pvals_adj, order, ranked, axis=1)
+    return pvals_adj
+
+
+def _rank_sums(X, label_codes, n_labels):
+    """Sums of the ranks (across all cells, averaged for ties) of each gene, for each label"""
+    label_sizes = np.bincount(label_codes, minlength=n_labels)
+    return _csc_rank_sums(X.indptr, X.indices, X.data, label_codes, label_sizes)
+
+
+@nb.njit(parallel=True, cache=True)
+def _csc_rank_sums(indptr, indices, data, label_codes, label_sizes):
+    n_cells = label_codes.shape[0]
+    n_labels = label_sizes.shape[0]
+    n_genes = indptr.shape[0] - 1
+    rank_sums = np.zeros((n_labels, n_genes))
+
+    for gene in nb.prange(n_genes):
+        start, stop = indptr[gene], indptr[gene + 1]
+        values = data[start:stop]
+        cells = indices[start:stop]
+        # NOTE: stored zeros are ranked as the implicit ones
+        order = np.argsort(values, kind='mergesort')
+        n_neg = 0
+        n_nonzero = 0
+        for pos in range(values.shape[0]):
+            n_neg += values[pos] < 0
+            n_nonzero += values[pos] != 0
+        n_zeros = n_cells - n_nonzero
+        zero_rank = n_neg + (n_zeros + 1) / 2.0
+
+        # zeros of each label, i.e. its cells minus its non-zero values
+        nonzero_per_label = np.zeros(n_labels, dtype=np.int64)
+
+        pos = 0
+        rank = 0  # number of values ranked before the current tie
+        while pos < order.shape[0]:
+            value = values[order[pos]]
+            tie_end = pos
+            while (tie_end + 1 < order.shape[0]) and (values[order[tie_end + 1]] == value):
+                tie_end += 1
+            if value != 0:
+                n_tied = tie_end - pos + 1
+                # average rank of the tie, with the zeros ranked before the positive values
+                avg_rank = rank + (n_tied + 1) / 2.0 + (n_zeros if value > 0 else 0)
+                for tied in range(pos, tie_end + 1):
+                    label = label_codes[cells[order[tied]]]
+                    rank_sums[label, gene] += avg_rank
+                    nonzero_per_label[label] += 1
+                rank += n_tied
+            pos = tie_end + 1
+
+        for label in range(n_labels):
+            rank_sums[label, gene] += (label_sizes[label] - nonzero_per_label[label]) * zero_rank
+
+    return rank_sums
@@ -0,0 +1,95 @@
+"""
+Compact ligand-receptor results, with categorical keys and float32 scores.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from liana._constants import PrimaryColumns as P
+
+
+def _compact_res(lr_res: pd.DataFrame, key_cols: list | None = None) -> pd.DataFrame:
+    """
+    Encode the keys of `lr_res` as categoricals, and its float64 scores as float32.
+
+    Categorical columns are stored as integer codes and their (unique) categories,
+    both in memory and in h5ad, and are converted back to strings with `_expand_res`.
+
+    Parameters
+    ----------
+    lr_res
+        Ligand-receptor results
+    key_cols
+        Columns to be encoded as categoricals. By default, the entity columns (source, target,
+        ligand/receptor & their complexes).
+
+    Returns
+    -------
+    A DataFrame with the same index & columns as `lr_res`.
+    """
+    if key_cols is None:
+        key_cols = P.complete
+
+    columns = {}
+    for col in lr_res.columns:
+        values = lr_res[col]
+        if (col in key_cols) and (values.dtype == object):
+            values = values.astype('category')
+        elif values.dtype == np.float64:
+            values = values.astype(np.float32)
+        columns[col] = values
+
+    return pd.DataFrame(columns, index=lr_res.index)
+
+
+def _expand_res(lr_res: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the categorical columns of `lr_res` (e.g. from `_compact_res`) back to strings.
+
+    Returns
+    -------
+    `lr_res` itself if it has no categorical columns, else a copy.
+    """
+    categorical = [col for col in lr_res.columns if isinstance(lr_res[col].dtype, pd.CategoricalDtype)]
+    if not categorical:
+        return lr_res
+    return lr_res.astype({col: object for col in categorical})
+
+
+def _concat_categoricals(columns: list) -> pd.Categorical:
+    """Concatenate categorical columns, with the union of their categories"""
+    return union_categoricals([pd.Categorical(col) for col in columns])
+
+
+def _concat_samples(results, samples, sample_key, compact=False) -> pd.DataFrame:
+    """
+    Write the results of each sample into a pre-allocated long-format DataFrame.
+    If `compact`, the sample column is categorical, as are the (compact) keys of each sample.
+    """
+    sizes = np.array([res.shape[0] for res in results])
+    bounds = np.append(0, np.cumsum(sizes))
+    columns = results[0].columns if results else []
+
+    if compact:
+        liana_res = {sample_key: pd.Categorical.from_codes(np.repeat(np.arange(len(samples)), sizes),
+                                                           categories=samples)}
+    else:
+        liana_res = {sample_key: np.repeat(np.asarray(samples, dtype=object), sizes)}
+    for col in columns:
+        dtypes = {res[col].dtype for res in results}
+        if all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+            # the union of the categories of all samples, i.e. without converting to strings
+            liana_res[col] = _concat_categoricals([res[col] for res in results])
+            continue
+        dtype = dtypes.pop() if len(dtypes) == 1 else object
+        if not isinstance(dtype, np.dtype):
+            liana_res[col] = pd.concat([res[col] for res in results], ignore_index=True)
+            continue
+        values = np.empty(bounds[-1], dtype=dtype)
+        for idx, res in enumerate(results):
+            values[bounds[idx]:bounds[idx + 1]] = res[col].values
+        liana_res[col] = values
+
+    return pd.DataFrame(liana_res)
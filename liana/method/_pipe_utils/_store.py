@@ -0,0 +1,228 @@
+"""
+On-disk store of ligand-receptor results, partitioned by sample (e.g. from `by_sample`).
+
+Each sample is written to its own HDF5 file, `<sample_key>=<sample>.h5` (with the sample URL-encoded),
+with each column stored separately, so that samples, and columns of each sample, are read independently.
+String & categorical columns are stored as integer codes and their categories.
+"""
+from __future__ import annotations
+
+import json
+import os
+from contextlib import suppress
+from urllib.parse import quote
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from liana.method._pipe_utils._results import _concat_samples
+
+_META = '_meta.json'
+
+
+class _ResultStore:
+    """
+    A directory with the results of each sample.
+
+    Samples are written to a temporary file, which is renamed once complete, so the results of a sample
+    are either complete or missing, e.g. after a crash. Finished samples can thus be skipped when resuming.
+    """
+    def __init__(self, path, sample_key=None, samples=None, method_name=None, compact=False, params=None):
+        """
+        Open the store at `path`, or create it if `sample_key` & `samples` are passed.
+
+        Parameters
+        ----------
+        path
+            Directory of the store.
+        sample_key
+            Column of the samples. If the store exists, it should have been created with the same
+            `sample_key`, `method_name`, `compact` & `params`.
+        samples
+            Samples of the store, in the order in which they are read. Samples not yet in the store are added.
+        method_name
+            Name of the method of the results.
+        compact
+            Whether the sample column is categorical, when the results of all samples are read.
+        params
+            Parameters of the run, e.g. as returned by `_get_params`, by which the results of the samples are compared.
+        """
+        self.path = os.fspath(path)
+        meta_path = os.path.join(self.path, _META)
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+            if (sample_key is not None) and \
+                    ((self.meta['sample_key'] != sample_key) or (self.meta['method_name'] != method_name)):
+                raise ValueError(f"The store at `{self.path}` has the results of {self.meta['method_name']} "
+                                 f"by `{self.meta['sample_key']}`. Please remove it, or pass another path.")
+            if sample_key is not None:
+                stored = {'compact': self.meta['compact'], **self.meta.get('params', {})}
+                passed = {'compact': compact, **_get_params(params or {})}
+                changed = sorted(key for key in stored.keys() | passed.keys() if stored.get(key) != passed.get(key))
+                if changed:
+                    raise ValueError(f"The store at `{self.path}` has results obtained with different {changed}. "
+                                     "Please remove it, or pass another path.")
+            if samples is not None:
+                new_samples = [sample for sample in samples if sample not in self.meta['samples']]
+                if new_samples:
+                    self.meta['samples'] += new_samples
+                    self._write_meta()
+        elif sample_key is None:
+            raise ValueError(f"No result store was found at `{self.path}`.")
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            # NOTE: as python scalars, e.g. int or str, so that they are JSON-serializable
+            self.meta = {'sample_key': sample_key,
+                         'samples': pd.Index(samples).tolist(),
+                         'method_name': method_name,
+                         'compact': compact,
+                         'params': _get_params(params or {})}
+            self._write_meta()
+
+    @property
+    def sample_key(self) -> str:
+        return self.meta['sample_key']
+
+    @property
+    def samples(self) -> list:
+        """The samples of the store, including those that are not finished"""
+        return self.meta['samples']
+
+    def finished(self) -> list:
+        """The samples which are in the store"""
+        return [sample for sample in self.samples if os.path.exists(self._sample_path(sample))]
+
+    @property
+    def columns(self) -> list:
+        """The columns of the results, i.e. of the first finished sample"""
+        finished = self.finished()
+        if not finished:
+            return []
+        with h5py.File(self._sample_path(finished[0]), 'r') as f:
+            return json.loads(f.attrs['columns'])
+
+    def write(self, sample, lr_res: pd.DataFrame):
+        """Write the results of a sample, replacing any previous ones"""
+        path = self._sample_path(sample)
+        tmp_path = path + '.tmp'
+        try:
+            with h5py.File(tmp_path, 'w') as f:
+                f.attrs['columns'] = json.dumps(list(map(str, lr_res.columns)))
+                for idx, col in enumerate(lr_res.columns):
+                    _write_column(f, str(idx), lr_res[col])
+        except BaseException:
+            # NOTE: the file may not have been created, e.g. if the directory is missing
+            with suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+
+    def read_sample(self, sample, columns=None) -> pd.DataFrame:
+        """Read the results of a sample, or only its `columns`"""
+        with h5py.File(self._sample_path(sample), 'r') as f:
+            all_columns = json.loads(f.attrs['columns'])
+            columns = all_columns if columns is None else columns
+            missing = [col for col in columns if col not in all_columns]
+            if missing:
+                raise ValueError(f"{missing} not found in the results of `{sample}`.")
+            return pd.DataFrame({col: _read_column(f, str(all_columns.index(col))) for col in columns})
+
+    def iter_samples(self, samples=None, columns=None):
+        """Iterate over (sample, results) of the finished `samples`, one sample at a time"""
+        samples = self.finished() if samples is None else samples
+        for sample in samples:
+            yield sample, self.read_sample(sample, columns=columns)
+
+    def read(self, samples=None, columns=None) -> pd.DataFrame:
+        """
+        Read the results of the finished `samples` (or of all finished samples),
+        in long format with the sample column, as returned by `by_sample`.
+        """
+        finished = self.finished()
+        samples = finished if samples is None else list(samples)
+        missing = [sample for sample in samples if sample not in finished]
+        if missing:
+            raise ValueError(f"{missing} are not in the store at `{self.path}`.")
+        results = [lr_res for _, lr_res in self.iter_samples(samples, columns=columns)]
+        return _concat_samples(results, pd.Index(samples), self.sample_key, compact=self.meta['compact'])
+
+    def _sample_path(self, sample) -> str:
+        return os.path.join(self.path, f"{quote(str(self.sample_key), safe='')}={quote(str(sample), safe='')}.h5")
+
+    def _write_meta(self):
+        meta_path = os.path.join(self.path, _META)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+
+def _get_params(params: dict) -> dict:
+    """
+    The parameters of a run, as JSON, so that they can be compared with those of the store.
+    DataFrames (e.g. `resource`) are represented by their shape & a hash of their values.
+    """
+    def to_json(value):
+        if isinstance(value, pd.DataFrame):
+            return {'shape': list(value.shape),
+                    'hash': str(pd.util.hash_pandas_object(value, index=False).sum())}
+        if isinstance(value, np.generic):
+            return value.item()
+        if callable(value):
+            return f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', repr(value))}"
+        return repr(value)
+
+    return json.loads(json.dumps(params, default=to_json, sort_keys=True))
+
+
+def _is_store(liana_res) -> bool:
+    return isinstance(liana_res, (str, os.PathLike))
+
+
+def _read_res(liana_res, columns, optional=()) -> pd.DataFrame:
+    """
+    Results as a DataFrame, read from a store (i.e. its path) with only the `columns` & the sample column,
+    and any of the `optional` columns that are in the store. DataFrames are returned as they are.
+    """
+    if not _is_store(liana_res):
+        return liana_res
+    store = _ResultStore(liana_res)
+    columns = list(columns) + [col for col in optional if col in store.columns]
+    return store.read(columns=columns)
+
+
+def _write_column(f, name, values: pd.Series):
+    if isinstance(values.dtype, pd.CategoricalDtype) or (values.dtype == object):
+        kind = 'category' if isinstance(values.dtype, pd.CategoricalDtype) else 'object'
+        values = pd.Categorical(values)
+        dset = f.create_dataset(name, data=values.codes)
+        dset.attrs['ordered'] = values.ordered
+        _write_categories(f, name + '_categories', values.categories)
+    else:
+        kind = 'values'
+        dset = f.create_dataset(name, data=values.values)
+    dset.attrs['kind'] = kind
+
+
+def _write_categories(f, name, categories: pd.Index):
+    # numeric & boolean categories keep their dtype, while any other should be strings
+    if categories.dtype.kind in 'biuf':
+        f.create_dataset(name, data=categories.values)
+        return
+    if not all(isinstance(category, str) for category in categories):
+        raise TypeError(f"Only string, numeric or boolean values can be stored, not {categories.dtype} "
+                        f"(e.g. {categories[0]!r}).")
+    f.create_dataset(name, data=np.asarray(categories, dtype=object), dtype=h5py.string_dtype())
+
+
+def _read_column(f, name):
+    dset = f[name]
+    kind = dset.attrs['kind']
+    if kind == 'values':
+        return dset[()]
+    categories = f[name + '_categories']
+    categories = categories.asstr()[()] if h5py.check_string_dtype(categories.dtype) else categories[()]
+    values = pd.Categorical.from_codes(dset[()], categories=categories, ordered=bool(dset.attrs['ordered']))
+    return values if kind == 'category' else np.asarray(values, dtype=object)
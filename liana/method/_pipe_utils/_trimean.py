@@ -0,0 +1,212 @@
+"""
+Sparse trimean, i.e. (Q1 + 2 * median + Q3) / 4, as used by CellChat.
+"""
+import numba as nb
+import numpy as np
+from scipy.sparse import csc_matrix, issparse
+from scipy.stats import norm
+
+
+def _trimean(a, axis=0):
+    quantiles = np.quantile(a.A, q=[0.25, 0.75], axis=axis)
+    median = np.median(a.A, axis=axis)
+    return (quantiles[0] + 2 * median + quantiles[1]) / 4
+
+
+def _sparse_trimean(X, label_codes, n_labels, perm_idxs=None) -> np.ndarray:
+    """
+    Trimean of each gene in each label, without densifying X.
+
+    Parameters
+    ----------
+    X
+        Cells x genes sparse matrix.
+    label_codes
+        Label code of each cell.
+    n_labels
+        Number of labels.
+    perm_idxs
+        Optional list of permuted cell indices. Then, the cells `perm_idx[label_codes == label]`
+        are assigned to each label, for each permutation.
+
+    Returns
+    -------
+    An array of shape (n_labels, n_genes), or (n_perms, n_labels, n_genes) if `perm_idxs` is passed.
+    Equivalent to calling `_trimean` on the rows of each label.
+    """
+    if not issparse(X):
+        X = csc_matrix(X)
+    X = X.tocsc()
+    X.sort_indices()
+
+    label_codes = np.asarray(label_codes, dtype=np.int64)
+    if perm_idxs is None:
+        codes = label_codes[np.newaxis, :]
+    else:
+        # permuted label of each cell
+        codes = np.empty((len(perm_idxs), label_codes.shape[0]), dtype=np.int64)
+        for perm, perm_idx in enumerate(perm_idxs):
+            codes[perm, perm_idx] = label_codes
+    counts = np.bincount(label_codes, minlength=n_labels).astype(np.int64)
+
+    trimeans = _csc_trimean(X.data, X.indices.astype(np.int64), X.indptr.astype(np.int64),
+                            codes, counts, n_labels, X.dtype.type(0))
+
+    return trimeans[0] if perm_idxs is None else trimeans
+
+
+@nb.njit(parallel=True, cache=True)
+def _csc_trimean(data, indices, indptr, codes, counts, n_labels, zero):
+    n_perms, n_genes = codes.shape[0], indptr.shape[0] - 1
+    trimeans = np.empty((n_perms, n_labels, n_genes), dtype=np.float64)
+
+    for job in nb.prange(n_perms * n_genes):
+        perm, gene = job // n_genes, job % n_genes
+        start, stop = indptr[gene], indptr[gene + 1]
+
+        # bucket the non-zero values of the gene by label
+        offsets = np.zeros(n_labels + 1, dtype=np.int64)
+        for pos in range(start, stop):
+            offsets[codes[perm, indices[pos]] + 1] += 1
+        offsets = np.cumsum(offsets)
+        fill = offsets[:-1].copy()
+        values = np.empty(stop - start, dtype=data.dtype)
+        for pos in range(start, stop):
+            label = codes[perm, indices[pos]]
+            values[fill[label]] = data[pos]
+            fill[label] += 1
+
+        for label in range(n_labels):
+            label_values = values[offsets[label]:offsets[label + 1]]
+            label_values.sort()
+            trimeans[perm, label, gene] = _sorted_trimean(label_values, counts[label], zero)
+
+    return trimeans
+
+
+@nb.njit(cache=True)
+def _sorted_trimean(values, n, zero):
+    # values are the sorted non-zero values, while the remaining n - len(values) are implicit zeros,
+    # `zero` is a zero in the dtype of the data, so that the interpolation is done in the same precision
+    if n == 0:
+        return np.nan
+    n_neg = np.searchsorted(values, 0, side='left')
+    n_pos = values.shape[0] - np.searchsorted(values, 0, side='right')
+
+    q1 = _sorted_quantile(values, n, n_neg, n_pos, zero, 0.25)
+    q3 = _sorted_quantile(values, n, n_neg, n_pos, zero, 0.75)
+
+    # NOTE: as in np.median, the middle values are averaged in the dtype of the data
+    if n % 2 == 1:
+        median = np.float64(_kth(values, n, n_neg, n_pos, zero, n // 2))
+    else:
+        median = np.float64(_kth(values, n, n_neg, n_pos, zero, n // 2 - 1) +
+                            _kth(values, n, n_neg, n_pos, zero, n // 2)) / 2
+
+    return (q1 + 2 * median + q3) / 4
+
+
+@nb.njit(cache=True)
+def _sorted_quantile(values, n, n_neg, n_pos, zero, q):
+    # linear interpolation, as in np.quantile
+    virtual = (n - 1) * q
+    lower = int(np.floor(virtual))
+    upper = min(lower + 1, n - 1)
+    gamma = virtual - lower
+
+    a = _kth(values, n, n_neg, n_pos, zero, lower)
+    b = _kth(values, n, n_neg, n_pos, zero, upper)
+    diff = b - a
+    if gamma >= 0.5:
+        return b - diff * (1 - gamma)
+    return a + diff * gamma
+
+
+@nb.njit(cache=True)
+def _kth(values, n, n_neg, n_pos, zero, k):
+    # k-th smallest value, with the zeros between the negative and positive values
+    if k < n_neg:
+        return values[k]
+    if k < n - n_pos:
+        return zero
+    return values[values.shape[0] - (n - k)]
+
+
+def _sparse_quantiles(X, qs) -> np.ndarray:
+    """
+    Quantiles of each gene across all cells, as in `np.quantile(X.A, qs, axis=0)`, without densifying X.
+
+    Returns
+    -------
+    An array of shape (len(qs), n_genes)
+    """
+    if not issparse(X):
+        X = csc_matrix(X)
+    X = X.tocsc()
+
+    return _csc_quantiles(X.data, X.indptr.astype(np.int64), X.shape[0],
+                          np.asarray(qs, dtype=np.float64), X.dtype.type(0))
+
+
+@nb.njit(parallel=True, cache=True)
+def _csc_quantiles(data, indptr, n, qs, zero):
+    n_genes = indptr.shape[0] - 1
+    quantiles = np.empty((qs.shape[0], n_genes), dtype=np.float64)
+
+    for gene in nb.prange(n_genes):
+        values = np.sort(data[indptr[gene]:indptr[gene + 1]])
+        n_neg = np.searchsorted(values, 0, side='left')
+        n_pos = values.shape[0] - np.searchsorted(values, 0, side='right')
+        for idx in range(qs.shape[0]):
+            quantiles[idx, gene] = _sorted_quantile(values, n, n_neg, n_pos, zero, qs[idx])
+
+    return quantiles
+
+
+def _sparse_trimean_moments(X, counts) -> tuple:
+    """
+    Approximate mean & variance of the trimean of a random subset of cells, for each label size.
+
+    The trimean is a linear combination of the quartiles, which are asymptotically jointly normal,
+    with their variance depending on the sparsity (i.e. the derivative of the quantile function).
+    The sparsity is estimated from the quantiles of all cells, with the bandwidth of Bofinger (1975).
+
+    Parameters
+    ----------
+    X
+        Cells x genes sparse matrix.
+    counts
+        Number of cells in each label.
+
+    Returns
+    -------
+    A tuple with the means and variances, each of shape (n_labels, n_genes).
+    """
+    n_cells = X.shape[0]
+    counts = np.asarray(counts, dtype=np.float64)
+    n_labels = counts.shape[0]
+    probs = np.array([0.25, 0.5, 0.75])
+    weights = np.array([0.25, 0.5, 0.25])
+
+    # Bofinger bandwidth, for each label size & quartile
+    z = norm.ppf(probs)
+    bandwidth = counts[:, np.newaxis] ** (-1 / 5) * \
+        (4.5 * norm.pdf(z) ** 4 / (2 * z ** 2 + 1) ** 2) ** (1 / 5)
+    lower = np.clip(probs - bandwidth, 0, 1)
+    upper = np.clip(probs + bandwidth, 0, 1)
+
+    quantiles = _sparse_quantiles(X, np.concatenate([probs, lower.ravel(), upper.ravel()]))
+    n_genes = quantiles.shape[1]
+    sparsity = (quantiles[3 + n_labels * 3:] - quantiles[3:3 + n_labels * 3]) / \
+        (upper - lower).reshape(-1, 1)
+    sparsity = sparsity.reshape(n_labels, 3, n_genes)
+
+    # covariance of the empirical cdf at the quartiles
+    cov = np.minimum.outer(probs, probs) - np.multiply.outer(probs, probs)
+    variances = np.einsum('i,j,ij,lig,ljg->lg', weights, weights, cov, sparsity, sparsity)
+    # finite population correction, as labels are sampled without replacement
+    variances *= ((n_cells - counts) / (max(n_cells - 1, 1) * counts))[:, np.newaxis]
+
+    means = np.broadcast_to(weights @ quantiles[:3], (n_labels, n_genes))
+
+    return means, variances
@@ -1,16 +1,24 @@
 from __future__ import annotations
 
 from liana.method.sc._liana_pipe import liana_pipe
+from liana.method._pipe_utils._pre import _choose_mtx_rep, _is_backed_mtx, _read_backed_rows, \
+    _check_mtx, _PreparedMatrix
+from liana.method._pipe_utils._results import _compact_res, _concat_samples
+from liana.method._pipe_utils._store import _ResultStore
+from liana.resource.select_resource import _handle_resource
 from liana.utils import mdata_to_anndata
 from liana._logging import _logg
 from liana._docs import d
-from liana._constants import Keys as K, DefaultValues as V
+from liana._constants import Keys as K, DefaultValues as V, InternalValues as I
 
 import anndata as an
 from mudata import MuData
+import numpy as np
 from pandas import DataFrame, concat
 from typing import Optional
+from inspect import signature
 from tqdm import tqdm
+from joblib import Parallel, delayed, effective_n_jobs
 import weakref
 
 
@@ -95,6 +103,7 @@ class MethodMeta:
                   sample_key: str,
                   key_added: str = K.uns_key,
                   inplace: bool = V.inplace,
+                  store: Optional[str] = None,
                   verbose: bool = V.verbose,
                   **kwargs):
         """
@@ -106,16 +115,21 @@ class MethodMeta:
         %(sample_key)s
         %(key_added)s
         %(inplace)s
+        store
+            Path of a directory, to which the results of each sample are written as soon as they are obtained,
+            rather than being kept in memory. Samples which are already in the store, e.g. from a run that
+            was interrupted, are skipped. The results can be read with `li.ut.read_result_store`, and are read
+            lazily by `li.multi.lrs_to_views` & `li.multi.to_tensor_c2c`. If None, results are kept in memory.
         verbose
             Possible values: False, True, 'full', where 'full' will print the results for each sample,
             and True will only print the sample progress bar. Default is False.
         **kwargs
-            keyword arguments to pass to the method
+            keyword arguments to pass to the method. If `n_jobs` > 1, the samples are run in parallel.
 
         Returns
         -------
         A pandas DataFrame with the results and a column sample is stored in `adata.uns[key_added]` if `inplace` is True,
-        else the DataFrame is returned.
+        else the DataFrame is returned. If `store` is passed, its path is stored (or returned) instead.
 
         """
 
@@ -133,27 +147,163 @@ class MethodMeta:
             full_verbose = False
 
         samples = adata.obs[sample_key].cat.categories
+        n_jobs = kwargs.pop('n_jobs', 1)
+
+        result_store = None
+        if store is not None:
+            # NOTE: the samples in the store should have been run with the same parameters (incl. defaults)
+            params = {name: param.default for name, param in signature(self.__call__).parameters.items()
+                      if (param.default is not param.empty) and (name not in _RUNTIME_PARAMS)
+                      and not name.startswith('_')}
+            params.update({key: value for key, value in kwargs.items() if key not in _RUNTIME_PARAMS})
+            result_store = _ResultStore(store, sample_key=sample_key, samples=samples,
+                                        method_name=self.method_name, compact=params.pop('compact', V.compact),
+                                        params=params)
+            finished = result_store.finished()
+            _logg(f"{len(finished)} samples are already in `{store}`, and will be skipped.",
+                  verbose=verbose and (len(finished) > 0))
+            samples = samples[~samples.isin(finished)]
+
+        # resolve the resource & matrix once, and pass them to each sample
+        sample_data = _iter_sample_data(adata, sample_key, samples, kwargs, verbose=full_verbose)
+        if n_jobs == 1 or samples.shape[0] == 1:
+            kwargs['n_jobs'] = n_jobs
+            n_parallel = 1
+        else:
+            # parallelize across samples, rather than within each sample
+            kwargs['n_jobs'] = 1
+            n_parallel = effective_n_jobs(n_jobs)
+
+        results = []
+        progress_bar = tqdm(total=samples.shape[0], disable=not verbose)
+        with Parallel(n_jobs=n_parallel) as parallel:
+            for start in range(0, samples.shape[0], n_parallel):
+                chunk = samples[start:start + n_parallel]
+                if verbose:
+                    progress_bar.set_description(f"Now running: {', '.join(map(str, chunk))}")
+                chunk_res = parallel(delayed(self.__call__)(temp, inplace=False, verbose=full_verbose, **kwargs)
+                                     for _, temp in zip(chunk, sample_data))
+                if result_store is not None:
+                    # NOTE: only the results of the current chunk are kept in memory
+                    for sample, lr_res in zip(chunk, chunk_res):
+                        result_store.write(sample, lr_res)
+                else:
+                    results += chunk_res
+                progress_bar.update(chunk.shape[0])
+        progress_bar.close()
+
+        if result_store is not None:
+            liana_res = result_store.path
+        else:
+            liana_res = _concat_samples(results, samples, sample_key,
+                                        compact=kwargs.get('compact', V.compact))
+
+        if inplace:
+            adata.uns[key_added] = liana_res
+        return None if inplace else liana_res
 
-        adata.uns[key_added] = {}
+    @d.dedent
+    def prepare(self,
+                adata: an.AnnData | MuData,
+                groupby: str,
+                max_perm_cache: float = 5e7,
+                **kwargs):
+        """
+        Prepare a method for repeated queries, e.g. with different `expr_prop`, `groupby_pairs` or interactions.
 
-        progress_bar = tqdm(samples, disable=not verbose)
-        for sample in (progress_bar):
-            if verbose:
-                progress_bar.set_description(f"Now running: {sample}")
+        Parameters
+        ----------
+        %(adata)s
+        %(groupby)s
+        max_perm_cache
+            Maximum number of permuted aggregates to keep in memory for permutation-based methods,
+            i.e. `n_perms` x labels x genes, for each aggregation function (mean & trimean), at 4-8 bytes each.
+            If they fit, the permutations are run once and reused by all queries. Otherwise, e.g. for 1000
+            permutations, 60 labels & 3000 genes (1.8e8), or if 0 is passed, the permutations are run again,
+            one batch at a time, by each query.
+        **kwargs
+            keyword arguments to pass to the method, which are then the defaults of each query.
+
+        Returns
+        -------
+        A `PreparedPipe`, which when called with the query parameters returns the results of the method.
+        """
+        pipe = self.__call__(adata, groupby=groupby, inplace=False, _prepare=True, **kwargs)
+        pipe.max_perm_cache = max_perm_cache
+        return pipe
 
+    @d.dedent
+    def by_groupby(self,
+                   adata: an.AnnData | MuData,
+                   groupby: list,
+                   key_added: str = K.uns_key,
+                   inplace: bool = V.inplace,
+                   verbose: bool = V.verbose,
+                   **kwargs):
+        """
+        Run a method for several cell groupings, e.g. annotations at different resolutions.
 
-            temp = adata[adata.obs[sample_key]==sample]
-            if temp.isbacked:
-                temp = temp.to_memory().copy() # NOTE does to_memory copy?
-            else:
-                temp = temp.copy()
+        The matrix is checked, and the resource is resolved, once for all groupings.
+        Each grouping then runs only on the resource genes, with the stats across all genes precomputed.
 
-            sample_res = self.__call__(temp, inplace=False, verbose=full_verbose, **kwargs)
+        Parameters
+        ----------
+        %(adata)s
+        groupby
+            List of keys in `adata.obs` by which the observations are grouped, one per run.
+        %(key_added)s
+        %(inplace)s
+        verbose
+            Possible values: False, True, 'full', where 'full' will print the results for each grouping,
+            and True will only print the grouping progress bar. Default is False.
+        **kwargs
+            keyword arguments to pass to the method. If `n_jobs` > 1, the groupings are run in parallel.
 
-            adata.uns[key_added][sample] = sample_res
+        Returns
+        -------
+        A dictionary with the DataFrame of each grouping, keyed by `groupby`, is stored in `adata.uns[key_added]`
+        if `inplace` is True, else the dictionary is returned.
 
-        liana_res = concat(adata.uns[key_added]).reset_index(level=1, drop=True).reset_index()
-        liana_res = liana_res.rename({"index":sample_key}, axis=1)
+        """
+        groupby = [groupby] if isinstance(groupby, str) else list(groupby)
+        missing = [key for key in groupby if key not in adata.obs]
+        if missing:
+            raise ValueError(f"{', '.join(missing)} not found in `adata.obs`.")
+        if len(set(groupby)) != len(groupby):
+            raise ValueError("`groupby` keys must be unique.")
+
+        if verbose == 'full':
+            verbose = True
+            full_verbose = True
+        else:
+            full_verbose = False
+
+        n_jobs = kwargs.pop('n_jobs', 1)
+
+        # check the matrix & resolve the resource once, and pass them to each grouping
+        shared = _get_groupby_data(adata, groupby, kwargs, verbose=full_verbose)
+        if n_jobs == 1 or len(groupby) == 1:
+            kwargs['n_jobs'] = n_jobs
+            n_parallel = 1
+        else:
+            # parallelize across groupings, rather than within each grouping
+            kwargs['n_jobs'] = 1
+            n_parallel = effective_n_jobs(n_jobs)
+
+        results = []
+        progress_bar = tqdm(total=len(groupby), disable=not verbose)
+        with Parallel(n_jobs=n_parallel) as parallel:
+            for start in range(0, len(groupby), n_parallel):
+                chunk = groupby[start:start + n_parallel]
+                if verbose:
+                    progress_bar.set_description(f"Now running: {', '.join(chunk)}")
+                results += parallel(delayed(self.__call__)(shared, groupby=key, inplace=False,
+                                                           verbose=full_verbose, **kwargs)
+                                    for key in chunk)
+                progress_bar.update(len(chunk))
+        progress_bar.close()
+
+        liana_res = dict(zip(groupby, results))
 
         if inplace:
             adata.uns[key_added] = liana_res
@@ -189,18 +339,24 @@ class Method(MethodMeta):
                  base: float = V.logbase,
                  supp_columns: list = V.supp_columns,
                  return_all_lrs: bool = V.return_all_lrs,
+                 top_n: Optional[int] = V.top_n,
+                 score_thresholds: Optional[dict] = V.score_thresholds,
                  key_added: str = K.uns_key,
                  use_raw: Optional[bool] = V.use_raw,
                  layer: Optional[str] = V.layer,
                  de_method: str = V.de_method,
                  n_perms: int = V.n_perms,
+                 null_distribution: str = V.null_distribution,
+                 early_stop: Optional[int] = V.early_stop,
                  seed: int = V.seed,
                  n_jobs: int = 1,
                  resource: Optional[DataFrame] = V.resource,
                  interactions: Optional[list] = V.interactions,
                  mdata_kwargs: dict = dict(),
+                 compact: bool = V.compact,
                  inplace: bool = V.inplace,
                  verbose: Optional[bool] = V.verbose,
+                 _prepare: bool = False,
                  ):
         """
         Run a ligand-receptor method.
@@ -219,18 +375,23 @@ class Method(MethodMeta):
             or any of the columns returned by `scanpy.tl.rank_genes_groups`, each starting with ligand_* or receptor_*.
             For example, `['ligand_pvals', 'receptor_pvals']`. None by default.
         %(return_all_lrs)s
+        %(top_n_sc)s
+        %(score_thresholds)s
         %(key_added)s
         %(use_raw)s
         %(layer)s
         %(de_method)s
         %(verbose)s
         %(n_perms_sc)s
+        %(null_distribution)s
+        %(early_stop)s
         %(seed)s
         n_jobs
             Number of jobs to run in parallel.
         %(resource)s
         %(interactions)s
         %(mdata_kwargs)s
+        %(compact)s
         %(inplace)s
 
         Returns
@@ -256,21 +417,183 @@ class Method(MethodMeta):
                                min_cells=min_cells,
                                supp_columns=supp_columns,
                                return_all_lrs=return_all_lrs,
+                               top_n=top_n,
+                               score_thresholds=score_thresholds,
                                groupby_pairs=groupby_pairs,
                                base=base,
                                de_method=de_method,
                                verbose=verbose,
                                _score=self._method,
                                n_perms=n_perms,
+                               null_distribution=null_distribution,
+                               early_stop=early_stop,
                                seed=seed,
                                n_jobs=n_jobs,
                                use_raw=use_raw,
                                layer=layer,
+                               _prepare=_prepare
                                )
+        if _prepare:
+            liana_res.compact = compact
+            return liana_res
+
+        if compact:
+            liana_res = _compact_res(liana_res)
+
         if inplace:
             adata.uns[key_added] = liana_res
         return None if inplace else liana_res
 
 
+# parameters which do not change the results of a method
+_RUNTIME_PARAMS = ['inplace', 'key_added', 'verbose', 'n_jobs']
+
+
+def _iter_sample_data(adata, sample_key, samples, kwargs, verbose):
+    """
+    Return an iterator over a lightweight AnnData for each sample.
+
+    The matrix is chosen and converted to CSR once, and each sample is then a row slice of it,
+    with only the `groupby` column of `obs`. For backed AnnData objects, only the rows of each sample
+    and the columns of the resource genes are read from disk.
+    `use_raw` & `layer` are consumed here, while `resource` & `interactions` are resolved once
+    and passed as `resource`.
+    """
+    use_raw = kwargs.get('use_raw', V.use_raw)
+    layer = kwargs.get('layer', V.layer)
+
+    if isinstance(adata, an.AnnData) and adata.isbacked:
+        X = _get_backed_mtx(adata, use_raw=use_raw, layer=layer)
+        if not _is_backed_mtx(X):
+            return _iter_sample_copies(adata, sample_key, samples)
+    elif isinstance(adata, an.AnnData):
+        X = _choose_mtx_rep(adata=adata, use_raw=use_raw, layer=layer, verbose=verbose)
+    else:
+        return _iter_sample_copies(adata, sample_key, samples)
+
+    var_names = adata.raw.var_names if (use_raw and layer is None) else adata.var_names
+    kwargs.update(use_raw=False, layer=None)
+
+    interactions = kwargs.pop('interactions', V.interactions)
+    resource = kwargs.pop('resource', V.resource)
+    if interactions is not None or resource is not None:
+        resource = _handle_resource(interactions=interactions,
+                                    resource=resource,
+                                    verbose=verbose)
+        kwargs['resource'] = resource
+
+    groupby = kwargs.get('groupby')
+    obs = adata.obs[[groupby]] if groupby in adata.obs.columns else adata.obs
+    sample_codes = adata.obs[sample_key].cat.codes.values
+    sample_rows = (np.flatnonzero(sample_codes == code)
+                   for code in adata.obs[sample_key].cat.categories.get_indexer(samples))
+
+    if not adata.isbacked:
+        return (an.AnnData(X=X[rows], obs=_get_sample_obs(obs, rows), var=DataFrame(index=var_names))
+                for rows in sample_rows)
+
+    # read only the resource genes, unless DE stats (adjusted across all genes) are requested
+    if kwargs.get('supp_columns'):
+        cols = np.arange(var_names.shape[0])
+    else:
+        if resource is None:
+            resource = _handle_resource(resource_name=kwargs.get('resource_name', V.resource_name),
+                                        verbose=verbose)
+        cols = np.flatnonzero(var_names.isin(_resource_genes(resource)))
+
+    return (_read_sample(X, rows, cols, obs, var_names) for rows in sample_rows)
+
+
+def _get_groupby_data(adata, groupby, kwargs, verbose):
+    """
+    Return a lightweight AnnData, shared by all groupings.
+
+    The matrix is chosen, checked, and converted to a float32 CSR with only the resource genes once,
+    with only the `groupby` columns of `obs`, and the stats of each cell across all genes in `uns['@row_stats']`.
+    `use_raw`, `layer` & `mdata_kwargs` are consumed here, while `resource` & `interactions` are resolved once
+    and passed as `resource`, as in `_iter_sample_data`. Backed AnnData objects are returned as they are.
+    """
+    if isinstance(adata, MuData):
+        adata = mdata_to_anndata(adata, **kwargs.pop('mdata_kwargs', {}), verbose=verbose)
+    elif adata.isbacked:
+        return adata
+
+    use_raw = kwargs.get('use_raw', V.use_raw)
+    layer = kwargs.get('layer', V.layer)
+    X = _choose_mtx_rep(adata=adata, use_raw=use_raw, layer=layer, verbose=verbose)
+    var_names = adata.raw.var_names if (use_raw and layer is None) else adata.var_names
+    kwargs.update(use_raw=False, layer=None)
+
+    interactions = kwargs.pop('interactions', V.interactions)
+    resource = kwargs.pop('resource', V.resource)
+    if interactions is not None or resource is not None:
+        resource = _handle_resource(interactions=interactions,
+                                    resource=resource,
+                                    verbose=verbose)
+        kwargs['resource'] = resource
+    else:
+        # NOTE: named resources are exploded (& cached) once anyway
+        resource = _handle_resource(resource_name=kwargs.get('resource_name', V.resource_name),
+                                    verbose=verbose, explode=True)
+
+    prepared = _PreparedMatrix(X, var_names)
+    _check_mtx(prepared, verbose=verbose)
+    row_stats = prepared.row_stats()
+    prepared.subset_cols(prepared.var_names[prepared.cols].isin(_resource_genes(resource)))
+
+    return prepared.to_anndata(obs=adata.obs[groupby], uns={I.row_stats: row_stats})
+
+
+def _resource_genes(resource) -> np.ndarray:
+    """The unique genes of the ligands & receptors (or their subunits) in `resource`"""
+    return np.union1d(resource['ligand'].str.split('_').explode().astype(str),
+                      resource['receptor'].str.split('_').explode().astype(str))
+
+
+def _iter_sample_copies(adata, sample_key, samples):
+    # subset each sample in full, e.g. for MuData objects
+    for sample in samples:
+        temp = adata[adata.obs[sample_key] == sample]
+        if temp.isbacked:
+            temp = temp.to_memory().copy()  # NOTE does to_memory copy?
+        else:
+            temp = temp.copy()
+        yield temp
+
+
+def _get_sample_obs(obs, rows) -> DataFrame:
+    sample_obs = obs.iloc[rows].copy()
+    # drop unused categories, as when copying an AnnData view
+    for col in sample_obs.columns:
+        if sample_obs[col].dtype.name == 'category':
+            sample_obs[col] = sample_obs[col].cat.remove_unused_categories()
+    return sample_obs
+
+
+def _get_backed_mtx(adata, use_raw, layer):
+    if layer is not None:
+        return adata.layers[layer]
+    if use_raw:
+        return None if adata.raw is None else adata.raw.X
+    return adata.X
+
+
+def _read_sample(X, rows, cols, obs, var_names) -> an.AnnData:
+    """
+    Read the rows of a sample from a backed matrix, along with the stats of each cell across all genes,
+    in `uns['@row_stats']`, from which `prep_check_adata` obtains the whole-matrix & per-label stats.
+    """
+    sample_X, col_sums, row_sums, row_sq_sums, row_max = _read_backed_rows(X, rows, cols)
+    row_stats = {'sums': row_sums,
+                 'sq_sums': row_sq_sums,
+                 'max': row_max,
+                 'n_features': np.sum(col_sums != 0)}
+
+    return an.AnnData(X=sample_X,
+                      obs=_get_sample_obs(obs, rows),
+                      var=DataFrame(index=var_names[cols]),
+                      uns={I.row_stats: row_stats})
+
+
 def _show_methods(methods):
     return concat([method.get_meta() for method in methods])
@@ -1,6 +1,7 @@
 import numpy as np
 from liana.method.sc._Method import Method, MethodMeta
 from liana.method._pipe_utils._get_mean_perms import _calculate_pvals
+from liana.method._pipe_utils._kernels import _register_pair_kernel, _score_pairs, _PROBABILITY
 
 
 # simplified/resource-generalizable cellchat probability score
@@ -27,7 +28,7 @@ def _cellchat_score(x, perm_stats) -> tuple:
     A tuple with lr_mean and pvalue for x
 
     """
-    lr_prob = _lr_probability((x['ligand_trimean'].values, x['receptor_trimean'].values))
+    lr_prob = _score_pairs(_lr_probability, x['ligand_trimean'].values, x['receptor_trimean'].values)
     cellchat_pvals = _calculate_pvals(lr_prob, perm_stats, _lr_probability)
 
     return lr_prob, cellchat_pvals
@@ -51,3 +52,4 @@ _cellchat = MethodMeta(method_name="CellChat",
 
 cellchat = Method(_method=_cellchat)
 cellchat._kh = 0.5
+_register_pair_kernel(_lr_probability, _PROBABILITY, get_param=lambda: cellchat._kh)
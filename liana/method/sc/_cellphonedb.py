@@ -1,9 +1,7 @@
-import numpy as np
 from liana.method.sc._Method import Method, MethodMeta
-from liana.method._pipe_utils._get_mean_perms import _calculate_pvals
+from liana.method._pipe_utils._get_mean_perms import _calculate_pvals, _mean
+from liana.method._pipe_utils._kernels import _register_pair_kernel, _score_pairs, _MEAN
 
-def _mean(a, axis=0):
-    return np.mean(a, axis=axis)
 
 # Internal Function to calculate CellPhoneDB LR_mean and p-values
 def _cpdb_score(x, perm_stats) -> tuple:
@@ -23,7 +21,7 @@ def _cpdb_score(x, perm_stats) -> tuple:
 
     """
     zero_msk = ((x['ligand_means'] == 0) | (x['receptor_means'] == 0))
-    lr_means = _mean((x['ligand_means'].values, x['receptor_means'].values))
+    lr_means = _score_pairs(_mean, x['ligand_means'].values, x['receptor_means'].values)
     lr_means[zero_msk] = 0
     cpdb_pvals = _calculate_pvals(lr_means, perm_stats, _mean)
 
@@ -48,3 +46,4 @@ _cellphonedb = MethodMeta(method_name="CellPhoneDB",
                           )
 
 cellphonedb = Method(_method=_cellphonedb)
+_register_pair_kernel(_mean, _MEAN)
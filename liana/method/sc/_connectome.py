@@ -1,5 +1,8 @@
+import numba as nb
+import numpy as np
+
 from liana.method.sc._Method import Method, MethodMeta
-from numpy import mean
+from liana.method._pipe_utils._kernels import _register_score_kernel
 
 
 def _connectome_score(x) -> tuple:
@@ -20,7 +23,19 @@ def _connectome_score(x) -> tuple:
     expr_prod = x['ligand_means'].values * x['receptor_means'].values
 
     # specificity
-    scaled_weight = mean((x['ligand_zscores'].values, x['receptor_zscores'].values), axis=0)
+    scaled_weight = np.mean((x['ligand_zscores'].values, x['receptor_zscores'].values), axis=0)
+    return expr_prod, scaled_weight
+
+
+@_register_score_kernel(_connectome_score, ['ligand_means', 'receptor_means',
+                                            'ligand_zscores', 'receptor_zscores'])
+@nb.njit(parallel=True, cache=True, error_model='numpy')
+def _connectome_kernel(ligand_means, receptor_means, ligand_zscores, receptor_zscores):
+    expr_prod = np.empty_like(ligand_means)
+    scaled_weight = np.empty_like(ligand_zscores)
+    for row in nb.prange(ligand_means.shape[0]):
+        expr_prod[row] = ligand_means[row] * receptor_means[row]
+        scaled_weight[row] = (ligand_zscores[row] + receptor_zscores[row]) / 2
     return expr_prod, scaled_weight
 
 
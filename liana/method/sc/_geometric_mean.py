@@ -2,6 +2,7 @@ from scipy.stats import gmean
 
 from liana.method.sc._Method import Method, MethodMeta
 from liana.method._pipe_utils._get_mean_perms import _calculate_pvals
+from liana.method._pipe_utils._kernels import _register_pair_kernel, _score_pairs, _GMEAN
 
 def _gmean_score(x, perm_stats) -> tuple:
     """
@@ -19,7 +20,7 @@ def _gmean_score(x, perm_stats) -> tuple:
     A tuple with lr_mean and p-value for x
 
     """
-    lr_gmeans = gmean((x['ligand_means'].values, x['receptor_means'].values), axis=0)
+    lr_gmeans = _score_pairs(gmean, x['ligand_means'].values, x['receptor_means'].values)
     gmean_pvals = _calculate_pvals(lr_gmeans, perm_stats, gmean)
 
     return lr_gmeans, gmean_pvals
@@ -39,3 +40,4 @@ _geometric_mean = MethodMeta(method_name="Geometric Mean",
                              )
 
 geometric_mean = Method(_method=_geometric_mean)
+_register_pair_kernel(gmean, _GMEAN)
@@ -7,14 +7,22 @@ import pandas
 import scanpy as sc
 import pandas as pd
 import numpy as np
+from scipy.sparse import csr_matrix
 from scipy.stats import norm
 
 from liana.method._pipe_utils import prep_check_adata, assert_covered, filter_resource
-from liana.method._pipe_utils._common import _join_stats, _get_props, _get_groupby_subset
+from liana.method._pipe_utils._common import _join_lr_stats, _get_groupby_subset, \
+    _get_group_stats, _label_indicator, _to_dense
 from liana.resource.select_resource import _handle_resource
-from liana.resource import explode_complexes, filter_reassemble_complexes
-from liana.method._pipe_utils._get_mean_perms import _get_means_perms, _get_mat_idx
+from liana.resource import filter_reassemble_complexes
+from liana.method._pipe_utils._get_mean_perms import _iter_means_perms, _iter_perm_stats, \
+    _get_mat_idx, _get_batch_size, _PermutationCache, _get_analytic_null, \
+    _AdaptivePerms
+from liana.method._pipe_utils._kernels import _score_lr
 from liana.method._pipe_utils._aggregate import _aggregate
+from liana.method._pipe_utils._trimean import _trimean, _sparse_trimean
+from liana.method._pipe_utils._rank_genes import _DE_METHODS, _rank_genes_stats
+from liana.method._pipe_utils._results import _compact_res
 from liana._constants import MethodColumns as M, CommonColumns as C, \
                             PrimaryColumns as P, InternalValues as I
 
@@ -36,10 +44,15 @@ def liana_pipe(adata: anndata.AnnData,
                layer: str | None,
                supp_columns: list | None = None,
                return_all_lrs: bool = False,
+               top_n: int | None = None,
+               score_thresholds: dict | None = None,
+               null_distribution: str = 'permutation',
+               early_stop: int | None = None,
                _score=None,
                _methods: list = None,
                _consensus_opts: list = None,
-               _aggregate_method: str | None = None
+               _aggregate_method: str | None = None,
+               _prepare: bool = False
                ):
     """
     Parameters
@@ -62,8 +75,8 @@ def liana_pipe(adata: anndata.AnnData,
     base
         The base by which to do expm1 (relevant only for 1vsRest logFC calculation)
     de_method
-        Differential expression method. `scanpy.tl.rank_genes_groups` is used to rank genes
-        according to 1vsRest. The default method is 't-test'. Only relevant if p-values
+        Differential expression method, by which genes are ranked according to 1vsRest, as in
+        `scanpy.tl.rank_genes_groups`. The default method is 't-test'. Only relevant if p-values
         are included in `supp_cols`
     n_perms
         n permutations (relevant only for permutation-based methods)
@@ -80,6 +93,15 @@ def liana_pipe(adata: anndata.AnnData,
     return_all_lrs
         Bool whether to return all LRs, or only those that surpass the expr_prop threshold.
         `False` by default.
+    top_n
+        Number of top-ranked interactions to return. If None, all are returned.
+    score_thresholds
+        Dictionary of score names and thresholds, which the returned interactions should pass.
+    null_distribution
+        Whether p-values are obtained by 'permutation', or approximated in closed form ('analytic').
+    early_stop
+        Number of permuted scores >= the observed score after which the permutations of an interaction
+        are stopped. If None, all permutations are run.
     _score
         Instance of Method classes (None by default - returns LR stats - no methods used).
     _methods
@@ -88,14 +110,23 @@ def liana_pipe(adata: anndata.AnnData,
         Ways to aggregate interactions across methods by default does all aggregations (['Specificity', 'Magnitude']).
     _aggregate_method
         RobustRankAggregate('rra') or mean rank ('mean').
+    _prepare
+        Whether to return a `PreparedPipe`, i.e. the ligand-receptor stats prior to filtering & scoring.
 
     Returns
     -------
-    A adata frame with ligand-receptor results
+    A adata frame with ligand-receptor results, or a `PreparedPipe` if `_prepare`.
 
     """
     _key_cols = P.primary
 
+    if null_distribution not in ['permutation', 'analytic']:
+        raise ValueError("`null_distribution` must be one of ['permutation', 'analytic'].")
+    if (early_stop is not None) and (early_stop < 1):
+        raise ValueError("`early_stop` must be a positive integer or None.")
+    if (top_n is not None) and (top_n < 1):
+        raise ValueError("`top_n` must be a positive integer or None.")
+
     if _score is not None:
         _complex_cols, _add_cols = _score.complex_cols, _score.add_cols
     else:
@@ -114,31 +145,36 @@ def liana_pipe(adata: anndata.AnnData,
     mat_mean = None
     mat_max = None
 
+    # whole-matrix stats, precomputed if only the resource genes were read from disk
+    mat_stats = adata.uns.get(I.mat_stats, {})
+
+    resource = _handle_resource(interactions=interactions,
+                                resource=resource,
+                                resource_name=resource_name,
+                                verbose=verbose,
+                                explode=True)
+
+    # NOTE: only the resource genes are prepared, along with the stats across all genes
     groupby_subset = _get_groupby_subset(groupby_pairs=groupby_pairs)
     adata = prep_check_adata(adata=adata,
                              groupby=groupby,
                              groupby_subset=groupby_subset,
+                             var_subset=np.union1d(np.unique(resource[P.ligand]),
+                                                   np.unique(resource[P.receptor])),
                              min_cells=min_cells,
                              use_raw=use_raw,
                              layer=layer,
                              verbose=verbose)
+    mat_stats = {**adata.uns[I.mat_stats], **mat_stats}
 
     if M.mat_mean in _add_cols:
-        mat_mean = np.mean(adata.X, dtype='float32')
+        mat_mean = mat_stats[M.mat_mean]
 
     # get mat max for CellChat
     if M.mat_max in _add_cols:
-        mat_max = adata.X.max()
+        mat_max = mat_stats[M.mat_max]
         assert isinstance(mat_max, np.float32)
 
-    resource = _handle_resource(interactions=interactions,
-                                resource=resource,
-                                resource_name=resource_name,
-                                verbose=verbose)
-
-    # explode complexes/decomplexify
-    resource = explode_complexes(resource)
-
     # Check overlap between resource and adata
     assert_covered(np.union1d(np.unique(resource[P.ligand]),
                               np.unique(resource[P.receptor])),
@@ -149,7 +185,7 @@ def liana_pipe(adata: anndata.AnnData,
 
     # Cluster stats
     if (M.ligand_cdf in _add_cols) or (M.receptor_cdf in _add_cols):
-        cluster_stats = _cluster_stats(adata)
+        cluster_stats = _cluster_stats(adata, mat_stats.get(I.label_moments))
 
     # Create Entities
     entities = np.union1d(np.unique(resource[P.ligand]),
@@ -177,83 +213,327 @@ def liana_pipe(adata: anndata.AnnData,
     if (M.ligand_cdf in _add_cols) or (M.receptor_cdf in _add_cols):
         lr_res = _complex_score(lr_res, cluster_stats)
 
-    # Mean Sums required for NATMI (note done on subunits also)
-    if M.ligand_means_sums in _add_cols:
-        on = [x for x in P.complete if x != P.source]
-        lr_res = _sum_means(lr_res, what=C.ligand_means, on=on)
-    if M.receptor_means_sums in _add_cols:
-        on = [x for x in P.complete if x != P.target]
-        lr_res = _sum_means(lr_res, what=C.receptor_means, on=on)
+    pipe = PreparedPipe(adata=adata,
+                        lr_res=lr_res,
+                        mat_max=mat_max,
+                        expr_prop=expr_prop,
+                        return_all_lrs=return_all_lrs,
+                        top_n=top_n,
+                        score_thresholds=score_thresholds,
+                        n_perms=n_perms,
+                        seed=seed,
+                        null_distribution=null_distribution,
+                        early_stop=early_stop,
+                        n_jobs=n_jobs,
+                        verbose=verbose,
+                        _score=_score,
+                        _key_cols=_key_cols,
+                        _complex_cols=_complex_cols,
+                        _add_cols=_add_cols,
+                        _methods=_methods,
+                        _consensus_opts=_consensus_opts,
+                        _aggregate_method=_aggregate_method)
+    if _prepare:
+        return pipe
+
+    # NOTE: permutations are only shared by the methods of a consensus
+    perm_cache = None
+    if (_score is not None) and (_score.method_name == "Rank_Aggregate"):
+        perm_cache = pipe._get_perm_cache()
+
+    return pipe._score_lrs(lr_res, expr_prop=expr_prop, return_all_lrs=return_all_lrs,
+                           top_n=top_n, score_thresholds=score_thresholds,
+                           perm_cache=perm_cache, _consensus_opts=_consensus_opts,
+                           _aggregate_method=_aggregate_method)
+
+
+class PreparedPipe:
+    """
+    The ligand-receptor stats of a method, prepared once and scored for each query.
+
+    The per-label stats are joined with the (exploded) resource once. Each query then only filters the cached
+    ligand-receptor stats, by `expr_prop`, `groupby_pairs` and/or interactions, and (re-)scores them.
+    The permuted aggregates (n_perms x labels x genes, for each aggregation function) are computed at the first
+    query and kept, if they fit in `max_perm_cache`, else the permutations are run again (streamed) by each query.
+    Returned by `prepare`, e.g. `li.mt.cellphonedb.prepare(adata, groupby='bulk_labels')`.
+
+    Note
+    ----
+    The cells & labels are those of the preparation, so querying a subset of `groupby_pairs`
+    only keeps those pairs, while passing it when preparing (or running) a method also removes the cells
+    of any other labels, and hence changes the 1 vs rest stats & the permutations.
+    Only the (full) permutation null is cached, i.e. the analytic and early-stopped nulls are
+    computed for each query.
+    """
+    def __init__(self, adata, lr_res, mat_max, expr_prop, return_all_lrs, top_n, score_thresholds,
+                 n_perms, seed, null_distribution, early_stop, n_jobs, verbose, _score, _key_cols,
+                 _complex_cols, _add_cols, _methods=None, _consensus_opts=None, _aggregate_method=None):
+        self.adata = adata
+        self.lr_res = lr_res
+        self.mat_max = mat_max
+        self.expr_prop = expr_prop
+        self.return_all_lrs = return_all_lrs
+        self.top_n = top_n
+        self.score_thresholds = score_thresholds
+        self.n_perms = n_perms
+        self.seed = seed
+        self.null_distribution = null_distribution
+        self.early_stop = early_stop
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.compact = False
+        self._score = _score
+        self._key_cols = _key_cols
+        self._complex_cols = _complex_cols
+        self._add_cols = _add_cols
+        self._methods = _methods
+        self._consensus_opts = _consensus_opts
+        self._aggregate_method = _aggregate_method
+        # NOTE: set by `prepare`, i.e. the permutations of a single run are not kept
+        self.max_perm_cache = 0
+        self._perm_cache = None
+
+    def __call__(self,
+                 expr_prop: float | None = None,
+                 groupby_pairs: pd.DataFrame | None = None,
+                 resource: pd.DataFrame | None = None,
+                 interactions: list | None = None,
+                 return_all_lrs: bool | None = None,
+                 top_n: int | None = None,
+                 score_thresholds: dict | None = None,
+                 aggregate_method: str | None = None,
+                 consensus_opts: list | None = None):
+        """
+        Score the prepared ligand-receptor stats.
+
+        Parameters
+        ----------
+        expr_prop
+            Minimum expression proportion for the ligands/receptors (and their subunits).
+            If None, the one of the preparation is used.
+        groupby_pairs
+            DataFrame with `source` & `target` columns, with the pairs of labels to keep.
+            If None, all prepared pairs are kept.
+        resource
+            DataFrame with [`ligand`, `receptor`] columns, with the interactions to keep.
+            Interactions which were not prepared are ignored.
+        interactions
+            List of (ligand, receptor) tuples with the interactions to keep, alternatively to `resource`.
+        return_all_lrs
+            Whether to return all interactions, or only those that pass `expr_prop`.
+            If None, the one of the preparation is used.
+        top_n, score_thresholds
+            Number of top-ranked interactions, and score thresholds, as in the method.
+            If None, those of the preparation are used.
+        aggregate_method, consensus_opts
+            As in `rank_aggregate`. If None, those of the preparation are used.
+
+        Returns
+        -------
+        A DataFrame with the ligand-receptor results, as returned by the method.
+        """
+        expr_prop = self.expr_prop if expr_prop is None else expr_prop
+        return_all_lrs = self.return_all_lrs if return_all_lrs is None else return_all_lrs
+        top_n = self.top_n if top_n is None else top_n
+        score_thresholds = self.score_thresholds if score_thresholds is None else score_thresholds
+        aggregate_method = self._aggregate_method if aggregate_method is None else aggregate_method
+        consensus_opts = self._consensus_opts if consensus_opts is None else consensus_opts
+
+        msk = np.ones(self.lr_res.shape[0], dtype=bool)
+        if groupby_pairs is not None:
+            msk &= _isin_pairs(self.lr_res, groupby_pairs, [P.source, P.target])
+        if (resource is not None) or (interactions is not None):
+            resource = _handle_resource(interactions=interactions, resource=resource, verbose=self.verbose)
+            msk &= _isin_pairs(self.lr_res,
+                               resource.rename(columns={P.ligand: P.ligand_complex, P.receptor: P.receptor_complex}),
+                               [P.ligand_complex, P.receptor_complex])
+
+        liana_res = self._score_lrs(self.lr_res[msk],
+                                    expr_prop=expr_prop,
+                                    return_all_lrs=return_all_lrs,
+                                    top_n=top_n,
+                                    score_thresholds=score_thresholds,
+                                    perm_cache=self._get_perm_cache(),
+                                    _consensus_opts=consensus_opts,
+                                    _aggregate_method=aggregate_method)
+
+        if self.compact:
+            liana_res = {method: _compact_res(lrs) for method, lrs in liana_res.items()} \
+                if isinstance(liana_res, dict) else _compact_res(liana_res)
+        return liana_res
+
+    def _get_perm_cache(self):
+        # NOTE: early stopping is specific to the scores of each method
+        if (self.null_distribution != 'permutation') or (self.early_stop is not None) or (self._score is None):
+            return None
+        if (self._perm_cache is None) or (self._perm_cache.max_size != self.max_perm_cache):
+            methods = self._methods if self._score.method_name == "Rank_Aggregate" else [self._score]
+            self._perm_cache = _get_perm_cache(adata=self.adata,
+                                               methods=methods,
+                                               mat_max=self.mat_max,
+                                               n_perms=self.n_perms,
+                                               seed=self.seed,
+                                               n_jobs=self.n_jobs,
+                                               verbose=self.verbose,
+                                               max_size=self.max_perm_cache)
+        return self._perm_cache
+
+    def _score_lrs(self, lr_res, expr_prop, return_all_lrs, top_n, score_thresholds, perm_cache,
+                   _consensus_opts, _aggregate_method):
+        _score, _key_cols, _complex_cols, _add_cols = \
+            self._score, self._key_cols, self._complex_cols, self._add_cols
+        adata, n_perms, seed, n_jobs, verbose = self.adata, self.n_perms, self.seed, self.n_jobs, self.verbose
+        null_distribution, early_stop = self.null_distribution, self.early_stop
+
+        # Mean Sums required for NATMI (note done on subunits also)
+        if M.ligand_means_sums in _add_cols:
+            on = [x for x in P.complete if x != P.source]
+            lr_res = _sum_means(lr_res, what=C.ligand_means, on=on)
+        if M.receptor_means_sums in _add_cols:
+            on = [x for x in P.complete if x != P.target]
+            lr_res = _sum_means(lr_res, what=C.receptor_means, on=on)
+
+        # Calculate Score
+        if _score is not None:
+            if _score.method_name == "Rank_Aggregate":
+                # Run all methods in consensus
+                def run_methods(verbose):
+                    lrs = {}
+                    for method in self._methods:
+                        if verbose:
+                            print(f"Running {method.method_name}")
+
+                        lrs[method.method_name] = \
+                            _run_method(lr_res=lr_res.copy(),
+                                        adata=adata,
+                                        expr_prop=expr_prop,
+                                        _score=method,
+                                        _key_cols=_key_cols,
+                                        _complex_cols=method.complex_cols,
+                                        _add_cols=method.add_cols,
+                                        n_perms=n_perms,
+                                        seed=seed,
+                                        return_all_lrs=return_all_lrs,
+                                        n_jobs=n_jobs,
+                                        verbose=verbose,
+                                        null_distribution=null_distribution,
+                                        early_stop=early_stop,
+                                        perm_cache=perm_cache,
+                                        _aggregate_flag=True
+                                        )
+                    return lrs
+                lrs = _run_shared(run_methods, perm_cache, verbose)
+                if _consensus_opts is not False:
+                    lr_res = _aggregate(lrs,
+                                        consensus=_score,
+                                        aggregate_method=_aggregate_method,
+                                        _key_cols=_key_cols,
+                                        _consensus_opts=_consensus_opts,
+                                        # NOTE: sorted (or selected) below
+                                        _sort=(top_n is None) and (score_thresholds is None)
+                                        )
+                else:  # Return by method results as they are
+                    if (top_n is None) and (score_thresholds is None):
+                        return lrs
+                    return {method.method_name: _select_lrs(lrs[method.method_name], *_get_orderby(method),
+                                                            top_n=top_n, score_thresholds=score_thresholds,
+                                                            directions=_get_directions([method]))
+                            for method in self._methods}
+            else:  # Run the specific method in mind
+                lr_res = _run_shared(lambda verbose: _run_method(lr_res=lr_res,
+                                                                 adata=adata,
+                                                                 expr_prop=expr_prop,
+                                                                 _score=_score, _key_cols=_key_cols,
+                                                                 _complex_cols=_complex_cols,
+                                                                 _add_cols=_add_cols,
+                                                                 n_perms=n_perms,
+                                                                 return_all_lrs=return_all_lrs,
+                                                                 n_jobs=n_jobs,
+                                                                 verbose=verbose,
+                                                                 seed=seed,
+                                                                 null_distribution=null_distribution,
+                                                                 early_stop=early_stop,
+                                                                 perm_cache=perm_cache),
+                                     perm_cache, verbose)
+        else:  # Just return lr_res
+            lr_res = filter_reassemble_complexes(lr_res=lr_res,
+                                                 _key_cols=_key_cols,
+                                                 expr_prop=expr_prop,
+                                                 complex_cols=_complex_cols,
+                                                 return_all_lrs=return_all_lrs)
+
+        if _score is not None:
+            methods = [_score] + (self._methods if _score.method_name == "Rank_Aggregate" else [])
+            lr_res = _select_lrs(lr_res, *_get_orderby(_score),
+                                 top_n=top_n, score_thresholds=score_thresholds,
+                                 directions=_get_directions(methods))
+
+        return lr_res
+
+
+def _get_orderby(_score):
+    # the score by which results are sorted, and whether it is ascending
+    if _score.magnitude is not None:
+        return _score.magnitude, _score.magnitude_ascending
+    return _score.specificity, _score.specificity_ascending
+
+
+def _get_directions(methods) -> dict:
+    # whether each score of the methods is ascending, i.e. lower is better
+    directions = {}
+    for method in methods:
+        for score, ascending in [(method.magnitude, method.magnitude_ascending),
+                                 (method.specificity, method.specificity_ascending)]:
+            if score is not None:
+                directions.setdefault(score, ascending)
+    return directions
+
+
+def _select_lrs(lr_res, orderby, ascending, top_n=None, score_thresholds=None, directions=None):
+    """
+    Sort `lr_res` by `orderby`, keeping only the interactions which pass `score_thresholds`,
+    and of those the `top_n`.
+
+    The top interactions are selected with `np.argpartition`, so only they are sorted.
+    As with `sort_values`, NaN scores are last.
+    """
+    if (top_n is None) and (score_thresholds is None):
+        return lr_res.sort_values(by=orderby, ascending=ascending)
 
-    # Calculate Score
-    if _score is not None:
-        if _score.method_name == "Rank_Aggregate":
-            # Run all methods in consensus
-            lrs = {}
-            for method in _methods:
-                if verbose:
-                    print(f"Running {method.method_name}")
-
-                lrs[method.method_name] = \
-                    _run_method(lr_res=lr_res.copy(),
-                                adata=adata,
-                                expr_prop=expr_prop,
-                                _score=method,
-                                _key_cols=_key_cols,
-                                _complex_cols=method.complex_cols,
-                                _add_cols=method.add_cols,
-                                n_perms=n_perms,
-                                seed=seed,
-                                return_all_lrs=return_all_lrs,
-                                n_jobs=n_jobs,
-                                verbose=verbose,
-                                _aggregate_flag=True
-                                )
-            if _consensus_opts is not False:
-                lr_res = _aggregate(lrs,
-                                    consensus=_score,
-                                    aggregate_method=_aggregate_method,
-                                    _key_cols=_key_cols,
-                                    _consensus_opts=_consensus_opts,
-                                    )
-            else:  # Return by method results as they are
-                return lrs
-        else:  # Run the specific method in mind
-            lr_res = _run_method(lr_res=lr_res,
-                                 adata=adata,
-                                 expr_prop=expr_prop,
-                                 _score=_score, _key_cols=_key_cols,
-                                 _complex_cols=_complex_cols,
-                                 _add_cols=_add_cols,
-                                 n_perms=n_perms,
-                                 return_all_lrs=return_all_lrs,
-                                 n_jobs=n_jobs,
-                                 verbose=verbose,
-                                 seed=seed)
-    else:  # Just return lr_res
-        lr_res = filter_reassemble_complexes(lr_res=lr_res,
-                                             _key_cols=_key_cols,
-                                             expr_prop=expr_prop,
-                                             complex_cols=_complex_cols,
-                                             return_all_lrs=return_all_lrs)
+    msk = np.ones(lr_res.shape[0], dtype=bool)
+    for score, threshold in (score_thresholds or {}).items():
+        if (score not in directions) or (score not in lr_res.columns):
+            raise ValueError(f"`{score}` is not a score of the results, "
+                             f"it should be one of {[x for x in directions if x in lr_res.columns]}.")
+        values = lr_res[score].values
+        msk &= (values <= threshold) if directions[score] else (values >= threshold)
+    idx = np.flatnonzero(msk)
 
-    if _score is not None:
-        orderby, ascending =  (_score.magnitude, _score.magnitude_ascending) if _score.magnitude is not None \
-            else (_score.specificity, _score.specificity_ascending)
+    # lower keys are better
+    keys = lr_res[orderby].values[idx].astype(np.float64)
+    if not ascending:
+        keys = -keys
+    keys[np.isnan(keys)] = np.inf
 
-        lr_res = lr_res.sort_values(by=orderby, ascending=ascending)
+    if (top_n is not None) and (top_n < idx.shape[0]):
+        top = np.sort(np.argpartition(keys, top_n - 1)[:top_n])
+        idx, keys = idx[top], keys[top]
 
-    return lr_res
+    return lr_res.iloc[idx[np.argsort(keys, kind='stable')]]
+
+
+def _isin_pairs(lr_res, pairs, cols) -> np.ndarray:
+    # whether the values of `cols` in each row of lr_res are among those of the rows of `pairs`
+    return pd.MultiIndex.from_frame(lr_res[cols]).isin(pd.MultiIndex.from_frame(pairs[cols].astype(str)))
 
 
 def _get_lr(adata, resource, groupby_pairs, relevant_cols, mat_mean, mat_max, de_method, base, verbose):
     labels = adata.obs[I.label].cat.categories
+    label_codes = adata.obs[I.label].cat.codes.values
 
     # Method-specific stats
     connectome_flag = (M.ligand_zscores in relevant_cols) | (
                 M.receptor_zscores in relevant_cols)
-    if connectome_flag:
-        adata.layers['scaled'] = sc.pp.scale(adata, copy=True).X
 
     logfc_flag = (M.ligand_logfc in relevant_cols) | (
             M.receptor_logfc in relevant_cols)
@@ -263,43 +543,31 @@ def _get_lr(adata, resource, groupby_pairs, relevant_cols, mat_mean, mat_max, de
                 print("Assuming that counts were `natural` log-normalized!")
         elif ('log1p' not in adata.uns_keys()) & verbose:
             print("Assuming that counts were `natural` log-normalized!")
-        adata.layers['normcounts'] = adata.X.copy()
-        adata.layers['normcounts'].data = _expm1_base(adata.X.data, base)
-
-    # initialize dict
-    dedict = {}
 
     # Calc pvals + other stats per gene or not
     rank_genes_bool = (C.ligand_pvals in relevant_cols) | (C.receptor_pvals in relevant_cols)
+
+    # Calculate label x gene stats, for all labels at once
+    X = adata.X
+    group_stats = _get_group_stats(X, label_codes, labels.shape[0], moments=rank_genes_bool)
+    label_stats = {'props': group_stats['props'], 'means': group_stats['means']}
+    if connectome_flag:
+        label_stats['zscores'] = _label_zscores(X, label_codes, labels.shape[0])
+    if logfc_flag:
+        # NOTE: expm1 is applied to the non-zero values, i.e. without copying the structure of X
+        normcounts = csr_matrix((_expm1_base(X.data, base), X.indices, X.indptr), shape=X.shape)
+        label_stats['logfc'] = _calc_log2fc(normcounts, label_codes, labels.shape[0])
+    if isinstance(mat_max, np.float32):  # cellchat flag
+        label_stats['trimean'] = _sparse_trimean(X / mat_max, label_codes, labels.shape[0])
     if rank_genes_bool:
-        adata = sc.tl.rank_genes_groups(adata, groupby=I.label,
-                                        method=de_method, use_raw=False,
-                                        copy=True)
-
-    for label in labels:
-        temp = adata[adata.obs[I.label] == label, :]
-        a = _get_props(temp.X)
-        stats = pd.DataFrame({'names': temp.var_names, 'props': a}). \
-            assign(label=label).sort_values('names')
-        if rank_genes_bool:
-            pvals = sc.get.rank_genes_groups_df(adata, label)
-            stats = stats.merge(pvals)
-        dedict[label] = stats
-
-    # check if genes are ordered correctly
-    if not list(adata.var_names) == list(dedict[labels[0]]['names']):
-        raise AssertionError("Variable names did not match DE results!")
-
-    # Calculate Mean, logFC and z-scores by group
-    for label in labels:
-        temp = adata[adata.obs[I.label].isin([label])]
-        dedict[label]['means'] = temp.X.mean(axis=0).A.flatten()
-        if connectome_flag:
-            dedict[label]['zscores'] = temp.layers['scaled'].mean(axis=0)
-        if logfc_flag:
-            dedict[label]['logfc'] = _calc_log2fc(adata, label)
-        if isinstance(mat_max, np.float32):  # cellchat flag
-            dedict[label]['trimean'] = _trimean(temp.X / mat_max)
+        if de_method in _DE_METHODS:
+            # NOTE: from the sums & sums of squares of each label
+            label_stats.update(_rank_genes_stats(X, label_codes, group_stats, method=de_method))
+        else:
+            adata = sc.tl.rank_genes_groups(adata, groupby=I.label,
+                                            method=de_method, use_raw=False,
+                                            copy=True)
+            label_stats.update(_get_rank_genes_stats(adata, labels))
 
     pairs = (pd.DataFrame(np.array(np.meshgrid(labels, labels))
                           .reshape(2, np.size(labels) * np.size(labels)).T)
@@ -309,10 +577,12 @@ def _get_lr(adata, resource, groupby_pairs, relevant_cols, mat_mean, mat_max, de
         pairs = pairs.merge(groupby_pairs, on=[P.source, P.target], how='inner')
 
     # Join Stats
-    lr_res = pd.concat(
-        [_join_stats(source, target, dedict, resource) for source, target in
-         zip(pairs[P.source], pairs[P.target])]
-    )
+    lr_res = _join_lr_stats(resource=resource,
+                            pairs=pairs,
+                            label_stats=label_stats,
+                            labels=labels,
+                            var_names=adata.var_names,
+                            relevant_cols=relevant_cols)
 
     if M.mat_mean in relevant_cols:
         assert isinstance(mat_mean, np.float32)
@@ -328,26 +598,54 @@ def _get_lr(adata, resource, groupby_pairs, relevant_cols, mat_mean, mat_max, de
     return lr_res[relevant_cols]
 
 
+def _get_rank_genes_stats(adata, labels):
+    # label x gene arrays for each of the columns returned by `sc.tl.rank_genes_groups`
+    rank_genes = [sc.get.rank_genes_groups_df(adata, label).set_index('names').reindex(adata.var_names)
+                  for label in labels]
+    return {col: np.array([df[col].values for df in rank_genes]) for col in rank_genes[0].columns}
+
+
 def _sum_means(lr_res, what, on):
     return lr_res.join(lr_res.groupby(on)[what].sum(), on=on, rsuffix='_sums')
 
 
-def _calc_log2fc(adata, label) -> np.ndarray:
-    # Get subject vs rest cells
-    subject = adata[adata.obs[I.label].isin([label])]
-    rest = adata[~adata.obs[I.label].isin([label])]
+def _label_zscores(X, label_codes, n_labels) -> np.ndarray:
+    # Means of the z-scores (as in `sc.pp.scale`) per label, without densifying X,
+    # i.e. (mean of label - mean) / std, with the std as in `sc.pp.scale` (ddof=1, 1 if 0)
+    n_cells = X.shape[0]
+    label_sizes = np.bincount(label_codes, minlength=n_labels)
+    # NOTE: sums are obtained with float64 indicator products, as sparse sums accumulate in X.dtype
+    indicator = _label_indicator(label_codes, n_labels, dtype=np.float64, weighted=False)
+    label_sums = _to_dense(indicator @ X)
+    label_sq_sums = _to_dense(indicator @ X.multiply(X))
+
+    mean = label_sums.sum(axis=0) / n_cells
+    mean_sq = label_sq_sums.sum(axis=0) / n_cells
+    var = (mean_sq - mean ** 2) * (n_cells / (n_cells - 1))
+    std = np.sqrt(var)
+    std[std == 0] = 1
+
+    label_means = label_sums / np.maximum(label_sizes, 1)[:, None]
+    return ((label_means - mean) / std).astype(X.dtype)
+
+
+def _calc_log2fc(normcounts, label_codes, n_labels) -> np.ndarray:
+    # 1 vs rest log2FC of the (expm1) counts of each label,
+    # with the sums of the rest obtained from the sums of all cells
+    label_sizes = np.bincount(label_codes, minlength=n_labels)
+    label_sums = _to_dense(_label_indicator(label_codes, n_labels, dtype=np.float64, weighted=False)
+                           @ normcounts)
+    rest_sums = label_sums.sum(axis=0) - label_sums
 
     # subject and rest means
-    subj_means = subject.layers['normcounts'].mean(0).A.flatten()
-    rest_means = rest.layers['normcounts'].mean(0).A.flatten()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        subj_means = label_sums / label_sizes[:, None]
+        rest_means = rest_sums / (label_sizes.sum() - label_sizes)[:, None]
 
     # log2 + 1 transform
-    subj_log2means = np.log2(subj_means + 1)
-    loso_log2means = np.log2(rest_means + 1)
-
-    logfc_vec = subj_log2means - loso_log2means
+    logfc = np.log2(subj_means + 1) - np.log2(rest_means + 1)
 
-    return logfc_vec
+    return logfc.astype(normcounts.dtype)
 
 
 def _expm1_base(X, base):
@@ -366,6 +664,9 @@ def _run_method(lr_res: pandas.DataFrame,
                 return_all_lrs: bool,
                 n_jobs: int,
                 verbose: bool,
+                null_distribution: str = 'permutation',
+                early_stop: int | None = None,
+                perm_cache: _PermutationCache | None = None,
                 _aggregate_flag: bool = False  # Indicates whether we're generating the consensus
                 ) -> pd.DataFrame:
     # re-assemble complexes - specific for each method
@@ -385,43 +686,65 @@ def _run_method(lr_res: pandas.DataFrame,
         lr_res = lr_res[lr_res[I.lrs_to_keep]]
     lr_res = lr_res[relevant_cols]
 
-    if (M.mat_max in _add_cols) & (_score.method_name == "CellChat"):
-        # CellChat matrix_max
-        norm_factor = np.unique(lr_res[M.mat_max].values)[0]
-        agg_fun = _trimean # Calculate sparse matrix quantiles?
-    else:
-        norm_factor = None
-        agg_fun = np.mean # NOTE: change to sparse matrix mean?
+    mat_max = np.unique(lr_res[M.mat_max].values)[0] if M.mat_max in _add_cols else None
+    agg_fun, norm_factor = _get_agg_fun(_score, _add_cols, mat_max)
+
+    # NOTE: _score is shared, so its specificity is not modified when no permutations are run
+    specificity = _score.specificity
 
     if _score.permute:
         # get permutations
-        if n_perms is not None:
-            perms = _get_means_perms(adata=adata,
-                                     n_perms=n_perms,
-                                     seed=seed,
-                                     agg_fun=agg_fun,
-                                     norm_factor=norm_factor,
-                                     n_jobs=n_jobs,
-                                     verbose=verbose)
+        if (n_perms is not None) and (null_distribution == 'analytic'):
+            # closed-form null moments, i.e. no permutations
+            perm_stats = _get_analytic_null(adata=adata,
+                                            lr_res=lr_res,
+                                            agg_fun=agg_fun,
+                                            norm_factor=norm_factor,
+                                            observed=lr_res[_complex_cols].values.T)
+        elif (n_perms is not None) and (early_stop is not None):
+            # permutations are stopped for each interaction once its p-value is resolved
+            perm_stats = _AdaptivePerms(adata=adata,
+                                        lr_res=lr_res,
+                                        n_perms=n_perms,
+                                        seed=seed,
+                                        agg_fun=agg_fun,
+                                        norm_factor=norm_factor,
+                                        early_stop=early_stop,
+                                        n_jobs=n_jobs,
+                                        verbose=verbose)
+        elif (n_perms is not None) and (perm_cache is not None):
+            # shared with the other methods in the consensus
+            perm_stats = perm_cache.null(_score.method_name, agg_fun, _get_mat_idx(adata, lr_res))
+        elif n_perms is not None:
+            # bound the size of both the permuted averages and the ligand-receptor stats per batch
+            n_labels = adata.obs[I.label].cat.categories.shape[0]
+            batch_size = _get_batch_size(n_perms, adata.shape[0],
+                                         max(n_labels * adata.shape[1], 2 * lr_res.shape[0]))
+            perms = _iter_means_perms(adata=adata,
+                                      n_perms=n_perms,
+                                      seed=seed,
+                                      agg_fun=agg_fun,
+                                      norm_factor=norm_factor,
+                                      n_jobs=n_jobs,
+                                      verbose=verbose,
+                                      batch_size=batch_size)
             # get tensor indexes for ligand, receptor, source, target
             ligand_idx, receptor_idx, source_idx, target_idx = _get_mat_idx(adata, lr_res)
 
-            # ligand and receptor perms
-            ligand_stat_perms = perms[:, source_idx, ligand_idx]
-            receptor_stat_perms = perms[:, target_idx, receptor_idx]
-            # stack them together
-            perm_stats = np.stack((ligand_stat_perms, receptor_stat_perms), axis=0)
+            # ligand and receptor perms are streamed to the scoring function batch by batch,
+            # i.e. the (2, n_perms, n_rows) tensor is never materialized
+            perm_stats = _iter_perm_stats(perms, ligand_idx, receptor_idx, source_idx, target_idx)
         else:
             perm_stats = None
-            _score.specificity = None
+            specificity = None
 
         scores = _score.fun(x=lr_res,
                             perm_stats=perm_stats)
     else:  # non-perm funs
-        scores = _score.fun(x=lr_res)
+        scores = _score_lr(_score, lr_res)
 
     lr_res.loc[:, _score.magnitude] = scores[0]
-    lr_res.loc[:, _score.specificity] = scores[1]
+    lr_res.loc[:, specificity] = scores[1]
 
 
     if return_all_lrs:
@@ -431,21 +754,66 @@ def _run_method(lr_res: pandas.DataFrame,
             fill_value = _assign_min_or_max(lr_res[_score.magnitude],
                                             _score.magnitude_ascending)
             lr_res.loc[~lr_res[I.lrs_to_keep], _score.magnitude] = fill_value
-        if _score.specificity is not None:
-            fill_value = _assign_min_or_max(lr_res[_score.specificity],
+        if specificity is not None:
+            fill_value = _assign_min_or_max(lr_res[specificity],
                                             _score.specificity_ascending)
-            lr_res.loc[~lr_res[I.lrs_to_keep], _score.specificity] = fill_value
+            lr_res.loc[~lr_res[I.lrs_to_keep], specificity] = fill_value
 
     if _aggregate_flag:  # if consensus keep only the keys and the method scores
-        lr_res = lr_res[_key_cols + [_score.magnitude, _score.specificity]]
+        lr_res = lr_res[_key_cols + [_score.magnitude, specificity]]
 
     # remove redundant cols for some scores
-    if (_score.magnitude is None) | (_score.specificity is None):
+    if (_score.magnitude is None) | (specificity is None):
         lr_res = lr_res.drop([None], axis=1)
 
     return lr_res
 
 
+def _get_agg_fun(_score, add_cols, mat_max):
+    if (M.mat_max in add_cols) & (_score.method_name == "CellChat"):
+        # CellChat matrix_max
+        return _trimean, mat_max
+    return np.mean, None  # NOTE: change to sparse matrix mean?
+
+
+def _get_perm_cache(adata, methods, mat_max, n_perms, seed, n_jobs, verbose, max_size=0):
+    """
+    Shared permutations for the permutation-based methods of a consensus, or of a `PreparedPipe`.
+    None if less than two methods permute, as then nothing is to be shared,
+    unless the permuted aggregates fit in `max_size` and are thus kept.
+    """
+    perm_methods = [method for method in methods if method.permute]
+    if (n_perms is None) or (len(perm_methods) == 0):
+        return None
+
+    agg_funs = dict(_get_agg_fun(method, method.add_cols, mat_max) for method in perm_methods)
+    perm_cache = _PermutationCache(adata=adata,
+                                   n_perms=n_perms,
+                                   seed=seed,
+                                   agg_funs=agg_funs,
+                                   n_jobs=n_jobs,
+                                   verbose=verbose,
+                                   max_size=max_size)
+    if (len(perm_methods) < 2) and not perm_cache.keep_aggs:
+        return None
+    return perm_cache
+
+
+def _run_shared(run, perm_cache, verbose):
+    """
+    Call `run(verbose)`, which runs one or more methods, with the permutations of `perm_cache` (if any).
+
+    The methods are first run to register their observed scores, so that the permutations of all methods
+    are scored in a single pass, and are then run again with their p-values.
+    NOTE: only the permutations are run once, i.e. the rest of each method is run twice.
+    """
+    if perm_cache is None:
+        return run(verbose)
+    run(False)
+    perm_cache.score()
+    return run(verbose)
+
+
 def _assign_min_or_max(x, x_ascending):
     if x_ascending:
         return np.max(x)
@@ -453,19 +821,21 @@ def _assign_min_or_max(x, x_ascending):
         return np.min(x)
 
 
-def _trimean(a, axis=0):
-    quantiles = np.quantile(a.A, q=[0.25, 0.75], axis=axis)
-    median = np.median(a.A, axis=axis)
-    return (quantiles[0] + 2 * median + quantiles[1]) / 4
-
-def _cluster_stats(adata):
-    cluster_stats = adata.obs.groupby('@label').size().to_frame(name='counts')
-    labels = adata.obs['@label'].cat.categories
-    for label in labels:
-        temp = adata[adata.obs['@label'].isin([label])]
-
-        cluster_stats.loc[label, 'mean'] = temp.X.mean()
-        cluster_stats.loc[label, 'std'] = np.std(temp.X.A)
+def _cluster_stats(adata, label_moments=None):
+    labels = adata.obs[I.label].cat.categories
+    if label_moments is None:
+        stats = _get_group_stats(adata.X, adata.obs[I.label].cat.codes.values,
+                                 labels.shape[0], moments=True)
+        label_moments = {'counts': stats['counts'], 'sums': stats['sums'].sum(axis=1),
+                         'sq_sums': stats['sq_sums'].sum(axis=1), 'n_features': adata.shape[1]}
+
+    # mean and std across all values (cells x genes) of each label
+    n_values = label_moments['counts'] * label_moments['n_features']
+    mean = label_moments['sums'] / n_values
+    std = np.sqrt(np.maximum(label_moments['sq_sums'] / n_values - mean ** 2, 0))
+
+    cluster_stats = pd.DataFrame({'counts': label_moments['counts'], 'mean': mean, 'std': std},
+                                 index=labels)
 
     return cluster_stats
 
@@ -1,8 +1,20 @@
+import numba as nb
+import numpy as np
+
 from liana.method.sc._Method import Method, MethodMeta
-from numpy import mean
+from liana.method._pipe_utils._kernels import _register_score_kernel
 
 def _logfc_score(x):
-    mean_logfc = mean((x['ligand_logfc'], x['receptor_logfc']), axis=0)
+    mean_logfc = np.mean((x['ligand_logfc'], x['receptor_logfc']), axis=0)
+    return None, mean_logfc
+
+
+@_register_score_kernel(_logfc_score, ['ligand_logfc', 'receptor_logfc'])
+@nb.njit(parallel=True, cache=True, error_model='numpy')
+def _logfc_kernel(ligand_logfc, receptor_logfc):
+    mean_logfc = np.empty_like(ligand_logfc)
+    for row in nb.prange(ligand_logfc.shape[0]):
+        mean_logfc[row] = (ligand_logfc[row] + receptor_logfc[row]) / 2
     return None, mean_logfc
 
 
@@ -1,4 +1,8 @@
+import numba as nb
+import numpy as np
+
 from liana.method.sc._Method import Method, MethodMeta
+from liana.method._pipe_utils._kernels import _register_score_kernel
 
 
 def _spec_weight(ligand_means, ligand_means_sums, receptor_means, receptor_means_sums):
@@ -18,6 +22,19 @@ def _natmi_score(x) -> tuple:
     return expr_prod, spec_weight
 
 
+@_register_score_kernel(_natmi_score, ['ligand_means', 'ligand_means_sums',
+                                       'receptor_means', 'receptor_means_sums'])
+@nb.njit(parallel=True, cache=True, error_model='numpy')
+def _natmi_kernel(ligand_means, ligand_means_sums, receptor_means, receptor_means_sums):
+    expr_prod = np.empty_like(ligand_means)
+    spec_weight = np.empty_like(ligand_means)
+    for row in nb.prange(ligand_means.shape[0]):
+        expr_prod[row] = ligand_means[row] * receptor_means[row]
+        spec_weight[row] = (ligand_means[row] / ligand_means_sums[row]) * \
+            (receptor_means[row] / receptor_means_sums[row])
+    return expr_prod, spec_weight
+
+
 # Initialize CPDB Meta
 _natmi = MethodMeta(method_name="NATMI",
                     complex_cols=['ligand_means', 'receptor_means'],
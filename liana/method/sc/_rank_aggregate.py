@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from liana.method.sc._Method import MethodMeta
 from liana.method.sc._liana_pipe import liana_pipe
+from liana.method._pipe_utils._results import _compact_res
 from liana._docs import d
 from liana.utils import mdata_to_anndata
 from mudata import MuData
@@ -65,18 +66,24 @@ class AggregateClass(MethodMeta):
                  aggregate_method: str = 'rra',
                  consensus_opts: Optional[list] = None,
                  return_all_lrs: bool = V.return_all_lrs,
+                 top_n: Optional[int] = V.top_n,
+                 score_thresholds: Optional[dict] = V.score_thresholds,
                  key_added: str = K.uns_key,
                  use_raw: Optional[bool] = V.use_raw,
                  layer: Optional[str] = V.layer,
                  de_method: str = V.de_method,
                  n_perms: int = V.n_perms,
+                 null_distribution: str = V.null_distribution,
+                 early_stop: Optional[int] = V.early_stop,
                  seed: int = V.seed,
                  n_jobs: int = 1,
                  resource: Optional[DataFrame] = V.resource,
                  interactions: Optional[list] = V.interactions,
                  mdata_kwargs: dict = dict(),
+                 compact: bool = V.compact,
                  inplace: bool = V.inplace,
                  verbose: Optional[bool] = V.verbose,
+                 _prepare: bool = False,
                  ):
         """
         Get an aggregate of ligand-receptor scores from multiple methods.
@@ -98,18 +105,23 @@ class AggregateClass(MethodMeta):
             Strategies to aggregate interactions across methods.
             Default is None - i.e. ['Specificity', 'Magnitude'] and both specificity and magnitude are aggregated.
         %(return_all_lrs)s
+        %(top_n_sc)s
+        %(score_thresholds)s
         %(key_added)s
         %(use_raw)s
         %(layer)s
         %(de_method)s
         %(verbose)s
         %(n_perms_sc)s
+        %(null_distribution)s
+        %(early_stop)s
         %(seed)s
         n_jobs
             Number of jobs to run in parallel.
         %(resource)s
         %(interactions)s
         %(mdata_kwargs)s
+        %(compact)s
         %(inplace)s
 
         Returns
@@ -134,18 +146,30 @@ class AggregateClass(MethodMeta):
                                min_cells=min_cells,
                                base=base,
                                return_all_lrs=return_all_lrs,
+                               top_n=top_n,
+                               score_thresholds=score_thresholds,
                                de_method=de_method,
                                verbose=verbose,
                                _score=self,
                                use_raw=use_raw,
                                layer=layer,
                                n_perms=n_perms,
+                               null_distribution=null_distribution,
+                               early_stop=early_stop,
                                seed=seed,
                                n_jobs=n_jobs,
                                _methods=self.methods,
                                _aggregate_method=aggregate_method,
-                               _consensus_opts=consensus_opts
+                               _consensus_opts=consensus_opts,
+                               _prepare=_prepare
                                )
+        if _prepare:
+            liana_res.compact = compact
+            return liana_res
+
+        if compact:
+            liana_res = {method: _compact_res(lrs) for method, lrs in liana_res.items()} \
+                if isinstance(liana_res, dict) else _compact_res(liana_res)
 
         if inplace:
             adata.uns[key_added] = liana_res
@@ -1,10 +1,19 @@
-from liana.method.sc._Method import Method, MethodMeta
+import numba as nb
 import numpy as np
 
+from liana.method.sc._Method import Method, MethodMeta
+from liana.method._pipe_utils._kernels import _register_score_kernel
+
 def _inter_score(x):
     inter_score = np.minimum(x['ligand_cdf'], x['receptor_cdf'])
     return inter_score, None
 
+
+@_register_score_kernel(_inter_score, ['ligand_cdf', 'receptor_cdf'])
+@nb.njit(cache=True)
+def _inter_kernel(ligand_cdf, receptor_cdf):
+    return np.minimum(ligand_cdf, receptor_cdf), None
+
 _scseqcomm = MethodMeta(method_name="scSeqComm",
                         complex_cols=["ligand_means", "receptor_means"],
                         add_cols=["ligand_cdf", "receptor_cdf"],
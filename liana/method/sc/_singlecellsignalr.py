@@ -1,6 +1,8 @@
+import numba as nb
 import numpy as np
 
 from liana.method.sc._Method import Method, MethodMeta
+from liana.method._pipe_utils._kernels import _register_score_kernel
 
 
 def _sca_score(x):
@@ -22,6 +24,16 @@ def _sca_score(x):
     return lr_sqrt / denominator, None
 
 
+@_register_score_kernel(_sca_score, ['ligand_means', 'receptor_means', 'mat_mean'])
+@nb.njit(parallel=True, cache=True, error_model='numpy')
+def _sca_kernel(ligand_means, receptor_means, mat_mean):
+    lrscore = np.empty_like(ligand_means)
+    for row in nb.prange(ligand_means.shape[0]):
+        lr_sqrt = np.sqrt(ligand_means[row]) * np.sqrt(receptor_means[row])
+        lrscore[row] = lr_sqrt / (lr_sqrt + mat_mean[row])
+    return lrscore, None
+
+
 # Initialize CPDB Meta
 _singlecellsignalr = MethodMeta(method_name="SingleCellSignalR",
                                 complex_cols=['ligand_means', 'receptor_means'],
@@ -3,8 +3,8 @@ import pandas as pd
 from itertools import product
 
 from liana.method._pipe_utils import prep_check_adata, assert_covered, filter_resource, _check_groupby
-from liana.method._pipe_utils._common import _join_stats, _get_props, _get_groupby_subset
-from liana.resource import explode_complexes, filter_reassemble_complexes
+from liana.method._pipe_utils._common import _join_stats, _get_groupby_subset, _get_group_stats
+from liana.resource import filter_reassemble_complexes
 from liana.resource.select_resource import _handle_resource
 
 from liana._logging import _logg
@@ -74,7 +74,8 @@ def df_to_lr(adata,
     resource = _handle_resource(interactions=interactions,
                                 resource=resource,
                                 resource_name=resource_name,
-                                verbose=verbose)
+                                verbose=verbose,
+                                explode=True)
 
     stat_names = ['expr', 'props'] + stat_keys
     if complex_col is not None:
@@ -104,15 +105,12 @@ def df_to_lr(adata,
 
     # get label cats
     labels = adata.obs[I.label].cat.categories
+    group_stats = _get_group_stats(adata.X, adata.obs[I.label].cat.codes.values, labels.shape[0])
     dedict = {}
-    for label in labels:
-        temp = adata[adata.obs[I.label] == label, :]
-        props = _get_props(temp.X)
-        means = np.array(temp.X.mean(axis=0), dtype='float32').flatten()
-
-        stats = pd.DataFrame({'names': temp.var_names,
-                              'props': props,
-                              'expr': means
+    for label_idx, label in enumerate(labels):
+        stats = pd.DataFrame({'names': adata.var_names,
+                              'props': group_stats['props'][label_idx],
+                              'expr': group_stats['means'][label_idx].astype('float32')
                               }). \
             assign(label=label).sort_values('names')
 
@@ -141,8 +139,6 @@ def df_to_lr(adata,
     if target_labels is not None:
         pairs = pairs[pairs['target'].isin(target_labels)]
 
-    resource = explode_complexes(resource)
-
     # Check overlap between resource and adata
     assert_covered(np.union1d(np.unique(resource["ligand"]),
                                 np.unique(resource["receptor"])),
@@ -11,6 +11,8 @@ from tqdm import tqdm
 from ..method import process_scores
 from liana._logging import _check_if_installed
 from liana.method._pipe_utils import _check_groupby
+from liana.method._pipe_utils._results import _expand_res
+from liana.method._pipe_utils._store import _is_store, _read_res
 from liana._docs import d
 from liana._constants import DefaultValues as V, Keys as K, PrimaryColumns as P
 
@@ -170,6 +172,8 @@ def lrs_to_views(adata: AnnData,
     var_sep
         Separator to use for the variable names in the views.
     %(uns_key)s
+        `adata.uns[uns_key]` can also be the path of a result store, as written by `by_sample` with `store`,
+        from which only the needed columns are read.
     %(sample_key)s
     %(source_key)s
     %(target_key)s
@@ -182,14 +186,22 @@ def lrs_to_views(adata: AnnData,
     Returns a MuData object with views that represent an aggregate for each entity in `adata.obs[groupby]`.
 
     """
-    if (sample_key not in adata.obs.columns) or (sample_key not in adata.uns[uns_key].columns):
-        raise ValueError(f'`{sample_key}` not found in `adata.obs` or `adata.uns[uns_key]`!' +
-                         'Please ensure that the sample key is present in both objects.')
-
     if uns_key not in adata.uns_keys():
         raise ValueError(f'`{uns_key}` not found in `adata.uns`! Please run `li.mt.rank_aggregate.by_sample` first.')
 
-    liana_res = adata.uns[uns_key].copy()
+    liana_res = adata.uns[uns_key]
+    if _is_store(liana_res):
+        # only the needed columns are read from the store
+        liana_res = _read_res(liana_res, columns=[source_key, target_key, ligand_key, receptor_key, score_key])
+    else:
+        liana_res = liana_res.copy()
+
+    if (sample_key not in adata.obs.columns) or (sample_key not in liana_res.columns):
+        raise ValueError(f'`{sample_key}` not found in `adata.obs` or `adata.uns[uns_key]`!' +
+                         'Please ensure that the sample key is present in both objects.')
+
+    # NOTE: compact results, i.e. with categorical keys, are converted to strings
+    liana_res = _expand_res(liana_res)
 
     if (score_key is None) or (score_key not in liana_res.columns):
         raise ValueError(f"Score column `{score_key}` not found in `liana_res`")
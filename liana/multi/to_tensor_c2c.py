@@ -6,6 +6,8 @@ from anndata import AnnData
 from pandas import DataFrame
 
 from liana.method import process_scores
+from liana.method._pipe_utils._results import _expand_res
+from liana.method._pipe_utils._store import _is_store, _read_res
 from liana._logging import _check_if_installed
 from liana._docs import d
 from liana._constants import DefaultValues as V, Keys as K, PrimaryColumns as P
@@ -14,7 +16,7 @@ from liana._constants import DefaultValues as V, Keys as K, PrimaryColumns as P
 def to_tensor_c2c(adata:AnnData=None,
                   sample_key:str = None,
                   score_key:str = None,
-                  liana_res: (DataFrame or None) = None,
+                  liana_res: (DataFrame or str or None) = None,
                   source_key:str = P.source,
                   target_key:str = P.target,
                   ligand_key:str = P.ligand_complex,
@@ -37,6 +39,8 @@ def to_tensor_c2c(adata:AnnData=None,
     %(score_key)s
     liana_res
         A dataframe with the LIANA results. If None, it will be taken from `adata.uns[uns_key]`.
+        Either can also be the path of a result store, as written by `by_sample` with `store`,
+        from which only the needed columns are read.
     %(source_key)s
     %(target_key)s
     %(ligand_key)s
@@ -65,11 +69,16 @@ def to_tensor_c2c(adata:AnnData=None,
         raise AttributeError('Ambiguous! One of `liana_res` or `adata` should be provided.')
     if adata is not None:
         assert uns_key in adata.uns_keys()
-        liana_res = adata.uns[uns_key].copy()
-    if liana_res is not None:
+        liana_res = adata.uns[uns_key]
+    if _is_store(liana_res):
+        liana_res = _read_res(liana_res, columns=[source_key, target_key, ligand_key, receptor_key, score_key],
+                              optional=['lrs_to_keep'])
+    elif liana_res is not None:
         liana_res = liana_res.copy()
     if (liana_res is None) & (adata is None):
         raise ValueError('`liana_res` or `adata` must be provided!')
+    # compact results, i.e. with categorical keys
+    liana_res = _expand_res(liana_res)
 
     keys = np.array([sample_key, source_key, target_key, ligand_key, receptor_key])
     missing_keys = keys[[ key not in liana_res.columns for key in keys]]
@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 
 from liana._constants import Keys as K
+from liana.method._pipe_utils._results import _expand_res
 
 def _check_var(liana_res, var_name, var):
     if var is None:
@@ -27,6 +28,8 @@ def _prep_liana_res(adata=None,
         liana_res = liana_res.copy()
     if (liana_res is None) & (adata is None):
         raise ValueError('`liana_res` or `adata` must be provided!')
+    # compact results, i.e. with categorical keys
+    liana_res = _expand_res(liana_res)
 
     # subset to only cell labels of interest
     liana_res = _filter_labels(liana_res, labels=source_labels, label_type='source')
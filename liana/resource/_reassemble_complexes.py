@@ -3,6 +3,7 @@ Functions to deal with protein complexes
 """
 from __future__ import annotations
 
+import numpy as np
 import pandas as pd
 from liana._logging import _logg
 from liana._docs import d
@@ -35,6 +36,95 @@ def filter_reassemble_complexes(lr_res,
     -----------
     lr_res: a reduced long-format pandas dataframe
     """
+    if complex_policy != 'min':
+        return _filter_reassemble_grouped(lr_res=lr_res,
+                                          _key_cols=_key_cols,
+                                          complex_cols=complex_cols,
+                                          expr_prop=expr_prop,
+                                          return_all_lrs=return_all_lrs,
+                                          complex_policy=complex_policy)
+
+    # integer code for each complex (key), in order of first appearance
+    codes = _get_key_codes(lr_res, _key_cols)
+    # rows are grouped by complex, while keeping their order within each complex
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    lr_res = lr_res.iloc[order]
+    starts = _get_segment_starts(codes)
+
+    # Filter by expr_prop (keep only complexes where all subunits are expressed)
+    props = np.fmin(lr_res['ligand_props'].values, lr_res['receptor_props'].values)
+    prop_min = np.fmin.reduceat(props, starts) if starts.size else props
+    expressed = prop_min >= expr_prop
+
+    if not return_all_lrs:
+        msk = np.repeat(expressed, np.diff(np.append(starts, codes.shape[0])))
+        lr_res = lr_res[msk].assign(prop_min=np.repeat(prop_min[expressed],
+                                                        np.diff(np.append(starts, codes.shape[0]))[expressed]))
+        codes = codes[msk]
+        index = np.arange(lr_res.shape[0])
+    else:
+         # deal with duplicated subunits
+         # subunits that are not expressed might not represent the most relevant subunit
+        lr_res = lr_res.iloc[starts].assign(prop_min=np.where(expressed, prop_min, 0),
+                                            lrs_to_keep=expressed)
+        codes = codes[starts]
+        index = order[starts]
+
+    # keep only the min subunit for each complex column
+    for col in complex_cols:
+        values = lr_res[col].values
+        starts = _get_segment_starts(codes)
+        if starts.size:
+            col_min = np.fmin.reduceat(values, starts)
+            msk = values == np.repeat(col_min, np.diff(np.append(starts, codes.shape[0])))
+        else:
+            msk = np.zeros(0, dtype=bool)
+        lr_res = lr_res[msk]
+        codes = codes[msk]
+        index = np.flatnonzero(msk)
+
+    # check if there are any duplicated subunits
+    starts = _get_segment_starts(codes)
+    if starts.size < codes.shape[0]:
+        # check if there are any non-equal subunit values
+        first = np.repeat(starts, np.diff(np.append(starts, codes.shape[0])))
+        values = lr_res[complex_cols].values
+        if not (values == values[first]).all():
+            _logg('There were duplicated subunits in the complexes. ' +
+                 'The subunits were reduced to only the minimum expression subunit. ' +
+                 'However, there were subunits that were not the same within a complex. ',
+                 level='warn')
+        lr_res = lr_res.iloc[starts]
+        index = index[starts]
+
+    lr_res.index = index
+
+    return lr_res
+
+
+def _get_key_codes(lr_res, key_cols) -> np.ndarray:
+    # combine the codes of each key column, and re-factorize to keep them bounded
+    codes = np.zeros(lr_res.shape[0], dtype=np.int64)
+    for key in key_cols:
+        key_codes, uniques = pd.factorize(lr_res[key])
+        codes = pd.factorize(codes * (uniques.shape[0] + 1) + key_codes)[0]
+    return codes
+
+
+def _get_segment_starts(codes) -> np.ndarray:
+    # start of each run of equal (sorted) codes
+    if codes.shape[0] == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.append(True, codes[1:] != codes[:-1]))
+
+
+def _filter_reassemble_grouped(lr_res,
+                               _key_cols,
+                               complex_cols,
+                               expr_prop,
+                               return_all_lrs=False,
+                               complex_policy='min'):
     # Filter by expr_prop (inner join only complexes where all subunits are expressed)
     expressed = (lr_res[_key_cols + ['ligand_props', 'receptor_props']]
                  .set_index(_key_cols)
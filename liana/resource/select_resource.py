@@ -1,11 +1,18 @@
-from pandas import read_csv
-from numpy import unique
+from functools import lru_cache
+import hashlib
 import pathlib
-from pandas import DataFrame
+
+import numpy as np
+from pandas import read_csv, DataFrame
 
 from liana._logging import _logg
+from liana.resource._reassemble_complexes import explode_complexes
 from liana._constants import DefaultValues as V
 
+_RESOURCE_PATH = pathlib.Path(__file__).parent.joinpath("omni_resource.csv")
+_STORE_PATH = pathlib.Path(__file__).parent.joinpath("omni_resource.npz")
+
+
 def select_resource(resource_name: str = V.resource_name) -> DataFrame:
     """
     Read resource of choice from the pre-generated resources in LIANA.
@@ -20,47 +27,147 @@ def select_resource(resource_name: str = V.resource_name) -> DataFrame:
     A dataframe with ``['ligand', 'receptor']`` columns
 
     """
-    resource_name = resource_name.lower()
+    return _select_resource(resource_name.lower()).copy()
 
-    resource_path = pathlib.Path(__file__).parent.joinpath("omni_resource.csv")
 
-    resource = read_csv(resource_path, index_col=False)
+def show_resources():
+    """
+    Show available resources.
 
-    if resource_name not in resource['resource'].unique():
-        raise ValueError(f"Resource {resource_name} not found. "
-                         f"Please choose from {resource['resource'].unique()}")
+    Returns
+    -------
+    A list of resource names available via ``liana.resource.select_resource``
 
-    resource = resource[resource['resource'] == resource_name]
+    """
+    return list(_load_store()['resource_categories'])
 
-    resource = resource[['source_genesymbol', 'target_genesymbol']]
-    resource = resource.rename(columns={'source_genesymbol': 'ligand',
-                                        'target_genesymbol': 'receptor'}
-                               )
+
+@lru_cache(maxsize=32)
+def _select_resource(resource_name) -> DataFrame:
+    store = _load_store()
+    msk = _get_resource_mask(store, resource_name)
+
+    resource = DataFrame({'ligand': _decode(store, 'ligand', msk),
+                          'receptor': _decode(store, 'receptor', msk)},
+                         index=np.flatnonzero(msk))
 
     return resource
 
 
-def show_resources():
-    """
-    Show available resources.
+@lru_cache(maxsize=32)
+def _select_exploded(resource_name) -> DataFrame:
+    """Resource in the form returned by ``explode_complexes``."""
+    store = _load_store()
+    msk = _get_resource_mask(store, resource_name)[store['exploded_row']]
+    row = store['exploded_row'][msk]
 
-    Returns
-    -------
-    A list of resource names available via ``liana.resource.select_resource``
+    ligand_complex = _decode(store, 'ligand')[row]
+    receptor_complex = _decode(store, 'receptor')[row]
+    resource = DataFrame({'interaction': ligand_complex + '&' + receptor_complex,
+                          'ligand': _decode(store, 'exploded_ligand', msk),
+                          'receptor': _decode(store, 'exploded_receptor', msk),
+                          'ligand_complex': ligand_complex,
+                          'receptor_complex': receptor_complex
+                          })
+
+    return resource
+
+
+def _get_resource_mask(store, resource_name) -> np.ndarray:
+    categories = store['resource_categories']
+    if resource_name not in categories:
+        raise ValueError(f"Resource {resource_name} not found. "
+                         f"Please choose from {categories}")
+
+    return store['resource_codes'] == np.flatnonzero(categories == resource_name)[0]
 
+
+def _decode(store, col, msk=None) -> np.ndarray:
+    codes = store[f'{col}_codes']
+    if msk is not None:
+        codes = codes[msk]
+    return store[f'{col}_categories'][codes]
+
+
+@lru_cache(maxsize=1)
+def _load_store() -> dict:
+    return _read_store(_STORE_PATH, _RESOURCE_PATH)
+
+
+def _read_store(store_path, resource_path) -> dict:
+    # use the compiled store, unless it is missing or out of sync with (the content of) the csv
+    if store_path.exists():
+        with np.load(store_path, allow_pickle=False) as npz:
+            store = {key: npz[key] for key in npz.files}
+        if str(store.get('source_sha256')) == _hash_file(resource_path):
+            return _as_object(store)
+
+    return _as_object(_compile_store(resource_path))
+
+
+def _hash_file(path) -> str:
+    return hashlib.sha256(pathlib.Path(path).read_bytes()).hexdigest()
+
+
+def _as_object(store) -> dict:
+    return {key: value.astype(object) if key.endswith('_categories') else value
+            for key, value in store.items()}
+
+
+def _compile_store(resource_path) -> dict:
+    """
+    Compile the csv resource into categorical codes, incl. the exploded complexes,
+    along with the hash of the csv, by which the store is checked when loaded.
     """
-    resource_path = pathlib.Path(__file__).parent.joinpath("omni_resource.csv")
     resource = read_csv(resource_path, index_col=False)
-    return list(unique(resource['resource']))
+    resource = resource.rename(columns={'source_genesymbol': 'ligand',
+                                        'target_genesymbol': 'receptor'})
 
+    exploded = _explode_rows(resource)
 
-def _handle_resource(interactions=None, resource=None, resource_name=None, x_name='ligand', y_name='receptor', verbose=True):
+    store = {'source_sha256': np.array(_hash_file(resource_path))}
+    for col, values in [('resource', resource['resource']),
+                        ('ligand', resource['ligand']),
+                        ('receptor', resource['receptor']),
+                        ('exploded_ligand', exploded['ligand']),
+                        ('exploded_receptor', exploded['receptor'])]:
+        categories, codes = np.unique(values.values.astype(str), return_inverse=True)
+        store[f'{col}_categories'] = categories
+        store[f'{col}_codes'] = codes.astype(np.int32)
+    store['exploded_row'] = exploded['row'].values.astype(np.int32)
+
+    return store
+
+
+def _write_store(resource_path=_RESOURCE_PATH, store_path=_STORE_PATH):
+    """
+    Compile the csv resource and save it as the store, i.e. ``omni_resource.npz``.
+    Should be run whenever ``omni_resource.csv`` is changed, via ``python -m liana.resource.select_resource``.
+    """
+    np.savez_compressed(store_path, **_compile_store(pathlib.Path(resource_path)))
+
+
+def _explode_rows(resource) -> DataFrame:
+    # same order as explode_complexes, i.e. receptor subunits, then ligand subunits
+    exploded = [(row, ligand, receptor)
+                for row, (ligands, receptors) in enumerate(zip(resource['ligand'].str.split('_'),
+                                                               resource['receptor'].str.split('_')))
+                for receptor in receptors
+                for ligand in ligands]
+
+    return DataFrame(exploded, columns=['row', 'ligand', 'receptor'])
+
+
+def _handle_resource(interactions=None, resource=None, resource_name=None, x_name='ligand', y_name='receptor', verbose=True,
+                     explode=False):
     if interactions is None:
         if resource is None:
             if resource_name is None:
                 raise ValueError("If 'interactions' and 'resource' are both None, 'resource_name' must be provided.")
             else:
                 _logg(f"Using resource `{resource_name}`.", verbose=verbose)
+                if explode:
+                    return _select_exploded(resource_name.lower()).copy()
                 resource = select_resource(resource_name)
         else:
             if verbose:
@@ -75,4 +182,11 @@ def _handle_resource(interactions=None, resource=None, resource_name=None, x_nam
             raise ValueError("'interactions' should be a list of tuples in the format [(x1, y1), (x2, y2), ...].")
         resource = DataFrame(interactions, columns=[x_name, y_name])
 
+    if explode:
+        resource = explode_complexes(resource, SOURCE=x_name, TARGET=y_name)
+
     return resource
+
+
+if __name__ == '__main__':
+    _write_store()
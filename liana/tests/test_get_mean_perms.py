@@ -3,7 +3,8 @@ import pathlib
 from scanpy.datasets import pbmc68k_reduced
 from pandas import read_csv
 
-from liana.method._pipe_utils._get_mean_perms import _get_means_perms, _get_positions
+from liana.method._pipe_utils._get_mean_perms import _get_means_perms, _get_positions, \
+    _iter_means_perms, _iter_perm_stats, _get_mat_idx, _calculate_pvals
 from liana.method.sc._liana_pipe import _trimean
 from liana.method.sc._cellphonedb import _mean
 
@@ -79,3 +80,105 @@ def test_cellchat_perms():
     expected = perms.sum(axis=0).sum(axis=1)
 
     assert np.testing.assert_almost_equal(desired, expected, decimal=6) is None
+
+
+def test_perms_batches():
+    perms = _get_means_perms(adata=adata,
+                             norm_factor=None,
+                             agg_fun=_mean,
+                             n_perms=10,
+                             seed=1337,
+                             n_jobs=1,
+                             verbose=False,
+                             batch_size=1)
+    batched = _get_means_perms(adata=adata,
+                               norm_factor=None,
+                               agg_fun=_mean,
+                               n_perms=10,
+                               seed=1337,
+                               n_jobs=1,
+                               verbose=False,
+                               batch_size=4)
+    np.testing.assert_almost_equal(perms, batched, decimal=6)
+
+    # equivalent to aggregating the permuted matrix
+    rng = np.random.default_rng(seed=1337)
+    perm_mat = adata.X[rng.permutation(np.arange(adata.shape[0]))]
+    labels = adata.obs['@label'].cat.categories
+    expected = np.array([perm_mat[(adata.obs['@label'] == label).values].mean(axis=0).A1
+                         for label in labels])
+    np.testing.assert_almost_equal(perms[0], expected, decimal=5)
+
+
+def test_perms_norm_factor():
+    X = adata.X.copy()
+    _get_means_perms(adata=adata,
+                     norm_factor=adata.X.max(),
+                     agg_fun=_trimean,
+                     n_perms=2,
+                     seed=1337,
+                     n_jobs=1,
+                     verbose=False
+                     )
+    # adata.X is not modified in place
+    assert (adata.X != X).nnz == 0
+
+
+def test_streamed_pvals():
+    lr_res = all_defaults[all_defaults['source'].isin(adata.obs['@label'].cat.categories)]
+    idx = _get_mat_idx(adata, lr_res)
+    lr_truth = _mean((lr_res['ligand_means'].values, lr_res['receptor_means'].values))
+
+    perms = _get_means_perms(adata=adata, norm_factor=None, agg_fun=_mean,
+                             n_perms=20, seed=1337, n_jobs=1, verbose=False)
+    ligand_idx, receptor_idx, source_idx, target_idx = idx
+    perm_stats = np.stack((perms[:, source_idx, ligand_idx],
+                           perms[:, target_idx, receptor_idx]), axis=0)
+    expected = _calculate_pvals(lr_truth, perm_stats, _mean)
+
+    perms = _iter_means_perms(adata=adata, norm_factor=None, agg_fun=_mean,
+                              n_perms=20, seed=1337, n_jobs=2, verbose=False, batch_size=3)
+    pvals = _calculate_pvals(lr_truth, _iter_perm_stats(perms, *idx), _mean)
+
+    np.testing.assert_array_equal(pvals, expected)
+
+
+def test_shared_pvals():
+    from liana.method._pipe_utils._get_mean_perms import _PermutationCache
+
+    lr_res = all_defaults[all_defaults['source'].isin(adata.obs['@label'].cat.categories)]
+    idx = _get_mat_idx(adata, lr_res)
+    lr_truth = _mean((lr_res['ligand_means'].values, lr_res['receptor_means'].values))
+
+    perms = _iter_means_perms(adata=adata, norm_factor=None, agg_fun=_mean,
+                              n_perms=20, seed=1337, n_jobs=1, verbose=False)
+    expected = _calculate_pvals(lr_truth, _iter_perm_stats(perms, *idx), _mean)
+
+    cache = _PermutationCache(adata=adata, n_perms=20, seed=1337, agg_funs={_mean: None, _trimean: None},
+                              n_jobs=2, verbose=False, batch_size=3)
+    null = cache.null('CellPhoneDB', _mean, idx)
+    # the observed scores are registered, and the p-values are returned once scored
+    assert np.isnan(_calculate_pvals(lr_truth, null, _mean)).all()
+    cache.score()
+    np.testing.assert_array_equal(_calculate_pvals(lr_truth, null, _mean), expected)
+    # only the p-values were kept, until returned
+    assert (cache._pending == {}) and (cache._pvals == {})
+
+
+def test_sparse_trimean():
+    from liana.method._pipe_utils._trimean import _sparse_trimean
+
+    label_codes = adata.obs['@label'].cat.codes.values
+    n_labels = adata.obs['@label'].cat.categories.shape[0]
+    X = adata.X.copy()
+    # include negative values, which are sorted below the implicit zeros
+    X.data[::7] *= -1
+
+    expected = np.array([_trimean(X[label_codes == label]) for label in range(n_labels)])
+    np.testing.assert_array_equal(_sparse_trimean(X, label_codes, n_labels), expected)
+
+    rng = np.random.default_rng(0)
+    perm_idxs = [rng.permutation(X.shape[0]) for _ in range(3)]
+    expected = np.array([[_trimean(X[perm_idx[label_codes == label]]) for label in range(n_labels)]
+                         for perm_idx in perm_idxs])
+    np.testing.assert_array_equal(_sparse_trimean(X, label_codes, n_labels, perm_idxs), expected)
@@ -0,0 +1,72 @@
+import numpy as np
+from pandas import DataFrame
+from scipy.stats import gmean
+
+from liana.method._pipe_utils._kernels import _SCORE_KERNELS, _PAIR_KERNELS, _score_lr, \
+    _score_pairs, _exceed_counts
+from liana.method.sc._cellphonedb import _mean
+from liana.method.sc._cellchat import _lr_probability
+from liana.method import cellchat, natmi, connectome, logfc, singlecellsignalr, scseqcomm
+
+rng = np.random.default_rng(1337)
+
+
+def _random_columns(columns, n_rows=500, dtype=np.float32):
+    x = DataFrame({col: rng.random(n_rows).astype(dtype) for col in columns})
+    # zeros, as in unexpressed genes
+    x.iloc[:50] = 0
+    return x
+
+
+def test_score_kernels():
+    for method in [natmi, connectome, logfc, singlecellsignalr, scseqcomm]:
+        assert method.fun in _SCORE_KERNELS
+        columns, _ = _SCORE_KERNELS[method.fun]
+        x = _random_columns(columns)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected = method.fun(x)
+        actual = _score_lr(method, x)
+
+        for exp, act in zip(expected, actual):
+            if exp is None:
+                assert act is None
+            else:
+                np.testing.assert_array_equal(np.asarray(exp), act)
+
+
+def test_pair_kernels():
+    ligand = rng.random(500).astype(np.float32)
+    receptor = rng.random(500).astype(np.float32)
+    ligand[:10] = 0
+
+    for score_fun in [_mean, gmean, _lr_probability]:
+        assert score_fun in _PAIR_KERNELS
+        with np.errstate(divide='ignore'):
+            expected = score_fun((ligand, receptor), axis=0)
+        np.testing.assert_allclose(_score_pairs(score_fun, ligand, receptor), expected, rtol=1e-6)
+
+    # parameters are looked up at each call
+    cellchat._kh = 1
+    try:
+        np.testing.assert_allclose(_score_pairs(_lr_probability, ligand, receptor),
+                                   _lr_probability((ligand, receptor), axis=0), rtol=1e-6)
+    finally:
+        cellchat._kh = 0.5
+
+
+def test_exceed_counts():
+    stats = rng.random((2, 100, 300)).astype(np.float32)
+    lr_truth = rng.random(300).astype(np.float32)
+
+    for score_fun in [_mean, _lr_probability]:
+        expected = np.sum(score_fun(stats, axis=0) >= lr_truth, axis=0)
+        np.testing.assert_array_equal(_exceed_counts(score_fun, stats, lr_truth), expected)
+
+    # observed scores are consistent with the permuted ones
+    lr_truth = _score_pairs(gmean, stats[0, 0], stats[1, 0])
+    assert (_exceed_counts(gmean, stats[:, :1], lr_truth) == 1).all()
+
+    # unregistered functions are scored with numpy
+    expected = np.sum(np.max(stats, axis=0) >= lr_truth, axis=0)
+    np.testing.assert_array_equal(_exceed_counts(np.max, stats, lr_truth), expected)
@@ -108,7 +108,103 @@ def test_expm1_fun():
 
 
 def test_calc_log2fc():
-    adata.layers['normcounts'] = adata.raw.X.copy()
-    adata.layers['normcounts'].data = _expm1_base(V.logbase, adata.raw.X.data)
-    adata.obs['@label'] = adata.obs.bulk_labels
-    np.testing.assert_almost_equal(np.mean(_calc_log2fc(adata, "Dendritic")), -0.123781264)
+    normcounts = adata.raw.X.copy()
+    normcounts.data = _expm1_base(V.logbase, adata.raw.X.data)
+    labels = adata.obs.bulk_labels
+    logfc = _calc_log2fc(normcounts, labels.cat.codes.values, labels.cat.categories.shape[0])
+    np.testing.assert_almost_equal(np.mean(logfc[labels.cat.categories.get_loc("Dendritic")]), -0.123781264)
+
+
+def test_group_stats():
+    from liana.method._pipe_utils._common import _get_group_stats
+    X = adata.raw.X
+    labels = adata.obs[groupby].cat.categories
+    label_codes = adata.obs[groupby].cat.codes.values
+
+    stats = _get_group_stats(X, label_codes, labels.shape[0], moments=True)
+    assert stats['means'].shape == (labels.shape[0], X.shape[1])
+
+    for label_idx in range(labels.shape[0]):
+        temp = X[label_codes == label_idx]
+        assert stats['counts'][label_idx] == temp.shape[0]
+        np.testing.assert_allclose(stats['means'][label_idx], temp.mean(axis=0).A1, rtol=1e-5, atol=1e-6)
+        np.testing.assert_array_equal(stats['props'][label_idx], temp.getnnz(axis=0) / temp.shape[0])
+        np.testing.assert_allclose(stats['sq_sums'][label_idx], temp.power(2).sum(axis=0).A1, rtol=1e-5)
+
+
+def test_join_lr_stats():
+    from pandas import concat, Index
+    from liana.method._pipe_utils._common import _join_stats, _join_lr_stats
+    from liana.method._pipe_utils import filter_resource
+    from liana.resource import select_resource, explode_complexes
+
+    rng = np.random.default_rng(0)
+    labels = Index(['A', 'B', 'C'])
+    var_names = Index(np.sort(adata.raw.var_names))
+    resource = filter_resource(explode_complexes(select_resource()), var_names)
+    label_stats = {'props': rng.random((labels.shape[0], var_names.shape[0])),
+                   'means': rng.random((labels.shape[0], var_names.shape[0]))}
+    dedict = {label: DataFrame({'names': var_names,
+                                'props': label_stats['props'][idx],
+                                'label': label,
+                                'means': label_stats['means'][idx]})
+              for idx, label in enumerate(labels)}
+    pairs = DataFrame(list(product(labels, labels)), columns=['source', 'target'])
+
+    expected = concat([_join_stats(source, target, dedict, resource)
+                       for source, target in zip(pairs['source'], pairs['target'])])
+    lr_res = _join_lr_stats(resource, pairs, label_stats, labels, var_names)
+
+    assert lr_res.shape == expected.shape
+    expected = expected.sort_values(['source', 'target', 'interaction', 'ligand', 'receptor'])
+    lr_res = lr_res.sort_values(['source', 'target', 'interaction', 'ligand', 'receptor'])
+    assert_frame_equal(lr_res[expected.columns].reset_index(drop=True),
+                       expected.reset_index(drop=True), check_dtype=False)
+
+
+def test_filter_reassemble_complexes():
+    from liana.method._pipe_utils._common import _join_lr_stats
+    from liana.method._pipe_utils import filter_resource
+    from liana.resource import select_resource, explode_complexes, filter_reassemble_complexes
+    from liana.resource._reassemble_complexes import _filter_reassemble_grouped
+
+    rng = np.random.default_rng(0)
+    labels = DataFrame(index=['A', 'B', 'C']).index
+    var_names = DataFrame(index=np.sort(adata.raw.var_names)).index
+    resource = filter_resource(explode_complexes(select_resource()), var_names)
+    label_stats = {'props': rng.random((labels.shape[0], var_names.shape[0])),
+                   'means': rng.random((labels.shape[0], var_names.shape[0]))}
+    pairs = DataFrame(list(product(labels, labels)), columns=['source', 'target'])
+    lr_res = _join_lr_stats(resource, pairs, label_stats, labels, var_names)
+
+    key_cols = ['source', 'target', 'ligand_complex', 'receptor_complex']
+    complex_cols = ['ligand_means', 'receptor_means']
+    for return_all_lrs in [False, True]:
+        expected = _filter_reassemble_grouped(lr_res.copy(), key_cols, complex_cols,
+                                              expr_prop=0.3, return_all_lrs=return_all_lrs)
+        reassembled = filter_reassemble_complexes(lr_res.copy(), key_cols, complex_cols,
+                                                  expr_prop=0.3, return_all_lrs=return_all_lrs)
+        assert_frame_equal(reassembled, expected, check_dtype=False)
+
+
+def test_rank_genes_stats():
+    import scanpy as sc
+    from liana.method._pipe_utils._common import _get_group_stats
+    from liana.method._pipe_utils._rank_genes import _rank_genes_stats, _DE_METHODS
+    from liana.method.sc._liana_pipe import _get_rank_genes_stats
+
+    temp = adata.raw.to_adata()
+    temp.obs['@label'] = temp.obs[groupby]
+    labels = temp.obs['@label'].cat.categories
+    label_codes = temp.obs['@label'].cat.codes.values
+    group_stats = _get_group_stats(temp.X, label_codes, labels.shape[0], moments=True)
+
+    for de_method in _DE_METHODS:
+        expected = sc.tl.rank_genes_groups(temp, groupby='@label', method=de_method,
+                                           use_raw=False, copy=True)
+        expected = _get_rank_genes_stats(expected, labels)
+        actual = _rank_genes_stats(temp.X, label_codes, group_stats, method=de_method)
+
+        for col in expected:
+            assert actual[col].dtype == expected[col].dtype
+            np.testing.assert_allclose(actual[col], expected[col], rtol=1e-6, atol=1e-12)
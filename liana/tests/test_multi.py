@@ -3,6 +3,7 @@ from liana.utils._getters import get_factor_scores, get_variable_loadings
 from liana.testing import sample_lrs
 
 import numpy as np
+import pytest
 import pandas as pd
 
 import cell2cell as c2c
@@ -57,6 +58,34 @@ def test_lrs_to_views():
     assert len(mdata.varm_keys())==3
 
 
+def test_lrs_to_views_store(tmp_path):
+    """Test lrs_to_views & to_tensor_c2c with results from a result store."""
+    from liana.method._pipe_utils._store import _ResultStore
+    liana_res = sample_lrs(by_sample=True)
+    samples = liana_res['sample'].cat.categories
+    store = _ResultStore(tmp_path / 'store', sample_key='sample', samples=samples, compact=True)
+    for sample in samples:
+        store.write(sample, liana_res[liana_res['sample'] == sample].drop(columns='sample'))
+
+    kwargs = dict(sample_key='sample', score_key='specificity_rank', obs_keys=['case'],
+                  lr_prop=0.1, lrs_per_sample=0, lrs_per_view=5, samples_per_view=0, min_variance=-1)
+    adata.uns['liana_results'] = liana_res
+    expected = lrs_to_views(adata=adata, uns_key='liana_results', **kwargs)
+    adata.uns['liana_results'] = store.path
+    mdata = lrs_to_views(adata=adata, uns_key='liana_results', **kwargs)
+    assert mdata.shape == expected.shape
+    for view in expected.mod.keys():
+        np.testing.assert_array_equal(mdata.mod[view].X, expected.mod[view].X)
+
+    # missing columns are not silently dropped
+    with pytest.raises(ValueError, match='specificity_rnk'):
+        lrs_to_views(adata=adata, uns_key='liana_results', **{**kwargs, 'score_key': 'specificity_rnk'})
+
+    liana_dict = to_tensor_c2c(liana_res=store.path, sample_key='sample',
+                               score_key='specificity_rank', return_dict=True)
+    assert set(liana_dict.keys()) == set(samples)
+
+
 
 def test_adata_to_views():
     """Test adata_to_views."""
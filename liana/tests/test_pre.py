@@ -21,6 +21,46 @@ def test_prep_check_adata():
     assert len(filt.obs['@label']) == 660
 
 
+def test_prep_check_adata_subset():
+    groupby_subset = ['CD14+ Monocyte', 'Dendritic', 'CD56+ NK', 'CD34+']
+    temp = prep_check_adata(adata=adata, groupby='bulk_labels', min_cells=20,
+                            groupby_subset=groupby_subset, use_raw=True)
+
+    labels = adata.obs['bulk_labels']
+    counts = labels[labels.isin(groupby_subset)].value_counts()
+    msk = labels.isin(counts.index[counts >= 20]).values
+    assert set(temp.obs['@label'].cat.categories) == set(counts.index[counts >= 20])
+    assert temp.obs_names.equals(adata.obs_names[msk])
+
+    # only non-empty features, in alphabetical order
+    raw = adata.raw.to_adata()
+    var_names = np.sort(raw.var_names[raw.X.sum(axis=0).A1 != 0])
+    assert list(temp.var_names) == list(var_names)
+    assert temp.X.dtype == np.float32
+    np.testing.assert_array_equal(temp.X.toarray(), raw[msk, var_names].X.toarray().astype(np.float32))
+
+
+def test_prep_check_adata_var_subset():
+    full = prep_check_adata(adata=adata, groupby='bulk_labels', min_cells=20, use_raw=True)
+    var_subset = full.var_names[::7]
+    temp = prep_check_adata(adata=adata, groupby='bulk_labels', min_cells=20, use_raw=True,
+                            var_subset=var_subset)
+
+    assert temp.var_names.equals(var_subset)
+    np.testing.assert_array_equal(temp.X.toarray(), full[:, var_subset].X.toarray())
+
+    # stats across all features
+    mat_stats = temp.uns['@mat_stats']
+    np.testing.assert_allclose(mat_stats['mat_mean'], np.mean(full.X, dtype=np.float64), rtol=1e-6)
+    assert mat_stats['mat_max'] == full.X.max()
+    label_moments = mat_stats['@label_moments']
+    np.testing.assert_array_equal(label_moments['counts'], full.obs['@label'].value_counts(sort=False))
+    np.testing.assert_allclose(label_moments['sums'],
+                               [full.X.astype(np.float64)[(full.obs['@label'] == label).values].sum()
+                                for label in full.obs['@label'].cat.categories], rtol=1e-10)
+    assert label_moments['n_features'] == full.shape[1]
+
+
 def test_check_if_covered():
     with pytest.raises(ValueError):
         assert_covered(['NOT', 'HERE'], adata.var_names, verbose=True)
@@ -52,3 +92,25 @@ def test_choose_mtx_failure():
     adata.raw = None
     with pytest.raises(ValueError):
         prep_check_adata(adata=adata, groupby='bulk_labels', min_cells=5, use_raw=True)
+
+
+def test_read_backed_rows(tmp_path):
+    from anndata import read_h5ad
+    from liana.method._pipe_utils._pre import _read_backed_rows, _is_backed_mtx
+
+    adata = pbmc68k_reduced()
+    adata.write_h5ad(tmp_path / 'adata.h5ad')
+    backed = read_h5ad(tmp_path / 'adata.h5ad', backed='r')
+    rows = np.sort(np.random.default_rng(0).choice(adata.shape[0], 300, replace=False))
+    cols = np.arange(0, adata.raw.shape[1], 3)
+
+    for X, expected in [(backed.raw.X, adata.raw.X), (backed.X, adata.X)]:
+        assert _is_backed_mtx(X)
+        sub, col_sums, row_sums, row_sq_sums, row_max = _read_backed_rows(X, rows, cols[cols < X.shape[1]], chunk_size=7)
+        expected = np.asarray(expected[rows].todense()) if hasattr(expected, 'todense') else expected[rows]
+        np.testing.assert_array_equal(sub.toarray(), expected[:, cols[cols < X.shape[1]]])
+        np.testing.assert_allclose(col_sums, expected.sum(axis=0, dtype=np.float64), rtol=1e-5)
+        np.testing.assert_allclose(row_sums, expected.sum(axis=1, dtype=np.float64), rtol=1e-5)
+        np.testing.assert_allclose(row_sq_sums, np.square(expected, dtype=np.float64).sum(axis=1), rtol=1e-5)
+        np.testing.assert_array_equal(row_max, expected.max(axis=1))
+    backed.file.close()
@@ -86,3 +86,64 @@ def test_aggregate_on_mdata():
                    verbose=True)
 
     assert mdata.uns['liana_res'].shape == (132, 11)
+
+
+def test_aggregate_shared_perms():
+    from liana.method import cellphonedb, geometric_mean, cellchat
+    methods = [cellphonedb, geometric_mean, cellchat]
+    perm_aggregate = AggregateClass(rank_aggregate._SCORE, methods=methods)
+
+    lrs = perm_aggregate(adata, groupby='bulk_labels', use_raw=True, n_perms=20,
+                         consensus_opts=False, inplace=False)
+
+    keys = ['source', 'target', 'ligand_complex', 'receptor_complex']
+    for method in methods:
+        expected = method(adata, groupby='bulk_labels', use_raw=True, n_perms=20, inplace=False)
+        res = lrs[method.method_name].merge(expected, on=keys, suffixes=('', '_expected'))
+        assert res.shape[0] == expected.shape[0]
+        assert (res[method.specificity] == res[f'{method.specificity}_expected']).all()
+
+
+def test_aggregate_aligned():
+    from functools import reduce
+    from pandas import merge
+    from liana.method._pipe_utils._aggregate import _aggregate, _align_lrs
+
+    key_cols = ['source', 'target', 'ligand_complex', 'receptor_complex']
+    lrs = rank_aggregate(adata, groupby='bulk_labels', use_raw=True, n_perms=2,
+                         inplace=False, consensus_opts=False)
+
+    # equivalent to outer-merging the results of all methods
+    aligned = _align_lrs(lrs, key_cols)
+    merged = reduce(lambda left, right: merge(left, right, how='outer', on=key_cols,
+                                              suffixes=('', '_duplicated')), lrs.values())
+    merged = merged.loc[:, ~merged.columns.str.endswith('_duplicated')]
+    assert_frame_equal(aligned, merged)
+
+    # misaligned keys are merged
+    lrs['CellPhoneDB'] = lrs['CellPhoneDB'].iloc[::-1]
+    assert _align_lrs(lrs, key_cols) is None
+    lr_res = _aggregate(lrs, consensus=rank_aggregate, _key_cols=key_cols)
+    assert lr_res.shape[0] == aligned.shape[0]
+    assert lr_res[key_cols].duplicated().sum() == 0
+
+
+def test_robust_rank_aggregate():
+    import numpy as np
+    from scipy.stats import beta
+    from liana.method._pipe_utils._aggregate import _robust_rank_aggregate
+
+    rng = np.random.default_rng(1337)
+    for k in [1, 3, 6]:
+        rmat = np.column_stack([rng.permutation(1000) + 1. for _ in range(k)])
+        rmat[:10] = 1
+
+        # Kolde et al., 2012
+        norm = np.sort(rmat / np.max(rmat, axis=0), axis=1)
+        dist_a = np.arange(1, k + 1)
+        expected = np.clip(np.min(beta.cdf(norm, dist_a, k - dist_a + 1), axis=1) * k, 0, 1)
+
+        np.testing.assert_allclose(_robust_rank_aggregate(rmat), expected, rtol=1e-12)
+
+    rmat[0, 0] = np.nan
+    assert np.isnan(_robust_rank_aggregate(rmat)).all()
@@ -156,6 +156,86 @@ def test_with_all_lrs():
     assert all(lr_all[~lr_all.lrs_to_keep][natmi.specificity] == min(lr_all[natmi.specificity])) is True
 
 
+def test_analytic_null():
+    from scipy.stats import spearmanr
+    key_cols = ['source', 'target', 'ligand_complex', 'receptor_complex']
+
+    for method, pval_col, min_rho in [(cellphonedb, 'cellphone_pvals', 0.95),
+                                      (geometric_mean, 'gmean_pvals', 0.95),
+                                      (cellchat, 'cellchat_pvals', 0.75)]:
+        perm = method(adata, groupby='bulk_labels', use_raw=True, n_perms=1000, inplace=False)
+        analytic = method(adata, groupby='bulk_labels', use_raw=True, n_perms=1000, inplace=False,
+                          null_distribution='analytic')
+        # scores are unaffected
+        assert perm.drop(columns=pval_col).equals(analytic.drop(columns=pval_col))
+
+        merged = perm.merge(analytic, on=key_cols)
+        pvals = merged[[f'{pval_col}_x', f'{pval_col}_y']].values
+        assert ((pvals[:, 1] >= 0) & (pvals[:, 1] <= 1)).all()
+        assert spearmanr(pvals[:, 0], pvals[:, 1])[0] > min_rho
+
+
+def test_early_stop():
+    for method, pval_col in [(cellphonedb, 'cellphone_pvals'), (cellchat, 'cellchat_pvals')]:
+        full = method(adata, groupby='bulk_labels', use_raw=True, n_perms=100, inplace=False)
+        # never stopped, i.e. equivalent to running all permutations
+        unstopped = method(adata, groupby='bulk_labels', use_raw=True, n_perms=100, inplace=False,
+                           early_stop=101)
+        assert full.equals(unstopped)
+
+        stopped = method(adata, groupby='bulk_labels', use_raw=True, n_perms=100, inplace=False,
+                         early_stop=5)
+        assert full.drop(columns=pval_col).equals(stopped.drop(columns=pval_col))
+        # interactions with less than 5 exceedances are never stopped
+        msk = full[pval_col] < 0.05
+        assert_almost_equal(full[pval_col][msk].values, stopped[pval_col][msk].values)
+        assert ((stopped[pval_col] >= 0.05) == ~msk).all()
+
+
+def test_wrong_null_distribution():
+    from pytest import raises
+    with raises(ValueError):
+        cellphonedb(adata, groupby='bulk_labels', use_raw=True, n_perms=4, null_distribution='bootstrap')
+
+
+def test_compact():
+    from numpy.testing import assert_allclose
+    from liana.method._pipe_utils._results import _expand_res
+
+    expected = natmi(adata, groupby='bulk_labels', use_raw=True, inplace=False)
+    compact = natmi(adata, groupby='bulk_labels', use_raw=True, inplace=False, compact=True)
+
+    assert compact['source'].dtype == 'category'
+    assert compact['spec_weight'].dtype == 'float32'
+
+    actual = _expand_res(compact)
+    for col in ['source', 'target', 'ligand_complex', 'receptor_complex']:
+        assert (actual[col].values == expected[col].values).all()
+    assert_allclose(actual['spec_weight'], expected['spec_weight'], rtol=1e-6)
+
+    by_sample = natmi.by_sample(adata, groupby='bulk_labels', use_raw=True, sample_key='sample',
+                                inplace=False, compact=True)
+    assert by_sample['sample'].dtype == 'category'
+    assert by_sample['ligand_complex'].dtype == 'category'
+
+
+def test_top_n():
+    from pandas.testing import assert_frame_equal
+    from liana.method import rank_aggregate
+
+    liana_res = rank_aggregate(adata, groupby='bulk_labels', use_raw=True, n_perms=10, inplace=False)
+    top_res = rank_aggregate(adata, groupby='bulk_labels', use_raw=True, n_perms=10, inplace=False, top_n=50)
+    assert top_res.shape[0] == 50
+    assert_almost_equal(top_res['magnitude_rank'].values, liana_res['magnitude_rank'].values[:50])
+    assert_frame_equal(top_res, liana_res.loc[top_res.index])
+
+    thresholded = rank_aggregate(adata, groupby='bulk_labels', use_raw=True, n_perms=10, inplace=False,
+                                 score_thresholds={'specificity_rank': 0.05, 'lr_means': 1})
+    expected = liana_res[(liana_res['specificity_rank'] <= 0.05) & (liana_res['lr_means'] >= 1)]
+    assert set(thresholded.index) == set(expected.index)
+    assert_almost_equal(thresholded['magnitude_rank'].values, expected['magnitude_rank'].values)
+
+
 def test_methods_by_sample():
     logfc.by_sample(adata, groupby='bulk_labels', use_raw=True, return_all_lrs=True, sample_key='sample')
     lr_by_sample = adata.uns['liana_res']
@@ -164,6 +244,152 @@ def test_methods_by_sample():
     assert lr_by_sample.shape == (10836, 15)
 
 
+def test_methods_by_sample_parallel():
+    from pandas.testing import assert_frame_equal
+
+    serial = cellphonedb.by_sample(adata, groupby='bulk_labels', use_raw=True, sample_key='sample',
+                                   n_perms=10, inplace=False)
+    parallel = cellphonedb.by_sample(adata, groupby='bulk_labels', use_raw=True, sample_key='sample',
+                                     n_perms=10, n_jobs=2, inplace=False)
+    assert_frame_equal(serial, parallel)
+
+    # each sample is run on its own row slice
+    temp = adata[adata.obs['sample'] == adata.obs['sample'].cat.categories[0]].copy()
+    expected = cellphonedb(temp, groupby='bulk_labels', use_raw=True, n_perms=10, inplace=False)
+    sample_res = serial[serial['sample'] == adata.obs['sample'].cat.categories[0]]
+    assert_frame_equal(sample_res.drop(columns='sample').reset_index(drop=True),
+                       expected.reset_index(drop=True))
+
+
+def test_methods_by_sample_backed(tmp_path):
+    from anndata import read_h5ad
+    from pandas.testing import assert_frame_equal
+    from liana.method import rank_aggregate
+
+    adata.write_h5ad(tmp_path / 'adata.h5ad')
+    backed = read_h5ad(tmp_path / 'adata.h5ad', backed='r')
+
+    # rank_aggregate includes the whole-matrix stats of CellChat & SingleCellSignalR
+    expected = rank_aggregate.by_sample(adata, groupby='bulk_labels', use_raw=True, sample_key='sample',
+                                        n_perms=10, inplace=False)
+    lr_by_sample = rank_aggregate.by_sample(backed, groupby='bulk_labels', use_raw=True, sample_key='sample',
+                                            n_perms=10, inplace=False)
+    assert_frame_equal(lr_by_sample, expected)
+
+    # scSeqComm's cluster stats are taken across all genes, rather than the resource genes
+    expected = scseqcomm.by_sample(adata, groupby='bulk_labels', use_raw=True, sample_key='sample', inplace=False)
+    lr_by_sample = scseqcomm.by_sample(backed, groupby='bulk_labels', use_raw=True, sample_key='sample',
+                                       inplace=False)
+    assert_frame_equal(lr_by_sample, expected)
+    backed.file.close()
+
+
+def test_methods_by_sample_store(tmp_path):
+    import os
+    from pytest import raises
+    from pandas.testing import assert_frame_equal
+    from liana.utils import read_result_store
+
+    store = tmp_path / 'store'
+    expected = natmi.by_sample(adata, groupby='bulk_labels', use_raw=True, sample_key='sample', inplace=False)
+    path = natmi.by_sample(adata, groupby='bulk_labels', use_raw=True, sample_key='sample',
+                           inplace=False, store=store)
+    assert path == str(store)
+    assert_frame_equal(read_result_store(path), expected)
+
+    # only the missing samples are run when resuming
+    files = sorted(f for f in os.listdir(store) if f.endswith('.h5'))
+    os.remove(store / files[0])
+    mtimes = {f: os.path.getmtime(store / f) for f in files[1:]}
+    natmi.by_sample(adata, groupby='bulk_labels', use_raw=True, sample_key='sample', store=store)
+    assert adata.uns['liana_res'] == str(store)
+    assert mtimes == {f: os.path.getmtime(store / f) for f in files[1:]}
+    assert_frame_equal(read_result_store(path), expected)
+
+    columns = ['source', 'target', natmi.magnitude]
+    assert list(read_result_store(path, columns=columns).columns) == ['sample'] + columns
+
+    # results of other parameters are not mixed in the store
+    for kwargs in [dict(expr_prop=0.3), dict(groupby='louvain'), dict(compact=True)]:
+        kwargs = {'groupby': 'bulk_labels', **kwargs}
+        with raises(ValueError, match='different'):
+            natmi.by_sample(adata, use_raw=True, sample_key='sample', store=store, **kwargs)
+
+
+def test_result_store_columns(tmp_path):
+    import numpy as np
+    from pytest import raises
+    from pandas.testing import assert_frame_equal
+    from liana.method._pipe_utils._store import _ResultStore
+
+    lr_res = DataFrame({'source': pandas.Categorical([1, 2, 1]),
+                        'target': pandas.Categorical(['b', 'a', 'b'], categories=['b', 'a'], ordered=True),
+                        'ligand': np.array(['A', None, 'C'], dtype=object),
+                        'score': [0.1, 0.2, 0.3],
+                        'lrs_to_keep': [True, False, True]})
+    store = _ResultStore(tmp_path / 'store', sample_key='sample', samples=['A', 'B'])
+    store.write('A', lr_res)
+    assert_frame_equal(store.read_sample('A'), lr_res)
+
+    # mixed values are not stored as strings
+    with raises(TypeError):
+        store.write('B', DataFrame({'source': np.array([1, 'A'], dtype=object)}))
+    assert store.finished() == ['A']
+
+    # errors before the temporary file is created are raised as they are
+    store.path = str(tmp_path / 'missing')
+    with raises(OSError, match='Unable to'):
+        store.write('A', lr_res)
+
+
+def test_methods_by_groupby():
+    from pandas.testing import assert_frame_equal
+    from liana.method import rank_aggregate
+
+    adata.obs['coarse'] = adata.obs['bulk_labels'].str.split(' ').str[0].astype('category')
+    groupby = ['bulk_labels', 'coarse']
+
+    # rank_aggregate includes the whole-matrix stats of CellChat & SingleCellSignalR
+    rank_aggregate.by_groupby(adata, groupby=groupby, use_raw=True, n_perms=10)
+    lr_by_groupby = adata.uns['liana_res']
+    assert list(lr_by_groupby.keys()) == groupby
+
+    parallel = rank_aggregate.by_groupby(adata, groupby=groupby, use_raw=True, n_perms=10,
+                                         n_jobs=2, inplace=False)
+    for key in groupby:
+        expected = rank_aggregate(adata, groupby=key, use_raw=True, n_perms=10, inplace=False)
+        assert_frame_equal(lr_by_groupby[key], expected)
+        assert_frame_equal(parallel[key], expected)
+    adata.obs.drop(columns='coarse', inplace=True)
+
+
+def test_prepare():
+    from pandas.testing import assert_frame_equal
+
+    pipe = cellphonedb.prepare(adata, groupby='bulk_labels', use_raw=True, n_perms=100)
+    for query in [dict(), dict(expr_prop=0.3), dict(expr_prop=0.05, return_all_lrs=True)]:
+        expected = cellphonedb(adata, groupby='bulk_labels', use_raw=True, n_perms=100, inplace=False, **query)
+        assert_frame_equal(pipe(**query), expected)
+    # the permuted aggregates fit, and are kept
+    assert pipe._perm_cache._aggs is not None
+
+    # else, the permutations are run for each query
+    streamed = cellphonedb.prepare(adata, groupby='bulk_labels', use_raw=True, n_perms=100, max_perm_cache=0)
+    assert_frame_equal(streamed(expr_prop=0.3), pipe(expr_prop=0.3))
+    assert streamed._perm_cache is None
+
+    # subsets of the prepared interactions & pairs are only filtered
+    liana_res = pipe()
+    interactions = list(liana_res[['ligand_complex', 'receptor_complex']].drop_duplicates()
+                        .itertuples(index=False, name=None))[:10]
+    pairs = DataFrame({'source': ['CD14+ Monocyte', 'Dendritic'], 'target': ['Dendritic', 'Dendritic']})
+    sub_res = pipe(interactions=interactions, groupby_pairs=pairs)
+    expected = liana_res.merge(pairs).merge(DataFrame(interactions, columns=['ligand_complex', 'receptor_complex']))
+    keys = ['source', 'target', 'ligand_complex', 'receptor_complex']
+    assert_frame_equal(sub_res.sort_values(keys).reset_index(drop=True),
+                       expected.sort_values(keys).reset_index(drop=True))
+
+
 def test_methods_on_mdata():
     from liana.testing._sample_anndata import generate_toy_mdata
     from itertools import product
@@ -1,4 +1,5 @@
 from liana.resource.select_resource import _handle_resource, select_resource
+from pandas.testing import assert_frame_equal
 import pytest
 
 def test_select_interactions():
@@ -63,3 +64,43 @@ def test_resource_exception_xy():
                          y_name='y',
                          verbose=True,
                          )
+
+
+def test_select_exploded():
+    from liana.resource import explode_complexes
+    from liana.resource.select_resource import _select_exploded
+
+    resource = select_resource('CellChatDB')
+    exploded = _select_exploded('cellchatdb')
+    assert_frame_equal(exploded, explode_complexes(resource))
+
+    exploded = _handle_resource(resource_name='cellchatdb', explode=True, verbose=False)
+    assert exploded is not _select_exploded('cellchatdb')
+    assert exploded.shape[0] > resource.shape[0]
+
+
+def test_compiled_store():
+    import numpy as np
+    from liana.resource.select_resource import _compile_store, _load_store, _RESOURCE_PATH
+
+    compiled = _compile_store(_RESOURCE_PATH)
+    store = _load_store()
+    assert compiled.keys() == store.keys()
+    for key in compiled.keys():
+        np.testing.assert_array_equal(compiled[key], store[key])
+
+
+def test_stale_store(tmp_path):
+    from liana.resource.select_resource import _write_store, _read_store, _hash_file, _RESOURCE_PATH
+
+    resource_path, store_path = tmp_path / 'resource.csv', tmp_path / 'resource.npz'
+    resource_path.write_text(_RESOURCE_PATH.read_text())
+    _write_store(resource_path, store_path)
+    assert str(_read_store(store_path, resource_path)['source_sha256']) == _hash_file(resource_path)
+
+    # an edit of the same size is not served from the (stale) store
+    text = resource_path.read_text()
+    assert 'TGFB1' in text
+    resource_path.write_text(text.replace('TGFB1', 'TGFBX', 1))
+    store = _read_store(store_path, resource_path)
+    assert 'TGFBX' in store['ligand_categories']
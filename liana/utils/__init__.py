@@ -5,3 +5,4 @@ from liana.utils.spatial_neighbors import spatial_neighbors
 from liana.utils._getters import get_factor_scores, get_variable_loadings
 from liana.utils.query_bandwidth import query_bandwidth
 from liana.utils.interpolate_adata import interpolate_adata
+from liana.utils.read_result_store import read_result_store
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from pandas import DataFrame
+
+from liana.method._pipe_utils._store import _ResultStore
+
+
+def read_result_store(path: str,
+                      samples: list | None = None,
+                      columns: list | None = None
+                      ) -> DataFrame:
+    """
+    Read the results of a method run by sample, from the store to which they were written.
+
+    Parameters
+    ----------
+    path
+        Path of the store, as passed to `by_sample`.
+    samples
+        Samples to be read. If None, all samples in the store are read.
+    columns
+        Columns to be read, besides the sample column. If None, all columns are read.
+
+    Returns
+    -------
+    A long-format DataFrame with the results of each sample, as returned by `by_sample`.
+    """
+    return _ResultStore(path).read(samples=samples, columns=columns)